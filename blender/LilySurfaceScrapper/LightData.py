@@ -16,10 +16,10 @@ class LightData(ScrappedData):
 
     @classmethod
     def makeScrapper(cls, url):
-        for S in ScrappersManager.getScrappersList():
-            if 'LIGHT' in S.scrapped_type and S.canHandleUrl(url):
-                return S()
-        return None
+        S = ScrappersManager.findScrapper(url, 'LIGHT')
+        if S is None:
+            return None
+        return S()
 
     def createLights(self):
         """Implement this in derived classes"""
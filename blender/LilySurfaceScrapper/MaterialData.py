@@ -52,11 +52,11 @@ class MaterialData(ScrappedData):
 
     @classmethod
     def makeScrapper(cls, url):
-        for S in ScrappersManager.getScrappersList():
-            if 'MATERIAL' in S.scrapped_type and S.canHandleUrl(url):
-                print("Using scrapper '{}'".format(S.__name__))
-                return S()
-        return None
+        S = ScrappersManager.findScrapper(url, 'MATERIAL')
+        if S is None:
+            return None
+        print("Using scrapper '{}'".format(S.__name__))
+        return S()
     
     def loadImages(self):
         """This is not needed by createMaterial, but is called when
@@ -22,6 +22,9 @@
 # from a single URL
 
 from .settings import UNSUPPORTED_PROVIDER_ERR
+from .prefetch import PrefetchJob, getVariantHistory
+from .scheduler import getDownloadScheduler, PRIORITY_PREFETCH
+from .aio import runCancellable
 
 class ScrappedData():
     """Internal representation of materials and worlds, responsible on one side for
@@ -37,20 +40,26 @@ class ScrappedData():
         """Implement in subclasses to (re)init specific data"""
         pass
 
-    def __init__(self, url, texture_root=""):
+    def __init__(self, url, texture_root="", config=None):
         """url: Base url to scrap
         texture_root: root directory where to store downloaded textures
+        config: settings of the scrapper (see config.Config), None for the default ones
         """
         self.url = url
         self.texture_root = texture_root
+        self.config = config
         self.error = None
         self._variants = None
         self._scrapper = type(self).makeScrapper(url)
         self.reinstall = False
+        self._prefetch = None
+        # Whether the variant list was read from disk rather than fetched
+        self._listing_from_disk = False
         if self._scrapper is None:
             self.error = UNSUPPORTED_PROVIDER_ERR
         else:
             self._scrapper.texture_root = texture_root
+            self._scrapper.config = config
         self.reset()
 
     def getVariantList(self):
@@ -58,11 +67,35 @@ class ScrappedData():
             return None
         if self._variants is not None:
             return self._variants
+        listing = self._scrapper.loadListing(self.url)
+        if listing is not None:
+            self._variants, age = listing
+            self._listing_from_disk = True
+            if age > self._scrapper.response_ttl:
+                self._refreshListing()
+            return self._variants
+        return self._fetchVariantList()
+
+    def _fetchVariantList(self):
+        self._listing_from_disk = False
         self._variants = self._scrapper.fetchVariantList(self.url)
         if self._variants is None:
             self.error = self._scrapper.error
+        else:
+            self._scrapper.saveListing(self.url, self._variants)
         return self._variants
 
+    def _refreshListing(self):
+        """List variants again in the background, so that the next import
+        uses an up to date listing while this one does not wait for it"""
+        scrapper = self._scrapper.makePrefetchScrapper()
+        url = self.url
+        def refresh():
+            variants = scrapper.fetchVariantList(url)
+            if variants is not None:
+                scrapper.saveListing(url, variants)
+        getDownloadScheduler().submit(url, refresh, priority=PRIORITY_PREFETCH)
+
     def isDownloaded(self, variantName):
         return self._scrapper.isDownloaded(variantName)
 
@@ -74,14 +107,86 @@ class ScrappedData():
             return False
         if self._variants is None:
             self.getVariantList()
+        if self._prefetch is not None:
+            self._prefetch.cancel()
+            self._prefetch = None
+        self._scrapper.updated_files = []
+        self._scrapper.error = None
         if not self._scrapper.fetchVariant(variant_index, self, reinstall=self.reinstall):
-            return False
+            if not self._listing_from_disk:
+                return False
+            # The saved listing may be outdated, e.g. links that changed
+            variant_name = self._variants[variant_index]
+            if not self._fetchVariantList() or variant_name not in self._variants:
+                return False
+            variant_index = self._variants.index(variant_name)
+            self._scrapper.error = None
+            if not self._scrapper.fetchVariant(variant_index, self, reinstall=self.reinstall):
+                return False
+        self._scrapper.touchVariant(self.name)
+        if self._scrapper.error is None:
+            self._scrapper.recordVariant(self.name)
+        if self._variants and len(self._variants) > 1:
+            getVariantHistory().record(self._variants[variant_index])
         return True
 
-    def setReinstall(self, value):
-        self.reinstall = value
-        return True
+    def prefetch(self, budget):
+        """Start downloading in the background what selectVariant will likely
+        need, while the user picks a variant. budget is the maximum number of
+        bytes that unused prefetched variants may take."""
+        if self.error is not None or self._variants is None or self._prefetch is not None:
+            return
+        self._prefetch = PrefetchJob(self._scrapper, self._variants, budget)
+        self._prefetch.start()
+
+    async def getVariantListAsync(self):
+        return await runCancellable(self.cancel, self.getVariantList)
+
+    async def selectVariantAsync(self, variant_index):
+        return await runCancellable(self.cancel, self.selectVariant, variant_index)
 
     def setReinstall(self, value):
         self.reinstall = value
         return True
+
+    def getUpdatedFiles(self):
+        """Files whose content changed when reinstalling the last selected variant"""
+        if self._scrapper is None:
+            return []
+        return self._scrapper.updated_files
+
+    def exportResult(self):
+        """What selecting a variant found, for applyResult to fill a copy of
+        this data in another process"""
+        return {
+            "name": self.name,
+            "maps": dict(self.maps),
+            "variants": self._variants,
+            "scrapper_error": self.getScrapperError(),
+            "updated_files": self.getUpdatedFiles(),
+        }
+
+    def applyResult(self, result):
+        if result.get("variants") is not None:
+            self._variants = result["variants"]
+        self.name = result.get("name", self.name)
+        self.maps.update(result.get("maps", {}))
+        if self._scrapper is not None:
+            if result.get("variants") is not None:
+                # Saved by the other process, tells which variants are downloaded
+                self._scrapper.loadListing(self.url)
+            self._scrapper.error = result.get("scrapper_error")
+            self._scrapper.updated_files = result.get("updated_files", [])
+
+    def getScrapperError(self):
+        """Error reported by the scrapper during the last variant selection"""
+        if self._scrapper is None:
+            return None
+        return self._scrapper.error
+
+    def cancel(self):
+        """Interrupt downloads running in another thread for this data"""
+        if self._prefetch is not None:
+            self._prefetch.cancel()
+        if self._scrapper is not None:
+            self._scrapper.cancel()
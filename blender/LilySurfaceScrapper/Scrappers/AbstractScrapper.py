@@ -22,18 +22,34 @@
 # from a single URL
 
 import os
+import re
+import copy
+import time
 import string
+import hashlib
+import threading
+from concurrent.futures import CancelledError
 
 import sys
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "site-packages"))
 from lxml import etree
 
-import requests
-import shutil
 import json
 
-from ..settings import TEXTURE_DIR
-from ..preferences import getPreferences
+from ..settings import TEXTURE_DIR, TEXTURE_STORE_DIR, RESPONSE_CACHE_TTL
+from ..config import getConfig as getDefaultConfig
+from .. import sessions
+from ..downloads import downloadFile, isModified, DownloadCancelled
+from ..scheduler import getDownloadScheduler, PRIORITY_INTERACTIVE, PRIORITY_THUMBNAIL, PRIORITY_PREFETCH
+from ..responsecache import ResponseCache
+from ..aio import runOnScheduler, runCancellable
+from ..telemetry import getMetricsRegistry
+from ..singleflight import getSingleFlight, flightKey
+from ..blobstore import getBlobStore
+from ..cachemanager import CacheManager
+from ..catalog import getCatalog
+from ..filelock import DirectoryLock, holdsLock
+from .. import manifest
 
 class AbstractScrapper():
     # Can be 'MATERIAL', 'WORLD', 'LIGHT'
@@ -44,66 +60,144 @@ class AbstractScrapper():
     home_url = None
     # The home directory of the scraper
     home_dir = "Abstract"
+    # Hosts of the URLs this scrapper handles (lower case, without "www."),
+    # and a regular expression that these URLs match from their start. They
+    # are used to route URLs to scrappers without calling every canHandleUrl,
+    # see ScrappersManager.findScrapper. Scrappers that do not handle URLs of
+    # given hosts (e.g. local paths) leave them empty and implement canHandleUrl.
+    url_hosts = ()
+    url_pattern = None
+    # Time in seconds during which scrapped pages are reused without asking the source
+    response_ttl = RESPONSE_CACHE_TTL
+    # Names of the attributes set by fetchVariantList that fetchVariant needs.
+    # When provided, and JSON serializable, they are saved in the metadata file
+    # of the asset so that the asset can be imported again without listing its
+    # variants from the network, see saveListing.
+    listing_state = None
 
     metadataFilename = ".metadata"
-    savedVariants = None
 
     @classmethod
     def canHandleUrl(cls, url):
-        raise NotImplementedError
+        """Return true if the URL can be scrapped by this scrapper.
+        Must not use the network, see fetchVariantList for that."""
+        if cls.url_pattern is None:
+            raise NotImplementedError
+        return re.match(cls.url_pattern, url) is not None
 
-    def __init__(self, texture_root=""):
+    def __init__(self, texture_root="", config=None):
         self._base_name = None
         self._thumbnailUrl = None
         self.error = None
         self.texture_root = texture_root
+        # Settings, see config.Config, or None to use the default ones
+        self.config = config
+        self._cancel_event = threading.Event()
+        # Priority class of the downloads of this scrapper in the scheduler
+        self.download_priority = PRIORITY_INTERACTIVE
+        # Optional function called with the size of each downloaded chunk, see downloads.downloadFile
+        self.download_meter = None
+        # Files whose content changed during the last reinstall
+        self.updated_files = []
+
+    def cancel(self):
+        """Ask running downloads to stop as soon as possible. They raise
+        DownloadCancelled in the thread that started them."""
+        self._cancel_event.set()
+
+    def makePrefetchScrapper(self):
+        """Copy of this scrapper, once its variant list is fetched, that
+        downloads at prefetch priority and can be cancelled on its own"""
+        scrapper = copy.copy(self)
+        scrapper.error = None
+        scrapper.updated_files = []
+        scrapper.download_priority = PRIORITY_PREFETCH
+        scrapper._cancel_event = threading.Event()
+        return scrapper
+
+    def _recordFetch(self, url_class, url, start_time, nbytes=0, path=None, retries=0, cache_hit=False):
+        """Report a fetch to the metrics registry, path is used to measure the
+        size of downloaded files"""
+        if path is not None and os.path.isfile(path):
+            nbytes = os.path.getsize(path)
+        provider = self.source_name if self is not None else __class__.source_name
+        getMetricsRegistry().record(provider, url_class, url, nbytes=nbytes,
+                                    duration=time.perf_counter() - start_time,
+                                    retries=retries, cache_hit=cache_hit)
 
     @classmethod
     def _fetch(cls, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-        r = requests.get(url if "https://" in url else "https://" + url, headers=headers)
+        r = sessions.get(url if "https://" in url else "https://" + url)
         if r.status_code != 200:
             return None
         else:
             return r
 
+    def _fetchText(self, url):
+        """Get the text of a page, through the response cache unless called
+        without an instance (e.g. from a classmethod). Return None and set
+        self.error if the page could not be found or reached."""
+        start_time = time.perf_counter()
+        try:
+            if self is None:
+                r = __class__._fetch(url)
+                text, cache_hit = (r.text if r is not None else None), False
+            else:
+                url = url if "https://" in url else "https://" + url
+                cache = ResponseCache(self.getTextureDirectory(os.path.join(".cache", "http")))
+                text, cache_hit = cache.fetchText(url, self.response_ttl)
+        except sessions.requests.exceptions.RequestException as err:
+            if self is None:
+                raise
+            self.error = "Could not reach {}: {}".format(url, err)
+            return None
+        __class__._recordFetch(self, "page", url, start_time,
+                               nbytes=len(text) if text is not None else 0, cache_hit=cache_hit)
+        if text is None and self is not None:
+            self.error = "URL not found: {}".format(url)
+        return text
+
     def fetchHtml(self, url):
         """Get a lxml.etree object representing the scrapped page.
         Use xpath queries to browse it."""
-        r = __class__._fetch(url)
-        if r is not None:
-            return etree.HTML(r.text)
-        else:
-            self.error = "URL not found: {}".format(url)
+        text = __class__._fetchText(self, url)
+        if text is not None:
+            return etree.HTML(text)
 
     def fetchJson(self, url):
-        r = __class__._fetch(url)
-        if r is not None:
-            return r.json()
-        else:
-            self.error = "URL not found: {}".format(url)
+        text = __class__._fetchText(self, url)
+        if text is not None:
+            return json.loads(text)
 
     def fetchXml(self, url):
         """Get a lxml.etree object representing the scrapped page.
         Use xpath queries to browse it."""
-        r = __class__._fetch(url)
-        if r is not None:
-            return etree.fromstring(r.text)
-        else:
-            self.error = "URL not found: {}".format(url)
+        text = __class__._fetchText(self, url)
+        if text is not None:
+            return etree.fromstring(text)
 
     def getRedirection(self, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
+        start_time = time.perf_counter()
         url = url if "https://" in url else "https://" + url
-        r = requests.get(url, headers=headers, allow_redirects=False)
+        try:
+            r = sessions.get(url, allow_redirects=False)
+        except sessions.requests.exceptions.RequestException as err:
+            if self is None:
+                raise
+            self.error = "Could not reach {}: {}".format(url, err)
+            return None
+        __class__._recordFetch(self, "redirect", url, start_time, retries=r.retries)
         if r.status_code == 302:
             return r.headers.get("Location")
         else:
             return None
 
+    def getConfig(self):
+        return self.config if self.config is not None else getDefaultConfig()
+
     def getTextureDirectory(self, material_name):
         """Return the texture dir, relative to the blend file, dependent on material's name"""
-        texture_dir = getPreferences().texture_dir
+        texture_dir = self.getConfig().texture_dir
         if texture_dir == "":
             texture_dir = TEXTURE_DIR
         if texture_dir.startswith("//"):
@@ -116,56 +210,249 @@ class AbstractScrapper():
             os.makedirs(dirpath)
         return dirpath
 
-    def fetchImage(self, url, material_name, map_name, force_ext=False, reinstall=False):
-        """Utility helper for download textures"""
+    def getBlobStore(self):
+        """Return the store in which downloaded maps are deduplicated, or None
+        if deduplication is disabled"""
+        config = self.getConfig()
+        if not config.use_texture_store:
+            return None
+        store_dir = config.texture_store_dir or TEXTURE_STORE_DIR
+        return getBlobStore(os.path.abspath(os.path.expanduser(store_dir)))
+
+    def storeFile(self, path, digest=None):
+        """Move a downloaded file into the blob store, leaving a link in place"""
+        store = self.getBlobStore()
+        if store is None:
+            return
+        try:
+            store.ingest(path, digest)
+        except OSError as err:
+            print("Could not deduplicate {}: {}".format(path, err))
+
+    def recordFile(self, path, url, stats, member=None, directory=None):
+        """Add a downloaded file to the manifest of its directory, or of
+        directory if given, then deduplicate it. stats holds the size, sha256
+        and optional etag and last_modified reported by downloadFile."""
+        if directory is None:
+            directory = os.path.dirname(path)
+        filename = os.path.relpath(path, directory).replace(os.path.sep, "/")
+        manifest.updateManifest(directory, filename, url, stats["size"], stats["sha256"],
+                                etag=stats.get("etag"), last_modified=stats.get("last_modified"), member=member)
+        catalog = self.getCatalog()
+        key = catalog.splitPath(directory)
+        if key is not None:
+            catalog.recordFile(*key, filename, stats["size"], stats["sha256"], url)
+        self.storeFile(path, stats["sha256"])
+
+    def getManifestEntry(self, path):
+        """Manifest entry of a file downloaded in its own directory, or None"""
+        return (manifest.loadManifest(os.path.dirname(path)) or {}).get(os.path.basename(path))
+
+    def isModified(self, path, url):
+        """Whether the file at path, previously downloaded from url, must be
+        downloaded again, either because the server tells that it changed or
+        because we cannot tell (no validators recorded, no answer)"""
+        entry = self.getManifestEntry(path)
+        if entry is None or entry["url"] != url:
+            return True
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            return True
+        try:
+            return isModified(url, entry.get("etag"), entry.get("last_modified")) is not False
+        except sessions.requests.exceptions.RequestException as err:
+            print("Could not revalidate {}: {}".format(url, err))
+            return True
+
+    def recordUpdate(self, path, previous_entry, sha256):
+        """Report a reinstalled file in self.updated_files if its content changed"""
+        if previous_entry is None or previous_entry["sha256"] != sha256:
+            self.updated_files.append(path)
+
+    def lockDirectory(self, directory):
+        """Lock guarding downloads into directory from other processes"""
+        return DirectoryLock(directory, cancel=self._cancel_event)
+
+    def getCatalog(self):
+        return getCatalog(self.getTextureDirectory(""))
+
+    def recordVariant(self, material_name):
+        """Record in the catalog that the variant whose maps are in the
+        texture directory of material_name is completely downloaded"""
+        catalog = self.getCatalog()
+        key = catalog.splitPath(self.getVariantDirectory(material_name))
+        if key is not None:
+            catalog.recordVariant(*key)
+
+    def recordAsset(self, matName, url=None, thumbnail=None):
+        self.getCatalog().recordAsset(self.home_dir, matName, url=url, thumbnail=thumbnail)
+
+    def getCacheManager(self):
+        store = self.getBlobStore()
+        return CacheManager(self.getTextureDirectory(""), store.directory if store is not None else None)
+
+    def getVariantDirectory(self, material_name):
+        """Directory of a variant whose maps were downloaded, without creating it"""
+        return os.path.join(self.getTextureDirectory(""), material_name.replace('/', os.path.sep))
+
+    def touchVariant(self, material_name):
+        """Record that the variant whose maps are in the texture directory of
+        material_name was just used, for the cache quota"""
+        variant_dir = self.getVariantDirectory(material_name)
+        if os.path.isdir(variant_dir):
+            self.getCacheManager().touch(variant_dir)
+
+    def _downloadFile(self, url, path, url_class="map", reinstall=True, store=True):
+        """Download url into path, return False if the file could not be found.
+        Concurrent calls for the same url and path share a single transfer.
+        If reinstall is False, a file that appeared at path meanwhile is kept,
+        otherwise an existing file is only downloaded again if it changed.
+        If store is True, the file is added to the manifest of its directory
+        and deduplicated in the blob store, otherwise it is a temporary file."""
+        def download():
+            # Another process may have downloaded it while we waited for the lock
+            with self.lockDirectory(os.path.dirname(path)):
+                if os.path.isfile(path) and (not reinstall or not self.isModified(path, url)):
+                    return True, None
+                previous_entry = self.getManifestEntry(path) if reinstall else None
+                print("Downloading {}...".format(url))
+                stats = {}
+                ok = downloadFile(url, path, cancel=self._cancel_event, stats=stats, priority=self.download_priority,
+                                  meter=self.download_meter)
+                if ok and store:
+                    self.recordFile(path, url, stats)
+                if ok and reinstall:
+                    self.recordUpdate(path, previous_entry, stats["sha256"])
+                return ok, stats.get("retries", 0)
+
+        start_time = time.perf_counter()
+        while True:
+            if holdsLock(os.path.dirname(path)):
+                # No other thread can write there, and one waiting for the
+                # lock in a flight we would join could not end
+                (ok, retries), shared = download(), False
+                break
+            try:
+                (ok, retries), shared = getSingleFlight().do(flightKey(url, path), download)
+                break
+            except DownloadCancelled:
+                # Retry if it is the scrapper we were waiting for that got cancelled
+                if self._cancel_event.is_set():
+                    raise
+        if shared or retries is None:
+            self._recordFetch(url_class, url, start_time, path=path, cache_hit=True)
+        else:
+            self._recordFetch(url_class, url, start_time, path=path, retries=retries)
+        return ok
+
+    def _useCached(self, url, path, url_class="map"):
+        print("Using cached {}.".format(url))
+        self._recordFetch(url_class, url, time.perf_counter(), path=path, cache_hit=True)
+
+    def _imagePath(self, url, material_name, map_name, force_ext=False):
         root = self.getTextureDirectory(material_name)
         if not force_ext:
             ext = os.path.splitext(url)[1]
             map_name = map_name + ext
-        path = os.path.join(root, map_name)
+        return os.path.join(root, map_name)
+
+    def fetchImage(self, url, material_name, map_name, force_ext=False, reinstall=False, url_class="map"):
+        """Utility helper for download textures"""
+        path = self._imagePath(url, material_name, map_name, force_ext)
         if os.path.isfile(path) and not reinstall:
-            print("Using cached {}.".format(url))
-        else:
-            print("Downloading {}...".format(url))
-            headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-            r = requests.get(url, stream=True, headers=headers)
-            if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    r.raw.decode_content = True
-                    shutil.copyfileobj(r.raw, f)
-            else:
-                self.error = "URL not found: {}".format(url)
-                return None
+            self._useCached(url, path, url_class)
+        elif not self._downloadFile(url, path, url_class, reinstall=reinstall):
+            self.error = "URL not found: {}".format(url)
+            return None
         return path
 
+    def fetchImages(self, material_name, map_urls, force_ext=False, reinstall=False):
+        """Download several maps of the same variant at once.
+        map_urls is a dict mapping map names to urls, and the returned dict
+        maps the same names to the downloaded paths, or None for maps that
+        could not be downloaded, in which case self.error lists them all."""
+        scheduler = getDownloadScheduler()
+        paths = {}
+        futures = {}
+        errors = []
+        # Another process may have downloaded some maps while we waited for the lock
+        with self.lockDirectory(self.getTextureDirectory(material_name)) as lock:
+            for map_name, url in map_urls.items():
+                path = self._imagePath(url, material_name, map_name, force_ext)
+                paths[map_name] = path
+                if os.path.isfile(path) and not reinstall:
+                    self._useCached(url, path)
+                else:
+                    futures[map_name] = scheduler.submit(url, lock.share(self._downloadFile), url, path,
+                                                         reinstall=reinstall, priority=self.download_priority)
+
+            for map_name, future in futures.items():
+                if self._cancel_event.is_set():
+                    future.cancel()
+                try:
+                    ok = future.result()
+                except (DownloadCancelled, CancelledError):
+                    ok = False
+                except Exception as err:
+                    ok = False
+                    print("Error while downloading {}: {}".format(map_urls[map_name], err))
+                if not ok:
+                    paths[map_name] = None
+                    errors.append("URL not found: {}".format(map_urls[map_name]))
+        if self._cancel_event.is_set():
+            raise DownloadCancelled(material_name)
+        if errors:
+            self.error = "\n".join(errors)
+        return paths
+
     def fetchZip(self, url, material_name, zip_name):
         """Utility helper for download textures"""
         root = self.getTextureDirectory(material_name)
         path = os.path.join(root, zip_name)
         if os.path.isfile(path):
-            print("Using cached {}.".format(url))
-        else:
-            print("Downloading {}...".format(url))
-            headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-            r = requests.get(url, stream=True, headers=headers)
-            if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    r.raw.decode_content = True
-                    shutil.copyfileobj(r.raw, f)
-            else:
-                self.error = "URL not found: {}".format(url)
-                return None
+            self._useCached(url, path, "archive")
+        elif not self._downloadFile(url, path, "archive", reinstall=False, store=False):
+            self.error = "URL not found: {}".format(url)
+            return None
         return path
 
-    def fetchText(self, url, material_name, filename):
+    def fetchText(self, url, material_name, filename, reinstall=False):
+        """Download a text file, return its path or None if it could not be downloaded"""
         root = self.getTextureDirectory(material_name)
         path = os.path.join(root, filename)
-        if os.path.isfile(path):
+        if os.path.isfile(path) and not reinstall:
+            self._recordFetch("text", url, time.perf_counter(), path=path, cache_hit=True)
             return path
-        data = self._fetch(url)
-        with open(path, "wb") as f:
-            f.write(data.content)
-        data.close()
+        def download():
+            with self.lockDirectory(root):
+                if os.path.isfile(path) and (not reinstall or not self.isModified(path, url)):
+                    return True, False
+                previous_entry = self.getManifestEntry(path) if reinstall else None
+                data = self._fetch(url)
+                if data is None:
+                    return False, False
+                # Write to a temporary file first so that a partial write is never
+                # mistaken for a cached file
+                with open(path + ".part", "wb") as f:
+                    f.write(data.content)
+                data.close()
+                os.replace(path + ".part", path)
+                stats = {
+                    "size": len(data.content),
+                    "sha256": hashlib.sha256(data.content).hexdigest(),
+                    "etag": data.headers.get("ETag"),
+                    "last_modified": data.headers.get("Last-Modified"),
+                }
+                self.recordFile(path, url, stats)
+                if reinstall:
+                    self.recordUpdate(path, previous_entry, stats["sha256"])
+                return True, True
+
+        start_time = time.perf_counter()
+        (ok, downloaded), shared = getSingleFlight().do(flightKey(url, path), download)
+        if not ok:
+            self.error = "URL not found: {}".format(url)
+            return None
+        self._recordFetch("text", url, start_time, path=path, cache_hit=shared or not downloaded)
         return path
 
     def clearString(self, s):
@@ -186,11 +473,69 @@ class AbstractScrapper():
         raise NotImplementedError
 
 
+    def prefetchPages(self):
+        """Fetch the pages that fetchVariant needs for any variant, so that
+        they are in the response cache when the user picks one. Called in the
+        background after fetchVariantList when prefetching is enabled."""
+        pass
+
+    # Coroutine versions of the methods above, see aio. Single requests wait
+    # for a slot on the download scheduler, the others run on worker threads.
+    # They work for any scrapper, including third-party ones that only
+    # implement the synchronous API.
+
+    def _slotUrl(self, url):
+        return url if "https://" in url else "https://" + url
+
+    async def fetchHtmlAsync(self, url):
+        return await runOnScheduler(self._slotUrl(url), self.fetchHtml, url, priority=self.download_priority)
+
+    async def fetchJsonAsync(self, url):
+        return await runOnScheduler(self._slotUrl(url), self.fetchJson, url, priority=self.download_priority)
+
+    async def fetchXmlAsync(self, url):
+        return await runOnScheduler(self._slotUrl(url), self.fetchXml, url, priority=self.download_priority)
+
+    async def getRedirectionAsync(self, url):
+        return await runOnScheduler(self._slotUrl(url), self.getRedirection, url, priority=self.download_priority)
+
+    async def fetchImageAsync(self, url, material_name, map_name, force_ext=False, reinstall=False):
+        return await runCancellable(self.cancel, self.fetchImage, url, material_name, map_name,
+                                    force_ext=force_ext, reinstall=reinstall)
+
+    async def fetchImagesAsync(self, material_name, map_urls, force_ext=False, reinstall=False):
+        return await runCancellable(self.cancel, self.fetchImages, material_name, map_urls,
+                                    force_ext=force_ext, reinstall=reinstall)
+
+    async def fetchZipAsync(self, url, material_name, zip_name):
+        return await runCancellable(self.cancel, self.fetchZip, url, material_name, zip_name)
+
+    async def fetchTextAsync(self, url, material_name, filename, reinstall=False):
+        return await runCancellable(self.cancel, self.fetchText, url, material_name, filename, reinstall=reinstall)
+
+    async def fetchVariantListAsync(self, url):
+        """Coroutine version of fetchVariantList. Use one scrapper instance
+        per asset when listing several assets concurrently."""
+        return await runCancellable(self.cancel, self.fetchVariantList, url)
+
+    async def fetchVariantAsync(self, variant_index, material_data, reinstall=False):
+        return await runCancellable(self.cancel, self.fetchVariant, variant_index, material_data, reinstall)
+
     def isDownloaded(self, variantName):
-        """Return True or False based on if the given variant name is present on the system
-        this should be done by checking against savedVariants which should be a dict, and should be populated if None.
-        """
-        raise NotImplementedError
+        """Return True or False based on if the given variant name is present on the system,
+        according to the download catalog and to the manifest of the variant, so that
+        variants with missing or truncated files get downloaded again. Override if
+        variants are not stored in the texture directory of the asset."""
+        if self._base_name is None:
+            return False
+        catalog = self.getCatalog()
+        if not catalog.isDownloaded(self.home_dir, self._base_name, variantName):
+            return False
+        variant_dir = self.getVariantDirectory(os.path.join(self.home_dir, self._base_name, variantName))
+        if not manifest.isComplete(variant_dir):
+            catalog.removeVariant(self.home_dir, self._base_name, variantName)
+            return False
+        return True
 
     def createMetadetaFile(self, url, matName, variants: list):
         """create a metadata file with the link of the item so that it can be called upon for thumbnails"""
@@ -199,19 +544,72 @@ class AbstractScrapper():
         if not os.path.isfile(metadataPath):
             with open(metadataPath, "w") as metadata:
                 json.dump({"url": url, "variants": variants}, metadata)
+        self.recordAsset(matName, url=url)
 
         return metadataPath
 
+    def _listingIndexPath(self, url):
+        """File telling in which asset directory the listing of url is saved"""
+        index_dir = self.getTextureDirectory(os.path.join(".cache", "listings"))
+        return os.path.join(index_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def saveListing(self, url, variants):
+        """Save the result of fetchVariantList in the metadata file of the asset"""
+        if self.listing_state is None or self._base_name is None:
+            return
+        asset = os.path.join(self.home_dir, self._base_name)
+        metadataPath = os.path.join(self.getTextureDirectory(asset), self.metadataFilename)
+        metadata = {
+            "url": url,
+            "variants": variants,
+            "listing": {attr: getattr(self, attr, None) for attr in self.listing_state},
+            "listed_at": time.time(),
+        }
+        try:
+            for path, content in ((metadataPath, metadata), (self._listingIndexPath(url), {"asset": asset})):
+                tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+                with open(tmp_path, "w") as f:
+                    json.dump(content, f)
+                os.replace(tmp_path, path)
+        except (OSError, TypeError) as err:
+            print("Could not save the variant list of {}: {}".format(url, err))
+        self.recordAsset(self._base_name, url=url)
+
+    def loadListing(self, url):
+        """Restore what fetchVariantList found for url from the metadata file
+        of the asset. Return the list of variants and the age of the listing
+        in seconds, or None if it was never saved."""
+        if self.listing_state is None:
+            return None
+        try:
+            with open(self._listingIndexPath(url), "r") as f:
+                asset = json.load(f)["asset"]
+            with open(os.path.join(self.getTextureDirectory(asset), self.metadataFilename), "r") as f:
+                metadata = json.load(f)
+            listing = metadata["listing"]
+            if metadata["url"] != url or any(attr not in listing for attr in self.listing_state):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        for attr in self.listing_state:
+            setattr(self, attr, listing[attr])
+        return metadata["variants"], time.time() - metadata["listed_at"]
+
     def saveThumbnail(self, url, matName):
         """save the thumbnail given the material name and url"""
         directory = os.path.join(self.home_dir, matName)
         if self._thumbnailUrl is None or self._base_name is None:
             return None
-        return self.fetchImage(url, directory, "thumbnail")
+        path = self.fetchImage(url, directory, "thumbnail", url_class="thumbnail")
+        if path is not None:
+            self.recordAsset(matName, thumbnail=path)
+        return path
 
     def getAndSaveThumbnail(self, itemUrl):
+        self.download_priority = max(self.download_priority, PRIORITY_THUMBNAIL)
         if self.canHandleUrl(itemUrl):
-            self.fetchVariantList(itemUrl)
+            if self.loadListing(itemUrl) is None:
+                self.fetchVariantList(itemUrl)
         else:
             print(f"'{itemUrl}' is a bad url -- {self.source_name}")
             return None
@@ -22,22 +22,50 @@
 # from a single URL
 
 import zipfile
+import zlib
 import os
+import time
 import re
+import hashlib
 from urllib.parse import urlparse, parse_qs, urlencode, urljoin
+from concurrent.futures import ThreadPoolExecutor
 from .AbstractScrapper import AbstractScrapper
+from ..settings import EXTRACT_MAX_WORKERS, DOWNLOAD_CHUNK_SIZE
+from ..remotezip import RemoteZip, RemoteZipError
+from ..downloads import isModified, DownloadCancelled
+from .. import sessions, manifest
 
 
 class Cc0texturesScrapper(AbstractScrapper):
     source_name = "CC0 Textures"
     home_url = "https://cc0textures.com"
     home_dir = "CC0Textures"
-
-    @classmethod
-    def canHandleUrl(cls, url):
-        """Return true if the URL can be scrapped by this scrapper."""
-        pattern = r"(?:https://(?:www\.)?cc0textures\.com/view(?:\.php)?\?(?:tex|id)=(.+)|cc0\.link/a/(.+))"
-        return re.match(pattern, url) is not None
+    url_hosts = ("cc0textures.com", "cc0.link")
+    url_pattern = r"(?:https://(?:www\.)?cc0textures\.com/view(?:\.php)?\?(?:tex|id)=(.+)|cc0\.link/a/(.+))"
+    # Download links of the API are stable for a given asset
+    response_ttl = 24 * 60 * 60
+    listing_state = ("_base_name", "_thumbnailUrl", "_variants", "_variants_urls")
+
+    # Translate cc0textures map names into our internal map names
+    maps_tr = {
+        # Names of the old website
+        'col': 'baseColor',
+        'nrm': 'normalInvertedY',
+        'mask': 'opacity',
+        'rgh': 'roughness',
+        'met': 'metallic',
+        'AO': 'ambientOcclusion',
+        'disp': 'height',
+        # New names
+        'Color': 'baseColor',
+        'Normal': 'normalInvertedY',
+        'Opacity': 'opacity',
+        'Roughness': 'roughness',
+        'Metalness': 'metallic',
+        'AmbientOcclusion': 'ambientOcclusion',
+        'Displacement': 'height'
+    }
+    map_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.exr'}
 
     def fetchVariantList(self, url):
         """Get a list of available variants.
@@ -90,53 +118,131 @@ class Cc0texturesScrapper(AbstractScrapper):
 
         self.saveThumbnail(self._thumbnailUrl, self._base_name)
 
-        if reinstall or not self.isDownloaded(variant):
-            zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
-            zip_dir = os.path.dirname(zip_path)
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                namelist = zip_ref.namelist()
-                zip_ref.extractall(zip_dir)
+        zip_dir = self.getTextureDirectory(material_data.name)
+        # Another process may have downloaded the variant while we waited for the lock
+        with self.lockDirectory(zip_dir):
+            downloaded = self.isDownloaded(variant)
+            if reinstall or not downloaded:
+                previous_files = manifest.loadManifest(zip_dir) or {}
+                # Both return None if the server does not support byte ranges
+                if reinstall and downloaded:
+                    fetched = self.fetchChangedMaps(zip_url, zip_dir, previous_files)
+                else:
+                    fetched = self.fetchRemoteMaps(zip_url, zip_dir)
+                if fetched is None:
+                    zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
+                    fetched = {name: {"sha256": digest} for name, digest in self.extractMaps(zip_path, zip_dir).items()}
+
+                    os.remove(zip_path)
+
+                for name, stats in fetched.items():
+                    path = os.path.join(zip_dir, *name.split("/"))
+                    stats["size"] = os.path.getsize(path)
+                    self.recordFile(path, zip_url, stats, member=name, directory=zip_dir)
+                    if reinstall:
+                        self.recordUpdate(path, previous_files.get(name), stats["sha256"])
+                self.recordVariant(material_data.name)
+
+        # Maps extracted from sub-directories of the archive are only listed in the manifest
+        namelist = set(os.listdir(zip_dir)).union(name for name in manifest.loadManifest(zip_dir) or ()
+                                                  if os.path.isfile(os.path.join(zip_dir, *name.split("/"))))
 
-            os.remove(zip_path)
-
-            if self.savedVariants is not None:
-                self.savedVariants[variant] = True
-        else:
-            zip_dir = self.getTextureDirectory(material_data.name)
-            namelist = os.listdir(zip_dir)
-
-        # Translate cc0textures map names into our internal map names
-        maps_tr = {
-            # Names of the old website
-            'col': 'baseColor',
-            'nrm': 'normalInvertedY',
-            'mask': 'opacity',
-            'rgh': 'roughness',
-            'met': 'metallic',
-            'AO': 'ambientOcclusion',
-            'disp': 'height',
-            # New names
-            'Color': 'baseColor',
-            'Normal': 'normalInvertedY',
-            'Opacity': 'opacity',
-            'Roughness': 'roughness',
-            'Metalness': 'metallic',
-            'AmbientOcclusion': 'ambientOcclusion',
-            'Displacement': 'height'
-        }
         for name in namelist:
-            base = os.path.splitext(name)[0]
-            map_type = base.split('_')[-1]
-            if map_type in maps_tr:
-                map_name = maps_tr[map_type]
+            map_name = self.getMapName(name)
+            if map_name is not None:
                 material_data.maps[map_name] = os.path.join(zip_dir, name)
         return True
 
-    def isDownloaded(self, variantName):
-        if self.savedVariants is None:
-            self.savedVariants = {i: False for i in self._variants}
-            for i in os.listdir(self.getTextureDirectory(os.path.join(self.home_dir, self._base_name))):
-                if i in self.savedVariants:
-                    self.savedVariants[i] = True
+    @classmethod
+    def getMapName(cls, filename):
+        """Return our internal map name for a file of the archive, or None
+        if it is not a map (preview, .usda/.mtlx sidecar, unused map...)"""
+        base, ext = os.path.splitext(os.path.basename(filename))
+        if ext.lower() not in cls.map_extensions:
+            return None
+        map_type = base.split('_')[-1]
+        return cls.maps_tr.get(map_type)
+
+    def selectMaps(self, namelist):
+        """Members of the archive to extract"""
+        return [name for name in namelist
+                if self.getMapName(name) is not None and ".." not in name.split("/")]
+
+    def fetchRemoteMaps(self, zip_url, zip_dir, only_modified=False):
+        """Download only the maps we use out of the remote archive, fetching
+        their byte ranges rather than the whole archive. If only_modified is
+        True, maps already in zip_dir with the same CRC-32 as in the archive
+        are skipped. Return a dict mapping extracted member names to their
+        sha256, etag and last_modified, or None if the server does not
+        support it."""
+        start_time = time.perf_counter()
+        try:
+            archive = RemoteZip(zip_url)
+            namelist = self.selectMaps(archive.namelist())
+            if only_modified:
+                namelist = [name for name in namelist
+                            if archive.isModified(name, os.path.join(zip_dir, *name.split("/")))]
+            archive.extractMembers(namelist, zip_dir, cancel=self._cancel_event, priority=self.download_priority,
+                                   meter=self.download_meter)
+        except RemoteZipError as err:
+            print("Partial download of {} not possible ({}), downloading the whole archive...".format(zip_url, err))
+            return None
+        self._recordFetch("archive", zip_url, start_time, nbytes=archive.transferredSize(namelist))
+        return {name: {"sha256": archive.digests[name], "etag": archive.etag, "last_modified": archive.last_modified}
+                for name in namelist}
+
+    def fetchChangedMaps(self, zip_url, zip_dir, files):
+        """Revalidate the maps of a downloaded variant, whose manifest entries
+        are files, and fetch again only the ones that changed. Nothing is
+        fetched if the server tells that the archive did not change, otherwise
+        maps are compared with the checksums of the archive's central directory.
+        Return the same as fetchRemoteMaps for the updated maps only."""
+        entries = [entry for entry in files.values() if entry.get("member") is not None and entry["url"] == zip_url]
+        validated = [entry for entry in entries if entry.get("etag") or entry.get("last_modified")]
+        if validated:
+            try:
+                modified = isModified(zip_url, validated[0]["etag"], validated[0]["last_modified"])
+            except sessions.requests.exceptions.RequestException:
+                modified = None
+            if modified is False:
+                print("{} did not change.".format(zip_url))
+                return {}
+        return self.fetchRemoteMaps(zip_url, zip_dir, only_modified=True)
+
+    def extractMaps(self, zip_path, zip_dir):
+        """Extract only the members of the archive that are maps we use.
+        Members are decompressed in parallel (zlib releases the GIL), each
+        worker reading from its own handle on the archive, and hashed along.
+        Like downloads, each member is written next to its final path and
+        replaces it once checked, rather than overwriting a file that may be
+        linked to the blob store.
+        Return a dict mapping extracted member names to their sha256."""
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            namelist = self.selectMaps(zip_ref.namelist())
+
+        def extract(name):
+            if self._cancel_event.is_set():
+                raise DownloadCancelled(name)
+            path = os.path.join(zip_dir, *name.split("/"))
+            part_path = path + ".part"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            h = hashlib.sha256()
+            crc = 0
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                expected_crc = zip_ref.getinfo(name).CRC
+                with zip_ref.open(name) as src, open(part_path, "wb") as dst:
+                    for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b""):
+                        if self._cancel_event.is_set():
+                            raise DownloadCancelled(name)
+                        crc = zlib.crc32(chunk, crc)
+                        h.update(chunk)
+                        dst.write(chunk)
+            if crc != expected_crc:
+                os.remove(part_path)
+                raise RemoteZipError("Corrupted member: {}".format(name))
+            os.replace(part_path, path)
+            return name, h.hexdigest()
+
+        with ThreadPoolExecutor(max_workers=EXTRACT_MAX_WORKERS) as executor:
+            return dict(executor.map(extract, namelist))
 
-        return self.savedVariants[variantName]
@@ -28,12 +28,10 @@ class CgbookcaseScrapper(AbstractScrapper):
     source_name = "cgbookcase.com"
     home_url = "https://www.cgbookcase.com/textures/"
     home_dir = "cgbookcase"
+    url_hosts = ("cgbookcase.com",)
+    url_pattern = r"(?:https?://)?(?:www\.)?cgbookcase\.com/textures/"
+    listing_state = ("_base_name", "_thumbnailUrl", "_variants", "_variants_links", "_double_sided")
 
-    @classmethod
-    def canHandleUrl(cls, url):
-        """Return true if the URL can be scrapped by this scrapper."""
-        return "cgbookcase.com/textures/" in url
-    
     def fetchVariantList(self, url):
         """Get a list of available variants.
         The list may be empty, and must be None in case of error."""
@@ -65,7 +63,7 @@ class CgbookcaseScrapper(AbstractScrapper):
 
         # Save some data for fetchVariant
         self._html = html
-        self._variants_data = variants_data
+        self._variants_links = [[m.attrib['href'] for m in d.xpath(".//a")] for d in variants_data]
         self._variants = variants
         self._double_sided = double_sided
         self._base_name = str(html.xpath("//h1/text()")[0])
@@ -78,7 +76,7 @@ class CgbookcaseScrapper(AbstractScrapper):
         Must fill material_data.name and material_data.maps.
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
-        variants_data = self._variants_data
+        variants_links = self._variants_links
         variants = self._variants
         double_sided = self._double_sided
 
@@ -89,16 +87,13 @@ class CgbookcaseScrapper(AbstractScrapper):
         variant_name = variants[variant_index]
         material_data.name = os.path.join(self.home_dir, self._base_name, variant_name)
 
-        if self.savedVariants is not None:
-            self.savedVariants[variant_name] = True
-
         self.saveThumbnail(self._thumbnailUrl, self._base_name)
 
         # If two sided, use several variants, and label them with is_back_side bool
-        n = len(variants_data)
-        selected_variants = [(variants_data[variant_index % n], False)]
+        n = len(variants_links)
+        selected_variants = [(variants_links[variant_index % n], False)]
         if double_sided and variant_index >= n and variant_index < n * 1.5:
-            selected_variants.append((variants_data[variant_index % n + n // 2], True))
+            selected_variants.append((variants_links[variant_index % n + n // 2], True))
 
         # Translate cgbookcase map names into our internal map names
         maps_tr = {
@@ -110,9 +105,9 @@ class CgbookcaseScrapper(AbstractScrapper):
             'Height': 'height',
             'AO': 'ambientOcclusion',
         }
-        for variant_html_data, is_back_side in selected_variants:
-            for m in variant_html_data.xpath(".//a"):
-                map_url = m.attrib['href']
+        map_urls = {}
+        for links, is_back_side in selected_variants:
+            for map_url in links:
                 if not map_url.startswith("http"):
                     map_url = "https://www.cgbookcase.com" + map_url
 
@@ -123,16 +118,9 @@ class CgbookcaseScrapper(AbstractScrapper):
                     map_name = maps_tr[map_name]
                     if is_back_side:
                         map_name += "_back"
-                    material_data.maps[map_name] = self.fetchImage(map_url, material_data.name, map_name,
-                                                                   reinstall=reinstall)
+                    map_urls[map_name] = map_url
+
+        # Download front and back maps all at once
+        material_data.maps.update(self.fetchImages(material_data.name, map_urls, reinstall=reinstall))
         
         return True
-
-    def isDownloaded(self, variantName):
-        if self.savedVariants is None:
-            self.savedVariants = {i: False for i in self._variants}
-            for i in os.listdir(self.getTextureDirectory(os.path.join(self.home_dir, self._base_name))):
-                if i in self.savedVariants:
-                    self.savedVariants[i] = True
-
-        return self.savedVariants[variantName]
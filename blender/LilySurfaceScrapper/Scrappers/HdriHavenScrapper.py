@@ -29,12 +29,11 @@ class HdriHavenScrapper(AbstractScrapper):
     source_name = "HDRI Haven"
     home_url = "https://hdrihaven.com/hdris/"
     home_dir = "hdrihaven"
+    url_hosts = ("hdrihaven.com",)
+    url_pattern = r"https://hdrihaven\.com/hdri"
+    response_ttl = 24 * 60 * 60
+    listing_state = ("_base_name", "_thumbnailUrl", "_variants", "_variant_links")
 
-    @classmethod
-    def canHandleUrl(cls, url):
-        """Return true if the URL can be scrapped by this scrapper."""
-        return url.startswith("https://hdrihaven.com/hdri")
-    
     def extractButtonName(self, d):
         names = d.xpath(".//div[@class='button']/b/text()")
         if len(names) >= 1:
@@ -67,7 +66,7 @@ class HdriHavenScrapper(AbstractScrapper):
             pass
 
         self._html = html
-        self._variant_data = variant_data
+        self._variant_links = [d.attrib['href'] for d in variant_data]
         self._variants = variants
         self._base_name = html.xpath('//h1/b/text()')[0]
 
@@ -79,7 +78,6 @@ class HdriHavenScrapper(AbstractScrapper):
         Must fill material_data.name and material_data.maps.
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
-        variant_data = self._variant_data
         variants = self._variants
         
         if variant_index < 0 or variant_index >= len(variants):
@@ -89,13 +87,10 @@ class HdriHavenScrapper(AbstractScrapper):
         var_name = variants[variant_index]
         material_data.name = os.path.join(self.home_dir, self._base_name, var_name)
 
-        if self.savedVariants is not None:
-            self.savedVariants[var_name] = True
-
         self.saveThumbnail(self._thumbnailUrl, self._base_name)
 
-        url = "https://hdrihaven.com" + variant_data[variant_index].attrib['href']
-        if url.endswith('.exr') or url.endswith('.hdr') or url.endswith('.jpg'):
+        url = self.getVariantUrl(variant_index)
+        if self.isMapUrl(url):
             map_url = url
         else:
             redirect_html = self.fetchHtml(url)
@@ -104,11 +99,16 @@ class HdriHavenScrapper(AbstractScrapper):
         
         return True
 
-    def isDownloaded(self, variantName):
-        if self.savedVariants is None:
-            self.savedVariants = {i: False for i in self._variants}
-            for i in os.listdir(self.getTextureDirectory(os.path.join(self.home_dir, self._base_name))):
-                if i in self.savedVariants:
-                    self.savedVariants[i] = True
+    def getVariantUrl(self, variant_index):
+        return "https://hdrihaven.com" + self._variant_links[variant_index]
+
+    @staticmethod
+    def isMapUrl(url):
+        """Whether a download button links to the map rather than to a download page"""
+        return url.endswith('.exr') or url.endswith('.hdr') or url.endswith('.jpg')
 
-        return self.savedVariants[variantName]
+    def prefetchPages(self):
+        for i in range(len(self._variants)):
+            url = self.getVariantUrl(i)
+            if not self.isMapUrl(url):
+                self.fetchHtml(url)
@@ -8,19 +8,17 @@ class IesLibraryScrapper(AbstractScrapper):
     source_name = "IES Library"
     home_url = "https://ieslibrary.com"
     home_dir = "ieslibrary"
+    response_ttl = 7 * 24 * 60 * 60
+    listing_state = ("_base_name", "_thumbnailUrl", "_variant", "_download_url", "_blender_energy")
 
-    pattern = r"https://ieslibrary\.com/en/browse#ies-(.+)"
-
-    @classmethod
-    def canHandleUrl(cls, url):
-        """Return true if the URL can be scrapped by this scrapper."""
-        return re.match(cls.pattern, url) is not None
+    url_hosts = ("ieslibrary.com",)
+    url_pattern = r"https://ieslibrary\.com/en/browse#ies-(.+)"
 
     def fetchVariantList(self, url):
         """Get a list of available variants.
         The list may be empty, and must be None in case of error."""
 
-        asset_id = re.match(self.pattern, url).group(1)
+        asset_id = re.match(self.url_pattern, url).group(1)
 
         api_url = f"https://ieslibrary.com/en/browse/data.json?ies={asset_id}"
 
@@ -60,13 +58,13 @@ class IesLibraryScrapper(AbstractScrapper):
 
         if reinstall or not self.isDownloaded(variant):
 
-            data_file = self.fetchText(download_url, material_data.name, "lightData.ies")
+            data_file = self.fetchText(download_url, material_data.name, "lightData.ies", reinstall=reinstall)
+            if data_file is None:
+                return False
             data_dir = os.path.dirname(data_file)
             with open(os.path.join(data_dir, "lightEnergy"), "w+") as f:
                 f.write(str(blender_energy))
 
-            if self.savedVariants is not None:
-                self.savedVariants[variant] = True
         else:
             data_dir = self.getTextureDirectory(material_data.name)
 
@@ -74,11 +72,3 @@ class IesLibraryScrapper(AbstractScrapper):
         material_data.maps["energy"] = os.path.join(data_dir, "lightEnergy")
         return True
 
-    def isDownloaded(self, variantName):
-        if self.savedVariants is None:
-            self.savedVariants = {self._variant: False, }
-            for i in os.listdir(self.getTextureDirectory(os.path.join(self.home_dir, self._base_name))):
-                if i in self.savedVariants:
-                    self.savedVariants[i] = True
-
-        return self.savedVariants[variantName]
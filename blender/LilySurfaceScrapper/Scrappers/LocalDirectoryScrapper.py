@@ -42,7 +42,6 @@ class LocalDirectoryScrapper(AbstractScrapper):
     @classmethod
     def canHandleUrl(cls, url):
         """Return true if the URL can be scrapped by this scrapper."""
-        print(f"test: {url}")
         return path.isdir(url)
 
     def fetchVariantList(self, url):
@@ -28,12 +28,11 @@ class TextureHavenScrapper(AbstractScrapper):
     source_name = "Texture Haven"
     home_url = "https://texturehaven.com/textures/"
     home_dir ="texturehaven"
+    url_hosts = ("texturehaven.com",)
+    url_pattern = r"https://texturehaven\.com/tex"
+    response_ttl = 24 * 60 * 60
+    listing_state = ("_base_name", "_thumbnailUrl", "_variants", "_map_links")
 
-    @classmethod
-    def canHandleUrl(cls, url):
-        """Return true if the URL can be scrapped by this scrapper."""
-        return url.startswith("https://texturehaven.com/tex")
-    
     def fetchVariantList(self, url):
         """Get a list of available variants.
         The list may be empty, and must be None in case of error."""
@@ -52,7 +51,11 @@ class TextureHavenScrapper(AbstractScrapper):
             pass
 
         self._html = html
-        self._maps = maps
+        # Name of each map and its link for each variant
+        self._map_links = [
+            [m.xpath("div[@class='map-download']//text()")[0], m.xpath(".//div[@class='res-item']/a/@href")]
+            for m in maps
+        ]
         self._variants = variants
         self._base_name = html.xpath("//title/text()")[0].split('|')[0].strip().replace("_", " ").title()
 
@@ -64,7 +67,7 @@ class TextureHavenScrapper(AbstractScrapper):
         Must fill material_data.name and material_data.maps.
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
-        maps = self._maps
+        map_links = self._map_links
         variants = self._variants
         
         if variant_index < 0 or variant_index >= len(variants):
@@ -74,9 +77,6 @@ class TextureHavenScrapper(AbstractScrapper):
         var_name = variants[variant_index]
         material_data.name = os.path.join(self.home_dir, self._base_name, var_name)
 
-        if self.savedVariants is not None:
-            self.savedVariants[var_name] = True
-
         self.saveThumbnail(self._thumbnailUrl, self._base_name)
 
         # Translate TextureHaven map names into our internal map names
@@ -99,21 +99,13 @@ class TextureHavenScrapper(AbstractScrapper):
             'Displacement': 'height',
         }
 
-        for m in maps:
-            map_name = m.xpath("div[@class='map-download']//text()")[0]
-            map_url = "https://texturehaven.com" + m.xpath(".//div[@class='res-item']/a/@href")[variant_index]
+        map_urls = {}
+        for map_name, links in map_links:
+            map_url = "https://texturehaven.com" + links[variant_index]
             if map_name in maps_tr:
-                map_name = maps_tr[map_name]
-                material_data.maps[map_name] = self.fetchImage(map_url, material_data.name, map_name,
-                                                               reinstall=reinstall)
+                map_urls[maps_tr[map_name]] = map_url
+
+        # Download all maps at once
+        material_data.maps.update(self.fetchImages(material_data.name, map_urls, reinstall=reinstall))
         
         return True
-
-    def isDownloaded(self, variantName):
-        if self.savedVariants is None:
-            self.savedVariants = {i: False for i in self._variants}
-            for i in os.listdir(self.getTextureDirectory(os.path.join(self.home_dir, self._base_name))):
-                if i in self.savedVariants:
-                    self.savedVariants[i] = True
-
-        return self.savedVariants[variantName]
@@ -26,9 +26,15 @@ class TexturesOneMaterialScrapper(AbstractScrapper):
     home_url = "https://www.3dassets.one"
     scrapped_type = "MATERIAL"
     home_dir = ""
+    url_hosts = ("textures.one", "3dassets.one")
+    url_pattern = r"(?:https?://)?(?:www\.)?(?:textures|3dassets)\.one/go[^?]*\?id="
     # todo this needs a rewirite
 
+    # (scrapped_type, url) -> (source_url, scrapper_class, scrapped_type),
+    # shared by the subclasses
     url_cache = {}
+    # Whether the source found for an url may be reused
+    cache_sources = True
 
     @classmethod
     def findSource(cls, url: str) -> str:
@@ -36,45 +42,75 @@ class TexturesOneMaterialScrapper(AbstractScrapper):
         return cls.getRedirection(None, url)
 
     @classmethod
-    def cacheSourceUrl(cls, url) -> bool:
-        """Look for a scrapper that can scrap the source page, and if so caches the
-        result for further use."""
+    def findSourceScrapper(cls, url):
+        """Look for a scrapper that can scrap the source page, and return the
+        source url, the scrapper class and its scrapped type, or None."""
         source_url = cls.findSource(url)
         if source_url is None:
             print("source url is none")
-            return False
-        for S in ScrappersManager.getScrappersList():
-            if cls.scrapped_type in S.scrapped_type and S.canHandleUrl(source_url):
-                scrapper_class: AbstractScrapper = S
-                scrapped_type: str = scrapper_class.scrapped_type
-                cls.url_cache[url] = (source_url, scrapper_class, scrapped_type)
-                return True
+            return None
+        S = ScrappersManager.findScrapper(source_url, cls.scrapped_type)
+        if S is not None:
+            scrapper_class: AbstractScrapper = S
+            scrapped_type: str = scrapper_class.scrapped_type
+            return source_url, scrapper_class, scrapped_type
         print("no scrapper could handle {}".format(source_url))
-        return False
+        return None
 
     @classmethod
-    def canHandleUrl(cls, url :str) -> bool:
-        """Return true if the URL can be scrapped by this scrapper."""
-        if ("textures.one/go" in url or "3dassets.one/go" in url) and "?id=" in url:
-            return cls.cacheSourceUrl(url)
-        # todo: textures seem to come from 3dtextures.me
-        return False
+    def cacheSourceUrl(cls, url) -> bool:
+        """Look for a scrapper that can scrap the source page, and if so caches the
+        result for further use."""
+        source = cls.findSourceScrapper(url)
+        if source is None:
+            return False
+        cls.url_cache[(cls.scrapped_type, url)] = source
+        return True
 
     def fetchVariantList(self, url: str) -> list:
         cls = self.__class__
-        if url not in cls.url_cache:
-            return []
-        source_url, scrapper_class, scrapped_type = cls.url_cache[url]
+        # Resolved here rather than in canHandleUrl, which must not use the network
+        # todo: textures seem to come from 3dtextures.me
+        key = (cls.scrapped_type, url)
+        try:
+            if cls.cache_sources:
+                found = key in cls.url_cache or cls.cacheSourceUrl(url)
+                source = cls.url_cache[key] if found else None
+            else:
+                source = cls.findSourceScrapper(url)
+        except OSError as err:
+            source = None
+            print("Could not resolve {}: {}".format(url, err))
+        if source is None:
+            self.error = "No supported source found for {}".format(url)
+            return None
+        source_url, scrapper_class, scrapped_type = source
         self.scrapped_type = scrapped_type
-        self.source_scrapper = scrapper_class(self.texture_root)
+        self.source_scrapper = scrapper_class(self.texture_root, self.config)
+        self.source_scrapper.download_priority = self.download_priority
         return self.source_scrapper.fetchVariantList(source_url)
 
     def fetchVariant(self, variant_index, material_data, reinstall=False):
         # todo implement homedir implementation
+        self.source_scrapper.updated_files = self.updated_files
+        self.source_scrapper.download_meter = self.download_meter
         return self.source_scrapper.fetchVariant(variant_index, material_data, reinstall=reinstall)
 
+    def makePrefetchScrapper(self):
+        scrapper = super().makePrefetchScrapper()
+        scrapper.source_scrapper = self.source_scrapper.makePrefetchScrapper()
+        return scrapper
+
+    def prefetchPages(self):
+        self.source_scrapper.prefetchPages()
+
     def isDownloaded(self, variantName):
         return False  # todo find out what is going on here and implement this properly
 
+    def cancel(self):
+        super().cancel()
+        if hasattr(self, "source_scrapper"):
+            self.source_scrapper.cancel()
+
 class TexturesOneWorldScrapper(TexturesOneMaterialScrapper):
     scrapped_type = "WORLD"
@@ -21,11 +21,17 @@
 from .TexturesOneScrapper import TexturesOneMaterialScrapper, TexturesOneWorldScrapper
 from .AbstractScrapper import AbstractScrapper
 from random import choice
-import requests
+import os
+from .. import sessions
 
 class TexturesOneSearchScrapper(TexturesOneMaterialScrapper):
     scrapped_type = "NONE"
     home_url = None  # Prevent double with TexturesOneMaterialScrapper in UI
+    # Handles search terms rather than URLs
+    url_hosts = ()
+    url_pattern = None
+    # Each search picks a random result
+    cache_sources = False
     scrapped_type_name = ""
     supported_creators = []
 
@@ -49,7 +55,7 @@ class TexturesOneSearchScrapper(TexturesOneMaterialScrapper):
         if not url.startswith("http"):
             url = "https://www.3dassets.one" + url
 
-        r = requests.get(url, headers={"User-Agent":"Mozilla/5.0"}, allow_redirects=False)
+        r = sessions.get(url, allow_redirects=False)
         if r.status_code == 200:
             return url
         elif 'Location' in r.headers:
@@ -59,10 +65,9 @@ class TexturesOneSearchScrapper(TexturesOneMaterialScrapper):
 
     @classmethod
     def canHandleUrl(cls, url: str) -> bool:
-        if "/" in url:
-            # It is an URL, not a search query
-            return False
-        return cls.cacheSourceUrl(url)
+        # A search query rather than an URL or a path, the search happens in fetchVariantList.
+        # Names of local directories are left to LocalDirectoryScrapper.
+        return url.strip() != "" and not any(c in url for c in "/\\:") and not os.path.isdir(url)
 
 class TexturesOneSearchMaterialScrapper(TexturesOneSearchScrapper):
     scrapped_type = "MATERIAL"
@@ -22,11 +22,54 @@
 # from a single URL
 
 import os
+import re
+from urllib.parse import urlsplit
 
 from .Scrappers.AbstractScrapper import AbstractScrapper
 
+def urlHost(url):
+    """Lower case host of url without "www.", also when given without scheme"""
+    if "://" not in url:
+        url = "//" + url
+    try:
+        host = urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+class UrlRouter():
+    """Table from URL hosts to the scrappers declaring them in url_hosts, with
+    their url_pattern compiled, so that finding the scrapper of an URL does not
+    try every scrapper. Scrappers without url_hosts are tried for URLs of
+    other hosts, in order, with their canHandleUrl."""
+
+    def __init__(self, scrappers):
+        self._by_host = {}
+        self._fallback = []
+        for S in scrappers:
+            if not S.url_hosts:
+                self._fallback.append(S)
+                continue
+            pattern = re.compile(S.url_pattern) if S.url_pattern is not None else None
+            for host in S.url_hosts:
+                self._by_host.setdefault(host.lower(), []).append((S, pattern))
+
+    def route(self, url, scrapped_type):
+        """Return the scrapper class handling url for the given type
+        ('MATERIAL', 'WORLD' or 'LIGHT'), or None"""
+        for S, pattern in self._by_host.get(urlHost(url), ()):
+            if scrapped_type not in S.scrapped_type:
+                continue
+            if pattern.match(url) if pattern is not None else S.canHandleUrl(url):
+                return S
+        for S in self._fallback:
+            if scrapped_type in S.scrapped_type and S.canHandleUrl(url):
+                return S
+        return None
+
 class ScrappersManager():
     all_scrappers = None
+    url_router = None
 
     @staticmethod
     def makeScrappersList():
@@ -61,4 +104,11 @@ class ScrappersManager():
     def getScrappersList(cls):
         if cls.all_scrappers is None:
             cls.all_scrappers = ScrappersManager.makeScrappersList()
+            cls.url_router = UrlRouter(cls.all_scrappers)
         return cls.all_scrappers
+
+    @classmethod
+    def findScrapper(cls, url, scrapped_type):
+        """Return the scrapper class handling url for the given type, or None"""
+        cls.getScrappersList()
+        return cls.url_router.route(url, scrapped_type)
@@ -38,10 +38,10 @@ class WorldData(ScrappedData):
 
     @classmethod
     def makeScrapper(cls, url):
-        for S in ScrappersManager.getScrappersList():
-            if 'WORLD' in S.scrapped_type and S.canHandleUrl(url):
-                return S()
-        return None
+        S = ScrappersManager.findScrapper(url, 'WORLD')
+        if S is None:
+            return None
+        return S()
     
     def loadImages(self):
         """Implement this in derived classes"""
@@ -29,6 +29,7 @@ def isImportedInBlender():
 if isImportedInBlender():
     from . import preferences
     from . import frontend
+    from . import aio
     from .callback import register_callback
 
     def register():
@@ -38,6 +39,7 @@ if isImportedInBlender():
     def unregister():
         frontend.unregister()
         preferences.unregister()
+        aio.getAsyncRunner().stop()
 
     if __name__ == "__main__":
         register()
@@ -45,4 +47,5 @@ if isImportedInBlender():
 else:
     from .WorldData import WorldData
     from .MaterialData import MaterialData
+    from .LightData import LightData
     from .ScrappersManager import ScrappersManager
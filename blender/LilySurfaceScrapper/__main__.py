@@ -0,0 +1,231 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Command line fetcher, downloading materials, worlds and lights into a texture
+directory without Blender, e.g. to fill the texture directory of render nodes
+beforehand. Run from the directory containing the add-on:
+
+    python -m LilySurfaceScrapper --texture-dir /path/to/textures URL [URL ...]
+
+A variant can be given along with each URL as URL#variant, or for all URLs
+with --variant. URLs that already have a fragment, like IES Library ones,
+are kept whole unless followed by another #variant. Otherwise the variant you are the most likely to pick when
+importing in Blender is downloaded, or all of them with --all-variants.
+URLs can also be listed in a JSON manifest, as strings or as objects with an
+url and a list of variants:
+
+    [
+        "https://cc0textures.com/view?id=Ground023#2K-JPG",
+        {"url": "https://hdrihaven.com/hdri/?h=the_lost_city", "variants": ["4k"]}
+    ]
+
+Exits with 0 if everything was downloaded, 1 if some downloads failed and 2
+if the arguments are invalid.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .MaterialData import MaterialData
+from .WorldData import WorldData
+from .LightData import LightData
+from .ScrappersManager import ScrappersManager
+from .config import Config, setConfig
+from .scheduler import getDownloadScheduler
+from .prefetch import getVariantHistory
+from .settings import TEXTURE_STORE_DIR
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+class FetchItem():
+    def __init__(self, url, variants=None):
+        self.url = url
+        # Variant names to download, None for the default ones
+        self.variants = variants or None
+
+    @classmethod
+    def parse(cls, spec):
+        """Read an URL given as URL#variant. The fragment of URLs that need it,
+        like IES Library ones, is only a variant if it follows another one."""
+        url, sep, variant = spec.rpartition("#")
+        if sep and isHandled(url):
+            return cls(url, [variant])
+        return cls(spec)
+
+def isHandled(url):
+    """Whether a scrapper handles url, without using the network"""
+    return any(ScrappersManager.findScrapper(url, scrapped_type) is not None
+               for scrapped_type in ('MATERIAL', 'WORLD', 'LIGHT'))
+
+def loadManifest(path):
+    with open(path, "r") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError("the manifest must be a list")
+    items = []
+    for entry in entries:
+        if isinstance(entry, str):
+            items.append(FetchItem.parse(entry))
+        elif isinstance(entry, dict) and isinstance(entry.get("url"), str):
+            items.append(FetchItem(entry["url"], entry.get("variants")))
+        else:
+            raise ValueError("invalid manifest entry: {}".format(entry))
+    return items
+
+def makeData(url, texture_root):
+    """Return the MaterialData, WorldData or LightData for url, whose variants
+    could be listed, or None and an error message"""
+    error = "no scrapper can handle this URL"
+    for data_class in (MaterialData, WorldData, LightData):
+        data = data_class(url, texture_root=texture_root)
+        if data.error is not None:
+            continue
+        # Some URLs (e.g. 3dassets.one) only tell whether they are materials
+        # or worlds once resolved when listing variants
+        if data.getVariantList() is not None:
+            return data, None
+        error = data.error
+    return None, error
+
+def selectVariants(variants, requested, all_variants):
+    """Indices of the variants to download, and the requested names that
+    are not in variants"""
+    if requested is None:
+        if all_variants:
+            return list(range(len(variants))), []
+        return [getVariantHistory().preferredVariant(variants)], []
+    lower_variants = [v.lower() for v in variants]
+    indices = []
+    missing = []
+    for name in requested:
+        if name.lower() in lower_variants:
+            indices.append(lower_variants.index(name.lower()))
+        else:
+            missing.append(name)
+    return indices, missing
+
+def fetchItem(item, args):
+    """Download the variants of an item. Return a list of (variant, status,
+    message), status being "downloaded", "cached" or "failed"."""
+    data, error = makeData(item.url, args.texture_dir)
+    if data is None:
+        return [(None, "failed", error)]
+    variants = data.getVariantList()
+    if not variants:
+        return [(None, "failed", "no variant found")]
+
+    indices, missing = selectVariants(variants, item.variants or args.variant, args.all_variants)
+    results = [(name, "failed", "no such variant, available: {}".format(", ".join(variants))) for name in missing]
+    data.setReinstall(args.reinstall)
+    for i in indices:
+        variant = variants[i]
+        cached = data.isDownloaded(variant) and not args.reinstall
+        try:
+            ok = data.selectVariant(i)
+        except Exception as err:
+            traceback.print_exc()
+            ok = False
+            data.error = str(err)
+        if not ok:
+            results.append((variant, "failed", data.getScrapperError() or data.error or "download failed"))
+        elif data.getScrapperError() is not None:
+            results.append((variant, "failed", data.getScrapperError()))
+        else:
+            results.append((variant, "cached" if cached else "downloaded", data.name))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m LilySurfaceScrapper",
+        description="Download materials, worlds and lights into a texture directory without Blender.")
+    parser.add_argument("urls", nargs="*", metavar="URL",
+                        help="URL of an asset, optionally followed by #variant")
+    parser.add_argument("-d", "--texture-dir", required=True,
+                        help="texture directory to download into")
+    parser.add_argument("-m", "--manifest", action="append", default=[],
+                        help="JSON file listing URLs to download, can be repeated")
+    parser.add_argument("-v", "--variant", action="append",
+                        help="variant to download for URLs that do not tell, can be repeated")
+    parser.add_argument("-a", "--all-variants", action="store_true",
+                        help="download all variants of URLs that do not tell which ones")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="number of assets fetched at the same time (default: 4)")
+    parser.add_argument("-r", "--reinstall", action="store_true",
+                        help="check downloaded files against the providers and update the ones that changed")
+    parser.add_argument("--store", nargs="?", const=TEXTURE_STORE_DIR, default=None, metavar="DIR",
+                        help="deduplicate maps in a texture store, by default {}".format(TEXTURE_STORE_DIR))
+    args = parser.parse_args(argv)
+
+    items = [FetchItem.parse(url) for url in args.urls]
+    for path in args.manifest:
+        try:
+            items += loadManifest(path)
+        except (OSError, ValueError) as err:
+            parser.error("could not read manifest {}: {}".format(path, err))
+    if not items:
+        parser.error("no URL given")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    args.texture_dir = os.path.abspath(os.path.expanduser(args.texture_dir))
+    setConfig(Config(
+        texture_dir=args.texture_dir,
+        use_texture_store=args.store is not None,
+        texture_store_dir=args.store or "",
+    ))
+
+    start_time = time.perf_counter()
+    counts = {"downloaded": 0, "cached": 0, "failed": 0}
+    try:
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {executor.submit(fetchItem, item, args): item for item in items}
+            for done, future in enumerate(as_completed(futures), start=1):
+                item = futures[future]
+                try:
+                    results = future.result()
+                except Exception as err:
+                    traceback.print_exc()
+                    results = [(None, "failed", str(err))]
+                for variant, status, message in results:
+                    counts[status] += 1
+                    label = item.url if variant is None else "{} ({})".format(item.url, variant)
+                    print("[{}/{}] {} {}: {}".format(done, len(items), status.upper(), label, message))
+    except KeyboardInterrupt:
+        print("Interrupted")
+        return EXIT_FAILED
+    finally:
+        getDownloadScheduler().shutdown()
+
+    print("{downloaded} downloaded, {cached} already there, {failed} failed".format(**counts) +
+          " in {:.1f}s".format(time.perf_counter() - start_time))
+    return EXIT_FAILED if counts["failed"] else EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Asyncio support. Blender's bundled Python has no asynchronous HTTP client, so
+the coroutine versions of the scrapper methods (fetchHtmlAsync,
+fetchVariantListAsync, etc.) await concurrent futures rather than sockets:
+
+ - single requests, like scrapped pages, are submitted to the download
+   scheduler and wait there for a slot of their host, like any download;
+ - methods that make several requests, like fetchVariant, run on a worker
+   thread, and the downloads they start go through the scheduler as usual.
+
+Cancelling a coroutine cancels its request if it did not start yet, and
+cancels the downloads of the scrapper otherwise. Third-party synchronous
+scrappers dropped in Scrappers/ get the async API without any change.
+
+Several coroutines can share one event loop, e.g. to list ten assets at once,
+as long as each of them uses its own scrapper instance. The AsyncRunner drives
+such a loop on its own thread so that Blender's interface is never blocked.
+"""
+
+import asyncio
+import functools
+import threading
+
+from .scheduler import getDownloadScheduler, PRIORITY_INTERACTIVE
+
+async def runOnScheduler(url, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """Run fn(*args, **kwargs) on the download scheduler once a slot for url's
+    host is granted. fn must not wait for other scheduler tasks."""
+    future = getDownloadScheduler().submit(url, fn, *args, priority=priority, **kwargs)
+    return await asyncio.wrap_future(future)
+
+async def runInThread(fn, *args, **kwargs):
+    """Run the blocking call fn(*args, **kwargs) on a worker thread"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+async def runCancellable(cancel, fn, *args, **kwargs):
+    """Like runInThread, calling cancel() if the coroutine gets cancelled, as
+    the thread itself cannot be interrupted"""
+    try:
+        return await runInThread(fn, *args, **kwargs)
+    except asyncio.CancelledError:
+        cancel()
+        raise
+
+class AsyncRunner():
+    """Event loop running on a background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    def _getLoop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="LilyAsyncio", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop, return a concurrent.futures.Future,
+        whose cancel() cancels the coroutine"""
+        return asyncio.run_coroutine_threadsafe(coro, self._getLoop())
+
+    def run(self, coro, timeout=None):
+        """Blocking version of submit, for scripts"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+# -----------------------------------------------------------------------------
+
+_async_runner = AsyncRunner()
+
+def getAsyncRunner():
+    return _async_runner
+
+def callWhenDone(future, callback, interval=0.1):
+    """Call callback(future) from Blender's main thread once future is done,
+    where it is safe to use the Blender API. Must be called from Blender."""
+    import bpy
+    def poll():
+        if not future.done():
+            return interval
+        callback(future)
+        return None
+    bpy.app.timers.register(poll, first_interval=interval)
@@ -0,0 +1,174 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Content-addressed texture store. Downloaded maps are kept once, in a store
+shared by all blend files, under the sha256 of their content, and the usual
+home_dir/asset/variant/map.ext layout of each texture directory is made of
+hard links to the stored files. So the same map downloaded for several blend
+files, through 3DAssets.one or directly, or shared by several variants, only
+takes disk space once.
+
+Files that cannot be hard linked to the store (e.g. it is on another drive)
+are kept as they are rather than replaced by symbolic links, which would break
+texture directories shared with render nodes or moved with their blend file.
+
+Since linked files share their content, maps must not be edited in place.
+"""
+
+import os
+import mmap
+import hashlib
+import threading
+
+from .settings import DOWNLOAD_CHUNK_SIZE, MMAP_HASH_MIN_SIZE
+
+# Files of texture directories that are not maps: transfer records, partial
+# downloads, scrapper metadata, cache bookkeeping and the response cache
+IGNORED_SUFFIXES = (".part", ".part.json", ".tmp", ".link", ".stale")
+IGNORED_NAMES = {".metadata", ".lastaccess", ".prefetched", ".manifest.json", ".lock"}
+IGNORED_DIRS = {".cache"}
+
+def fileSha256(path):
+    """Hash a file. Large files are memory-mapped and hashed in one go, which
+    avoids copying them through Python and releases the GIL meanwhile, so
+    that several files can be hashed in parallel."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_HASH_MIN_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+        else:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+class BlobStore():
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def blobPath(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _isLinked(self, blob, path):
+        try:
+            return os.path.samefile(blob, path)
+        except OSError:
+            return False
+
+    def materialize(self, blob, path):
+        """Replace the file at path by a hard link to blob, atomically.
+        Return False, leaving the file untouched, if it cannot be hard linked."""
+        if self._isLinked(blob, path):
+            return True
+        tmp_path = path + ".link"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            return False
+        os.replace(tmp_path, path)
+        return True
+
+    def ingest(self, path, digest=None):
+        """Add the file at path to the store, as a second name of the same
+        file. If the store already has the same content, the file is replaced
+        by a hard link to it. Return the path of the blob, or None if the file
+        had to be kept as it is."""
+        if digest is None:
+            digest = fileSha256(path)
+        blob = self.blobPath(digest)
+        with self._lock:
+            if not os.path.isfile(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    os.link(path, blob)
+                    return blob
+                except OSError:
+                    # Not on the same file system as the store
+                    return None
+        return blob if self.materialize(blob, path) else None
+
+    @staticmethod
+    def _listFiles(root, exclude=None):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames
+                           if d not in IGNORED_DIRS and os.path.join(dirpath, d) != exclude]
+            for filename in filenames:
+                if filename in IGNORED_NAMES or filename.endswith(IGNORED_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, filename)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    yield path
+
+    def analyze(self, root):
+        """Look for duplicated files in a texture directory. Return a dict with
+        the number of files, of distinct contents, of files already linked to
+        the store, and the number of bytes that compacting would free."""
+        report = {"files": 0, "unique": 0, "linked": 0, "duplicates": 0, "wasted_bytes": 0}
+        seen = set()
+        for path in self._listFiles(root, exclude=self.directory):
+            report["files"] += 1
+            digest = fileSha256(path)
+            blob = self.blobPath(digest)
+            if self._isLinked(blob, path):
+                report["linked"] += 1
+                seen.add(digest)
+                continue
+            if digest in seen or os.path.isfile(blob):
+                report["duplicates"] += 1
+                report["wasted_bytes"] += os.path.getsize(path)
+            seen.add(digest)
+        report["unique"] = len(seen)
+        return report
+
+    def compact(self, root):
+        """Move all files of a texture directory into the store, turning
+        duplicates into links. Return the number of bytes freed."""
+        freed = 0
+        for path in self._listFiles(root, exclude=self.directory):
+            size = os.path.getsize(path)
+            digest = fileSha256(path)
+            blob = self.blobPath(digest)
+            if self._isLinked(blob, path):
+                continue
+            had_blob = os.path.isfile(blob)
+            if self.ingest(path, digest) is not None and had_blob:
+                freed += size
+        return freed
+
+# -----------------------------------------------------------------------------
+
+_blob_stores = {}
+_blob_stores_lock = threading.Lock()
+
+def getBlobStore(directory):
+    with _blob_stores_lock:
+        store = _blob_stores.get(directory)
+        if store is None:
+            store = BlobStore(directory)
+            _blob_stores[directory] = store
+        return store
@@ -0,0 +1,216 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Size quota for texture directories. Each imported variant directory
+(home_dir/asset/variant) gets a marker file touched whenever the variant is
+used, and when the directory grows beyond its quota, the least recently used
+variants are removed as a whole, sub-directories included, except pinned ones,
+e.g. those used by the open blend file. Variants that were prefetched but never used are marked as such and are
+removed first. Scrappers are notified of evictions through listeners so that the
+variants they remember as downloaded are updated.
+"""
+
+import os
+import stat
+import shutil
+import threading
+
+from .blobstore import IGNORED_DIRS
+from .filelock import isLocked
+from .manifest import MANIFEST_FILENAME
+
+ACCESS_MARKER = ".lastaccess"
+# Present in variant directories downloaded by prefetch until they are used
+PREFETCH_MARKER = ".prefetched"
+
+_eviction_listeners = []
+# Guards markers, so that a variant used during its prefetch does not get marked afterwards
+_marker_lock = threading.Lock()
+
+def addEvictionListener(listener):
+    """listener(variant_dir) is called after a variant directory is removed"""
+    _eviction_listeners.append(listener)
+
+def isPrefetched(variant_dir):
+    return os.path.isfile(os.path.join(variant_dir, PREFETCH_MARKER))
+
+class CacheEntry():
+    def __init__(self, path, size, last_access, hardlinks, prefetched=False):
+        self.path = path
+        self.size = size
+        self.last_access = last_access
+        self.prefetched = prefetched
+        # (st_dev, st_ino) of files that have other hard links, i.e. that
+        # are deduplicated in the blob store
+        self.hardlinks = hardlinks
+
+class CacheManager():
+    def __init__(self, root, store_dir=None):
+        self.root = root
+        self.store_dir = store_dir
+        self._lock = threading.Lock()
+
+    def touch(self, variant_dir):
+        """Record that a variant was just used"""
+        marker = os.path.join(variant_dir, ACCESS_MARKER)
+        with _marker_lock:
+            try:
+                with open(marker, "a"):
+                    pass
+                os.utime(marker, None)
+                if isPrefetched(variant_dir):
+                    os.remove(os.path.join(variant_dir, PREFETCH_MARKER))
+            except OSError as err:
+                print("Could not record access to {}: {}".format(variant_dir, err))
+
+    def markPrefetched(self, variant_dir, since=None):
+        """Record that a variant was downloaded without the user asking for it,
+        unless it was used since the time since (as given by time.time()).
+        Return whether the variant is marked."""
+        with _marker_lock:
+            try:
+                if since is not None and os.path.getmtime(os.path.join(variant_dir, ACCESS_MARKER)) >= since:
+                    return False
+            except OSError:
+                # Never used
+                pass
+            try:
+                with open(os.path.join(variant_dir, PREFETCH_MARKER), "a"):
+                    pass
+                return True
+            except OSError as err:
+                print("Could not mark {} as prefetched: {}".format(variant_dir, err))
+                return False
+
+    def _isVariant(self, dirpath, filenames):
+        """Whether dirpath is the root of a variant: it has a manifest or
+        markers, or it is home_dir/asset/variant (see catalog.splitPath)"""
+        if ".metadata" in filenames:
+            # Asset directory, holding the metadata and thumbnail
+            return False
+        if MANIFEST_FILENAME in filenames or ACCESS_MARKER in filenames or PREFETCH_MARKER in filenames:
+            return True
+        return len(os.path.relpath(dirpath, self.root).split(os.sep)) >= 3
+
+    def scan(self):
+        """List variant directories, with the files of their sub-directories,
+        except those of an asset download in progress"""
+        entries = []
+        seen_inodes = set()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames
+                           if d not in IGNORED_DIRS and os.path.join(dirpath, d) != self.store_dir]
+            if dirpath == self.root or not self._isVariant(dirpath, filenames):
+                continue
+            # The sub-directories are part of the variant
+            dirnames[:] = []
+
+            files = [os.path.join(subdir, filename)
+                     for subdir, subdirnames, subfilenames in os.walk(dirpath)
+                     for filename in subfilenames]
+            if not files or any(path.endswith(".part") for path in files):
+                continue
+
+            size = 0
+            mtimes = []
+            hardlinks = set()
+            for path in files:
+                if os.path.basename(path) in (ACCESS_MARKER, PREFETCH_MARKER):
+                    continue
+                st = os.lstat(path)
+                mtimes.append(st.st_mtime)
+                if stat.S_ISLNK(st.st_mode):
+                    # Symbolic links to the store take no space here
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if st.st_nlink > 1:
+                    hardlinks.add(key)
+                # Files hard linked in several variants only count once
+                if key not in seen_inodes:
+                    seen_inodes.add(key)
+                    size += st.st_size
+
+            if ACCESS_MARKER in filenames:
+                last_access = os.stat(os.path.join(dirpath, ACCESS_MARKER)).st_mtime
+            else:
+                # Downloaded before access was tracked
+                last_access = max(mtimes, default=0)
+            entries.append(CacheEntry(dirpath, size, last_access, hardlinks, PREFETCH_MARKER in filenames))
+        return entries
+
+    def _collectBlobs(self, hardlinks):
+        """Remove blobs of the store that are no longer linked anywhere"""
+        if self.store_dir is None or not hardlinks or not os.path.isdir(self.store_dir):
+            return
+        for dirpath, _, filenames in os.walk(self.store_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) in hardlinks and st.st_nlink == 1:
+                    os.remove(path)
+
+    def evict(self, entry):
+        """Remove a variant directory. Blobs it was linked to are only
+        collected afterwards, once for all evicted entries."""
+        shutil.rmtree(entry.path, ignore_errors=True)
+        print("Evicted {} from the texture cache".format(entry.path))
+        for listener in _eviction_listeners:
+            listener(entry.path)
+
+    def enforceQuota(self, quota, pinned=()):
+        """Remove the least recently used variants until the texture directory
+        takes no more than quota bytes. Variant directories in pinned, or
+        containing a file in pinned, are kept, and unused prefetched variants
+        go first. Return the evicted entries."""
+        return self._evict(lambda entry, total: total > quota, pinned)
+
+    def reclaimPrefetched(self, pinned=()):
+        """Remove all prefetched variants that were not used. Return the evicted entries."""
+        return self._evict(lambda entry, total: entry.prefetched, pinned)
+
+    def _evict(self, predicate, pinned):
+        """Evict entries, in eviction order, as long as predicate(entry, total_size) holds"""
+        # Not realpath, that would resolve links to the blob store
+        pinned = [os.path.normcase(os.path.abspath(path)) for path in pinned]
+        def isPinned(entry):
+            variant_dir = os.path.normcase(os.path.abspath(entry.path))
+            return any(path == variant_dir or path.startswith(variant_dir + os.sep) for path in pinned)
+
+        with self._lock:
+            entries = self.scan()
+            total = sum(entry.size for entry in entries)
+            evicted = []
+            for entry in sorted(entries, key=lambda e: (not e.prefetched, e.last_access)):
+                if not predicate(entry, total):
+                    break
+                if isPinned(entry):
+                    continue
+                if isLocked(entry.path):
+                    # Being downloaded, maybe by another Blender instance
+                    continue
+                self.evict(entry)
+                total -= entry.size
+                evicted.append(entry)
+            self._collectBlobs(set().union(*(entry.hardlinks for entry in evicted)))
+            return evicted
@@ -0,0 +1,247 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Download catalog. Each texture directory has a SQLite database listing its
+assets (provider/asset, with their url and thumbnail), the variants that are
+completely downloaded and their files, so that telling whether a variant is
+downloaded or listing the assets of a provider does not need to walk the
+texture directory. It is updated on every download and eviction, and can be
+rebuilt from what is on disk, which is done automatically the first time.
+
+The database uses write-ahead logging, so that several Blender instances
+sharing a texture directory can read it while one of them writes.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from . import manifest
+from .blobstore import IGNORED_NAMES, IGNORED_SUFFIXES
+from .cachemanager import addEvictionListener
+
+CATALOG_FILENAME = "catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    provider TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    url TEXT,
+    thumbnail TEXT,
+    updated_at REAL,
+    PRIMARY KEY (provider, asset)
+);
+CREATE TABLE IF NOT EXISTS variants (
+    provider TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    size INTEGER,
+    file_count INTEGER,
+    downloaded_at REAL,
+    PRIMARY KEY (provider, asset, variant)
+);
+CREATE TABLE IF NOT EXISTS files (
+    provider TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    url TEXT,
+    updated_at REAL,
+    PRIMARY KEY (provider, asset, variant, filename)
+);
+"""
+
+class Catalog():
+    def __init__(self, root):
+        """root: the texture directory"""
+        self.root = root
+        cache_dir = os.path.join(root, ".cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, CATALOG_FILENAME)
+        is_new = not os.path.isfile(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        if is_new:
+            self.rebuild()
+
+    def _execute(self, query, *args):
+        with self._lock, self._connection:
+            return self._connection.execute(query, args).fetchall()
+
+    def splitPath(self, path):
+        """Return (provider, asset, variant) for a variant directory of the
+        texture directory, or None if path is not one"""
+        try:
+            parts = os.path.relpath(path, self.root).split(os.sep)
+        except ValueError:
+            # On another drive
+            return None
+        if len(parts) < 3 or parts[0] in (os.curdir, os.pardir):
+            return None
+        return parts[0], parts[1], "/".join(parts[2:])
+
+    def recordAsset(self, provider, asset, url=None, thumbnail=None):
+        """Add an asset, or update its url or thumbnail when provided"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO assets (provider, asset) VALUES (?, ?)", (provider, asset))
+            self._connection.execute(
+                "UPDATE assets SET url = COALESCE(?, url), thumbnail = COALESCE(?, thumbnail), updated_at = ? "
+                "WHERE provider = ? AND asset = ?",
+                (url, thumbnail, time.time(), provider, asset))
+
+    def recordFile(self, provider, asset, variant, filename, size, sha256=None, url=None):
+        self._execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            provider, asset, variant, filename, size, sha256, url, time.time())
+
+    def recordVariant(self, provider, asset, variant):
+        """Mark a variant as completely downloaded"""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO assets (provider, asset, updated_at) VALUES (?, ?, ?)",
+                (provider, asset, time.time()))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO variants "
+                "SELECT ?, ?, ?, COALESCE(SUM(size), 0), COUNT(*), ? FROM files "
+                "WHERE provider = ? AND asset = ? AND variant = ?",
+                (provider, asset, variant, time.time(), provider, asset, variant))
+
+    def removeVariant(self, provider, asset, variant):
+        with self._lock, self._connection:
+            for table in ("variants", "files"):
+                self._connection.execute(
+                    "DELETE FROM {} WHERE provider = ? AND asset = ? AND variant = ?".format(table),
+                    (provider, asset, variant))
+
+    def isDownloaded(self, provider, asset, variant):
+        return bool(self._execute(
+            "SELECT 1 FROM variants WHERE provider = ? AND asset = ? AND variant = ?",
+            provider, asset, variant))
+
+    def downloadedVariants(self, provider, asset):
+        return {row[0] for row in self._execute(
+            "SELECT variant FROM variants WHERE provider = ? AND asset = ?", provider, asset)}
+
+    def assets(self, provider):
+        """List the (asset, url, thumbnail) of a provider, sorted by name"""
+        return self._execute(
+            "SELECT asset, url, thumbnail FROM assets WHERE provider = ? ORDER BY asset", provider)
+
+    def rebuild(self, exclude=None):
+        """Forget everything and register what is in the texture directory.
+        exclude is a directory to skip, typically the blob store.
+        Return the number of assets and of variants found."""
+        assets = []
+        variants = []
+        files = []
+        now = time.time()
+        for provider, asset, asset_dir in self._walkAssets(exclude):
+            url = None
+            thumbnail = None
+            for entry in os.scandir(asset_dir):
+                if entry.name == ".metadata":
+                    url = self._readUrl(entry.path)
+                elif entry.name.startswith("thumbnail") and entry.is_file():
+                    thumbnail = entry.path
+                elif entry.is_dir() and not entry.name.startswith("."):
+                    variant_files = self._listVariantFiles(entry.path)
+                    if variant_files is None:
+                        continue
+                    for filename, size, sha256, file_url in variant_files:
+                        files.append((provider, asset, entry.name, filename, size, sha256, file_url, now))
+                    size = sum(f[1] for f in variant_files)
+                    variants.append((provider, asset, entry.name, size, len(variant_files), now))
+            assets.append((provider, asset, url, thumbnail, now))
+
+        with self._lock, self._connection:
+            for table in ("assets", "variants", "files"):
+                self._connection.execute("DELETE FROM {}".format(table))
+            self._connection.executemany("INSERT INTO assets VALUES (?, ?, ?, ?, ?)", assets)
+            self._connection.executemany("INSERT INTO variants VALUES (?, ?, ?, ?, ?, ?)", variants)
+            self._connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", files)
+        return len(assets), len(variants)
+
+    def _walkAssets(self, exclude):
+        for provider in os.scandir(self.root):
+            if not provider.is_dir() or provider.name.startswith(".") or provider.path == exclude:
+                continue
+            for asset in os.scandir(provider.path):
+                if asset.is_dir() and not asset.name.startswith(".") and asset.path != exclude:
+                    yield provider.name, asset.name, asset.path
+
+    @staticmethod
+    def _readUrl(metadata_path):
+        try:
+            with open(metadata_path, "r") as f:
+                return json.load(f).get("url")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def _listVariantFiles(variant_dir):
+        """(filename, size, sha256, url) of the files of a complete variant,
+        or None if it is incomplete or empty"""
+        if not manifest.isComplete(variant_dir):
+            return None
+        entries = manifest.loadManifest(variant_dir)
+        if entries is not None:
+            return [(filename, entry["size"], entry["sha256"], entry["url"])
+                    for filename, entry in entries.items()] or None
+        # Downloaded before manifests existed
+        variant_files = []
+        for entry in os.scandir(variant_dir):
+            if entry.is_file() and entry.name not in IGNORED_NAMES and not entry.name.endswith(IGNORED_SUFFIXES):
+                variant_files.append((entry.name, entry.stat().st_size, None, None))
+        return variant_files or None
+
+# -----------------------------------------------------------------------------
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def getCatalog(root):
+    root = os.path.abspath(root)
+    with _catalogs_lock:
+        catalog = _catalogs.get(os.path.normcase(root))
+        if catalog is None:
+            catalog = Catalog(root)
+            _catalogs[os.path.normcase(root)] = catalog
+        return catalog
+
+def _forgetEvictedVariant(variant_dir):
+    with _catalogs_lock:
+        catalogs = list(_catalogs.values())
+    for catalog in catalogs:
+        key = catalog.splitPath(os.path.abspath(variant_dir))
+        if key is not None:
+            catalog.removeVariant(*key)
+
+addEvictionListener(_forgetEvictedVariant)
@@ -0,0 +1,73 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Settings of the scrapping core. Scrappers read them from a Config object
+rather than from the add-on preferences, which need bpy and must only be
+accessed from Blender's main thread. The frontend makes one out of the
+preferences when starting an import, other callers (the command line fetcher,
+worker processes, which receive it pickled) make their own or call setConfig.
+"""
+
+from .settings import TEXTURE_DIR
+
+class Config():
+    def __init__(self, texture_dir=TEXTURE_DIR, use_texture_store=False, texture_store_dir=""):
+        """texture_dir: where textures are downloaded, relative to the texture
+        root (e.g. the blend file directory) if not absolute
+        use_texture_store: whether to deduplicate maps in a blob store
+        texture_store_dir: directory of the blob store, empty for the default one"""
+        self.texture_dir = texture_dir
+        self.use_texture_store = use_texture_store
+        self.texture_store_dir = texture_store_dir
+
+    @classmethod
+    def fromPreferences(cls, preferences):
+        return cls(
+            texture_dir=preferences.texture_dir,
+            use_texture_store=preferences.use_texture_store,
+            texture_store_dir=preferences.texture_store_dir,
+        )
+
+    def __repr__(self):
+        return "Config(texture_dir={!r}, use_texture_store={!r}, texture_store_dir={!r})".format(
+            self.texture_dir, self.use_texture_store, self.texture_store_dir)
+
+# -----------------------------------------------------------------------------
+
+_config = None
+
+def setConfig(config):
+    """Config used by scrappers that were not given one"""
+    global _config
+    _config = config
+
+def getConfig():
+    """Config set by setConfig, or else the one of the add-on preferences"""
+    if _config is not None:
+        return _config
+    try:
+        from .preferences import getPreferences
+    except ImportError:
+        raise RuntimeError("Not running in Blender, give scrappers a Config or call setConfig()")
+    return Config.fromPreferences(getPreferences())
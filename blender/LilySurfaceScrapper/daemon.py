@@ -0,0 +1,462 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Optional worker process. Scrapping pages, downloading, extracting and hashing
+maps all happen in Blender's Python otherwise, where they compete with the
+interface for the GIL. When enabled, background imports are sent to a long
+lived worker process instead, which sends back the downloaded maps so that
+Blender only has to build nodes.
+
+The worker is a plain Python process (without bpy) running this module. It is
+started by the first Blender instance that needs it and keeps running after
+Blender exits, until it has no client for DAEMON_IDLE_TIMEOUT seconds, so that
+its HTTP connections, response cache and download scheduler are reused from
+one session to the next. It listens on a local socket (a named pipe on
+Windows), and clients authenticate with a key only readable by the user.
+
+Messages are dicts with a type:
+ - client to worker: "hello" with the protocol and add-on versions of the
+   client, "import" (see DaemonClient.submitImport), "cancel" with the
+   import_id of an import, "ping", "shutdown"
+ - worker to client: "hello" with the versions of the worker, "done" with the
+   id of an import and its result (see ScrappedData.exportResult), "pong"
+
+A worker left running by another version of the add-on is stopped and
+started again by the first client that connects to it.
+"""
+
+import os
+import sys
+import time
+import secrets
+import itertools
+import threading
+import traceback
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from . import bl_info
+from .config import Config, getConfig
+from .jobs import ImportJob
+from .MaterialData import MaterialData
+from .WorldData import WorldData
+from .LightData import LightData
+from .scheduler import getDownloadScheduler
+from .settings import (
+    DAEMON_ADDRESS, DAEMON_AUTHKEY_FILE, DAEMON_LOG_FILE,
+    DAEMON_IDLE_TIMEOUT, DAEMON_START_TIMEOUT, DAEMON_MAX_JOBS,
+)
+
+# Version of the messages above, to be increased whenever they change
+PROTOCOL_VERSION = 2
+ADDON_VERSION = tuple(bl_info["version"])
+
+DATA_CLASSES = {
+    'MATERIAL': MaterialData,
+    'WORLD': WorldData,
+    'LIGHT': LightData,
+}
+
+class DaemonError(Exception):
+    """Raised when the worker process cannot be started or reached"""
+    pass
+
+def getAuthKey(path=DAEMON_AUTHKEY_FILE):
+    """Key shared by the worker and its clients, created on first use"""
+    try:
+        with open(path, "rb") as f:
+            key = f.read()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key = secrets.token_hex(32).encode("ascii")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Created by another process meanwhile
+        time.sleep(0.1)
+        with open(path, "rb") as f:
+            return f.read()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+def isSocketPath(address):
+    return isinstance(address, str) and not address.startswith("\\\\")
+
+# -----------------------------------------------------------------------------
+# Worker side
+
+class WorkerDaemon():
+    def __init__(self, address=DAEMON_ADDRESS, authkey=None, idle_timeout=DAEMON_IDLE_TIMEOUT):
+        self.address = address
+        self.authkey = authkey or getAuthKey()
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._clients = 0
+        self._last_activity = time.monotonic()
+        self._stopping = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=DAEMON_MAX_JOBS, thread_name_prefix="LilyWorker")
+
+    def serveForever(self):
+        self._removeStaleSocket()
+        listener = Listener(self.address, authkey=self.authkey)
+        print("Worker {} listening on {}".format(os.getpid(), self.address), flush=True)
+        threading.Thread(target=self._watchIdle, name="LilyWorkerIdle", daemon=True).start()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as err:
+                    print("Rejected a connection: {}".format(err), flush=True)
+                    continue
+                threading.Thread(target=self._serve, args=(connection,), name="LilyWorkerClient", daemon=True).start()
+        finally:
+            listener.close()
+            self._executor.shutdown(wait=False)
+            getDownloadScheduler().shutdown()
+        print("Worker {} stopped".format(os.getpid()), flush=True)
+
+    def stop(self):
+        self._stopping.set()
+        # Wake up accept()
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except (OSError, EOFError, AuthenticationError):
+            pass
+
+    def _removeStaleSocket(self):
+        """Remove the socket file left by a worker that crashed"""
+        if not isSocketPath(self.address) or not os.path.exists(self.address):
+            return
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            os.remove(self.address)
+            return
+        raise DaemonError("Another worker is already listening on {}".format(self.address))
+
+    def _touch(self):
+        with self._lock:
+            self._last_activity = time.monotonic()
+
+    def _watchIdle(self):
+        while not self._stopping.wait(min(60, self.idle_timeout)):
+            with self._lock:
+                idle = self._clients == 0 and time.monotonic() - self._last_activity > self.idle_timeout
+            if idle:
+                print("No client for {} seconds".format(self.idle_timeout), flush=True)
+                self.stop()
+
+    def _serve(self, connection):
+        send_lock = threading.Lock()
+        def send(message):
+            with send_lock:
+                connection.send(message)
+
+        # Imports of this client by id, None until started. A cancelled
+        # import is removed, under jobs_lock so that it cannot be started after
+        jobs = {}
+        jobs_lock = threading.Lock()
+        with self._lock:
+            self._clients += 1
+        try:
+            while not self._stopping.is_set():
+                try:
+                    message = connection.recv()
+                except (OSError, EOFError):
+                    break
+                self._touch()
+                message_type = message.get("type")
+                if message_type == "import":
+                    with jobs_lock:
+                        jobs[message["id"]] = None
+                    self._executor.submit(self._runImport, message, jobs, jobs_lock, send)
+                elif message_type == "cancel":
+                    with jobs_lock:
+                        job = jobs.pop(message["import_id"], None)
+                    if job is not None:
+                        job.cancel()
+                elif message_type == "hello":
+                    send({"type": "hello", "id": message.get("id"), "pid": os.getpid(),
+                          "protocol": PROTOCOL_VERSION, "version": ADDON_VERSION})
+                elif message_type == "ping":
+                    send({"type": "pong", "id": message.get("id"), "pid": os.getpid()})
+                elif message_type == "shutdown":
+                    self.stop()
+        finally:
+            # Nobody is waiting for these anymore
+            with jobs_lock:
+                running = [job for job in jobs.values() if job is not None]
+                jobs.clear()
+            for job in running:
+                job.cancel()
+            with self._lock:
+                self._clients -= 1
+            self._touch()
+            connection.close()
+
+    def _runImport(self, message, jobs, jobs_lock, send):
+        request_id = message["id"]
+        result = {"type": "done", "id": request_id, "error": None, "needs_variant": False, "cancelled": False}
+        try:
+            data_class = DATA_CLASSES[message["kind"]]
+            data = data_class(message["url"], texture_root=message["texture_root"], config=Config(**message["config"]))
+            job = ImportJob(data,
+                variant_name=message["variant_name"],
+                variant_index=message["variant_index"],
+                reinstall=message["reinstall"])
+            with jobs_lock:
+                if request_id not in jobs:
+                    result["cancelled"] = True
+                    return
+                jobs[request_id] = job
+            job.run()
+            with jobs_lock:
+                cancelled = job.cancelled or request_id not in jobs
+            result.update(error=job.error, needs_variant=job.needs_variant, cancelled=cancelled)
+            result.update(data.exportResult())
+        except Exception as err:
+            traceback.print_exc()
+            result["error"] = "Import failed in the worker process: {}".format(err)
+        finally:
+            with jobs_lock:
+                jobs.pop(request_id, None)
+            try:
+                send(result)
+            except (OSError, EOFError):
+                pass
+
+# -----------------------------------------------------------------------------
+# Client side
+
+class DaemonClient():
+    def __init__(self, python=sys.executable, address=DAEMON_ADDRESS):
+        """python: interpreter used to start the worker when it is not running"""
+        self.python = python
+        self.address = address
+        self._connect_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._connection = None
+        # Futures of the answers to requests, by request id
+        self._pending = {}
+        self._request_ids = itertools.count(1)
+
+    def isConnected(self):
+        return self._connection is not None
+
+    def _connect(self):
+        """Return the connection to the worker, starting it if needed"""
+        with self._connect_lock:
+            if self._connection is not None:
+                return self._connection
+            authkey = getAuthKey()
+            try:
+                connection = Client(self.address, authkey=authkey)
+            except OSError:
+                self.startDaemon()
+                connection = self._waitForDaemon(authkey)
+            except AuthenticationError as err:
+                raise DaemonError("The worker process refused the connection: {}".format(err))
+            if not self._hello(connection):
+                print("Restarting the worker process, left by another version of the add-on")
+                self._stopDaemon(connection, authkey)
+                self.startDaemon()
+                connection = self._waitForDaemon(authkey)
+                if not self._hello(connection):
+                    connection.close()
+                    raise DaemonError("The worker process runs another version of the add-on")
+            self._connection = connection
+            threading.Thread(target=self._receive, args=(connection,), name="LilyWorkerEvents", daemon=True).start()
+            return connection
+
+    def startDaemon(self):
+        # Run from the directory containing the add-on, whatever its name
+        package_dir = os.path.dirname(os.path.realpath(__file__))
+        module = __package__.split(".")[0] + ".daemon"
+        os.makedirs(os.path.dirname(DAEMON_LOG_FILE), exist_ok=True)
+        print("Starting worker process: {} -m {}".format(self.python, module))
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # Keep running after Blender exits
+            kwargs["start_new_session"] = True
+        with open(DAEMON_LOG_FILE, "ab") as log:
+            subprocess.Popen([self.python, "-u", "-m", module],
+                cwd=os.path.dirname(package_dir),
+                stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                close_fds=True, **kwargs)
+
+    def _waitForDaemon(self, authkey):
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while True:
+            try:
+                return Client(self.address, authkey=authkey)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise DaemonError("The worker process did not start, see {}".format(DAEMON_LOG_FILE))
+                time.sleep(0.2)
+            except AuthenticationError as err:
+                raise DaemonError("The worker process refused the connection: {}".format(err))
+
+    def _hello(self, connection):
+        """Tell whether the worker runs the same version as this client. Workers
+        older than the hello message ignore it and only answer the ping."""
+        try:
+            connection.send({"type": "hello", "protocol": PROTOCOL_VERSION, "version": ADDON_VERSION})
+            connection.send({"type": "ping"})
+            hello = None
+            while True:
+                if not connection.poll(DAEMON_START_TIMEOUT):
+                    raise DaemonError("The worker process does not answer")
+                message = connection.recv()
+                if message.get("type") == "hello":
+                    hello = message
+                elif message.get("type") == "pong":
+                    break
+        except (OSError, EOFError) as err:
+            connection.close()
+            raise DaemonError("Could not reach the worker process: {}".format(err))
+        return (hello is not None
+                and hello.get("protocol") == PROTOCOL_VERSION
+                and tuple(hello.get("version", ())) == ADDON_VERSION)
+
+    def _stopDaemon(self, connection, authkey):
+        """Stop the worker at the other end of connection and wait until it
+        no longer listens, so that another one can take its address"""
+        try:
+            connection.send({"type": "shutdown"})
+        except (OSError, EOFError):
+            pass
+        connection.close()
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while True:
+            try:
+                Client(self.address, authkey=authkey).close()
+            except (OSError, EOFError, AuthenticationError):
+                return
+            if time.monotonic() > deadline:
+                raise DaemonError("The worker process of another version did not stop")
+            time.sleep(0.2)
+
+    def _receive(self, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                break
+            with self._send_lock:
+                future = self._pending.pop(message.get("id"), None)
+            if future is not None:
+                future.set_result(message)
+
+        with self._connect_lock:
+            if self._connection is connection:
+                self._connection = None
+        with self._send_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(DaemonError("The worker process stopped"))
+
+    def _send(self, message, expect_answer=True):
+        """Send a request, return its id and a future of the answer"""
+        connection = self._connect()
+        request_id = next(self._request_ids)
+        future = Future()
+        with self._send_lock:
+            if expect_answer:
+                self._pending[request_id] = future
+            try:
+                connection.send(dict(message, id=request_id))
+            except (OSError, ValueError) as err:
+                self._pending.pop(request_id, None)
+                raise DaemonError("Could not reach the worker process: {}".format(err))
+        return request_id, future
+
+    def submitImport(self, data, variant_name="", variant_index=-1, reinstall=False):
+        """Ask the worker to do what an ImportJob does for data. Return the id
+        of the request and a future of the result, to give to data.applyResult"""
+        kind = next(k for k, data_class in DATA_CLASSES.items() if isinstance(data, data_class))
+        config = data.config if data.config is not None else getConfig()
+        return self._send({
+            "type": "import",
+            "kind": kind,
+            "url": data.url,
+            "texture_root": data.texture_root,
+            "config": vars(config),
+            "variant_name": variant_name,
+            "variant_index": variant_index,
+            "reinstall": reinstall,
+        })
+
+    def cancel(self, request_id):
+        if self._connection is None:
+            return
+        try:
+            self._send({"type": "cancel", "import_id": request_id}, expect_answer=False)
+        except DaemonError:
+            pass
+
+    def ping(self, timeout=DAEMON_START_TIMEOUT):
+        """Pid of the worker, starting it if needed"""
+        return self._send({"type": "ping"})[1].result(timeout)["pid"]
+
+    def shutdown(self):
+        """Stop the worker if it is running, even if other Blender instances use it"""
+        try:
+            connection = Client(self.address, authkey=getAuthKey())
+        except (OSError, EOFError, AuthenticationError):
+            return False
+        with connection:
+            connection.send({"type": "shutdown"})
+        return True
+
+# -----------------------------------------------------------------------------
+
+_client = None
+_client_lock = threading.Lock()
+
+def getDaemonClient(python=None):
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DaemonClient(python or sys.executable)
+        return _client
+
+def main():
+    try:
+        WorkerDaemon().serveForever()
+    except DaemonError as err:
+        print(err, flush=True)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
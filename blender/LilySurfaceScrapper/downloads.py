@@ -0,0 +1,385 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Download machinery shared by all scrappers. A variant is made of several maps
+that can be downloaded at the same time, so scrappers submit all of them at
+once to the download scheduler and wait for the whole set rather than fetching
+them one after the other. Each file is downloaded with downloadFile, which
+resumes interrupted transfers and never leaves a truncated file in place.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import wait
+
+import requests
+
+from . import sessions
+from .scheduler import getDownloadScheduler, PRIORITY_INTERACTIVE
+from .blobstore import fileSha256
+from .settings import (
+    DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_ATTEMPTS,
+    SEGMENTED_DOWNLOAD_MIN_SIZE, SEGMENT_TARGET_SIZE, SEGMENT_MAX_COUNT
+)
+
+class DownloadCancelled(Exception):
+    """Raised by downloads when asked to stop by their cancel event"""
+    pass
+
+class RemoteFileChanged(Exception):
+    """Raised when the remote file changed in the middle of a segmented download"""
+    pass
+
+# -----------------------------------------------------------------------------
+# Resumable downloads
+#
+# Files are first written to <path>.part next to a <path>.part.json record
+# telling which url is being downloaded and which version of it (ETag or
+# Last-Modified). The .part file is renamed into place only once complete, so
+# an interrupted download never looks like a cached file, and the record lets
+# the next attempt, possibly after Blender restarted, resume where it stopped.
+#
+# Large files are split into byte-range segments downloaded in parallel into a
+# preallocated .part file. Whether a file is large enough is told by the
+# headers of its first response, whose body is used for the first segment.
+# Other segments each wait for a slot of the scheduler, like separate files.
+# Their record lists the segments and which of them are complete, so that only
+# unfinished segments are downloaded again.
+
+def partPaths(path):
+    """Return the paths of the partial file and of its transfer record"""
+    return path + ".part", path + ".part.json"
+
+def _loadRecord(record_path, url):
+    try:
+        with open(record_path, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record.get("url") != url:
+        return None
+    return record
+
+def _saveRecord(record_path, record):
+    with open(record_path, "w") as f:
+        json.dump(record, f)
+
+def _totalSize(r):
+    """Full size of the remote file, or None if the server did not tell"""
+    if r.status_code == 206:
+        content_range = r.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length")
+    return int(length) if length is not None and length.isdigit() else None
+
+def _planSegments(url, r):
+    """Return the record of a segmented download if the file answered by the
+    full response r is large enough to be worth splitting and the server
+    accepts byte ranges, None otherwise"""
+    length = r.headers.get("Content-Length", "")
+    if r.status_code != 200 or r.headers.get("Accept-Ranges") != "bytes" or not length.isdigit():
+        return None
+    size = int(length)
+    if size < SEGMENTED_DOWNLOAD_MIN_SIZE:
+        return None
+
+    count = min(max(size // SEGMENT_TARGET_SIZE, 2), SEGMENT_MAX_COUNT)
+    segment_size = -(-size // count)
+    segments = [[start, min(start + segment_size, size), False] for start in range(0, size, segment_size)]
+    return {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "size": size,
+        "segments": segments,
+    }
+
+def _attemptSegmentedDownload(url, part_path, record_path, record, cancel, priority, meter, first_response=None):
+    """Download the unfinished segments of record in parallel. Each segment
+    but the one of the calling thread, which already holds a slot, waits for
+    its own slot from the scheduler, so that segments count against the
+    per-host limit. first_response is an optional response to a plain GET of
+    the file, whose body is used for the first segment."""
+    if not os.path.isfile(part_path) or os.path.getsize(part_path) != record["size"]:
+        # Preallocate, so that each segment can be written in place
+        with open(part_path, "wb") as f:
+            f.truncate(record["size"])
+        for segment in record["segments"]:
+            segment[2] = False
+    _saveRecord(record_path, record)
+
+    validator = record.get("etag") or record.get("last_modified")
+    record_lock = threading.Lock()
+    stop = threading.Event()
+
+    def fetchSegment(segment, r=None):
+        start, end, _ = segment
+        if r is None:
+            headers = {"Range": "bytes={}-{}".format(start, end - 1), "Accept-Encoding": "identity"}
+            if validator:
+                headers["If-Range"] = validator
+            r = sessions.get(url, stream=True, headers=headers)
+            if r.status_code == 200:
+                r.close()
+                raise RemoteFileChanged(url)
+            if r.status_code != 206:
+                r.close()
+                return False
+        written = 0
+        try:
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(url)
+                    # The body of a full response goes on after the segment
+                    chunk = chunk[:end - start - written]
+                    if meter is not None:
+                        meter(len(chunk))
+                    f.write(chunk)
+                    written += len(chunk)
+                    if written == end - start:
+                        break
+        finally:
+            r.close()
+        if written != end - start:
+            raise requests.exceptions.ChunkedEncodingError(
+                "Incomplete segment of {}: got {} bytes out of {}".format(url, written, end - start))
+        with record_lock:
+            segment[2] = True
+            _saveRecord(record_path, record)
+        return True
+
+    pending = [segment for segment in record["segments"] if not segment[2]]
+    first_segment = None
+    if first_response is not None and pending and pending[0][0] == 0:
+        first_segment = pending.pop(0)
+    queue_lock = threading.Lock()
+
+    def fetchPending():
+        """Fetch segments until there is none left, return False if one was
+        not found. Other threads stop as soon as one of them fails."""
+        while not stop.is_set():
+            with queue_lock:
+                if not pending:
+                    return True
+                segment = pending.pop(0)
+            try:
+                found = fetchSegment(segment)
+            except BaseException:
+                stop.set()
+                raise
+            if not found:
+                stop.set()
+                return False
+        return True
+
+    scheduler = getDownloadScheduler()
+    helper_count = len(pending) if first_segment is not None else len(pending) - 1
+    helpers = [scheduler.submit(url, fetchPending, priority=priority) for _ in range(helper_count)]
+    try:
+        if first_segment is not None:
+            try:
+                fetchSegment(first_segment, first_response)
+            except BaseException:
+                stop.set()
+                raise
+        ok = fetchPending()
+    finally:
+        # Helpers that did not get a slot yet are not needed anymore
+        for future in helpers:
+            future.cancel()
+        wait([future for future in helpers if not future.cancelled()])
+    for future in helpers:
+        if not future.cancelled() and not future.result():
+            ok = False
+    if not ok:
+        return False
+
+    # Verify the assembled file
+    if os.path.getsize(part_path) != record["size"] or not all(segment[2] for segment in record["segments"]):
+        raise requests.exceptions.ChunkedEncodingError("Incomplete download of {}".format(url))
+    return True
+
+def _hashPrefix(path, size):
+    """Hash of the first size bytes of a file, to resume hashing a stream"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while size > 0:
+            chunk = f.read(min(size, DOWNLOAD_CHUNK_SIZE))
+            if not chunk:
+                break
+            h.update(chunk)
+            size -= len(chunk)
+    return h
+
+def _attemptStreamDownload(url, part_path, record_path, record, cancel, info, priority, meter):
+    """Download the file, or its missing end, in a single stream, unless the
+    response tells that it is large enough to be split into segments.
+    The sha256 of the file is computed along and stored in info."""
+    offset = os.path.getsize(part_path) if record is not None and os.path.isfile(part_path) else 0
+
+    # Ask for raw bytes so that offsets in the partial file match the remote ones
+    headers = {"Accept-Encoding": "identity"}
+    if offset > 0:
+        headers["Range"] = "bytes={}-".format(offset)
+        validator = record.get("etag") or record.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    r = sessions.get(url, stream=True, headers=headers)
+    try:
+        if r.status_code == 416 and record is not None and record.get("size") == offset:
+            # The previous attempt actually got everything
+            return True
+        if r.status_code not in (200, 206):
+            return False
+        if r.status_code == 200:
+            # Either a first attempt or the server ignored/refused the range
+            offset = 0
+            segmented_record = _planSegments(url, r)
+            if segmented_record is not None:
+                return _attemptSegmentedDownload(url, part_path, record_path, segmented_record, cancel, priority, meter,
+                                                 first_response=r)
+
+        record = {
+            "url": url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "size": _totalSize(r),
+        }
+        _saveRecord(record_path, record)
+
+        h = _hashPrefix(part_path, offset) if offset > 0 else hashlib.sha256()
+        with open(part_path, "ab" if offset > 0 else "wb") as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(url)
+                if meter is not None:
+                    meter(len(chunk))
+                f.write(chunk)
+                h.update(chunk)
+        info["sha256"] = h.hexdigest()
+    finally:
+        r.close()
+
+    size = record["size"]
+    if size is not None and os.path.getsize(part_path) != size:
+        raise requests.exceptions.ChunkedEncodingError(
+            "Incomplete download of {}: got {} bytes out of {}".format(url, os.path.getsize(part_path), size))
+    return True
+
+def _attemptDownload(url, part_path, record_path, cancel, info, priority, meter):
+    """Make one attempt at completing part_path.
+    Return True when complete, False if the url is not available and raise
+    requests exceptions on network errors, leaving the partial file behind."""
+    info.pop("sha256", None)
+    record = _loadRecord(record_path, url)
+    if record is not None and "segments" in record:
+        return _attemptSegmentedDownload(url, part_path, record_path, record, cancel, priority, meter)
+    return _attemptStreamDownload(url, part_path, record_path, record, cancel, info, priority, meter)
+
+def isModified(url, etag=None, last_modified=None):
+    """Ask the server whether url changed since it was downloaded with the
+    given ETag or Last-Modified. Return None if it cannot tell."""
+    if not etag and not last_modified:
+        return None
+    headers = {"Accept-Encoding": "identity"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    # A GET rather than a HEAD, which some servers answer without validators.
+    # The body is not read when the file changed, it is downloaded afterwards.
+    r = sessions.get(url, stream=True, headers=headers)
+    r.close()
+    if r.status_code == 304:
+        return False
+    if r.status_code != 200:
+        return None
+    # Servers ignoring conditional requests still send the current validators
+    if etag:
+        return r.headers.get("ETag") != etag
+    return r.headers.get("Last-Modified") != last_modified
+
+def downloadFile(url, path, sha256=None, cancel=None, stats=None, priority=PRIORITY_INTERACTIVE, meter=None):
+    """Download url into path, resuming any previously interrupted transfer.
+    The file only appears at path once its size matches the Content-Length
+    announced by the server and, if provided, its hash matches sha256.
+    cancel is an optional threading.Event that interrupts the transfer, raising
+    DownloadCancelled and keeping the partial file for a later resume.
+    stats is an optional dict in which the number of retries is reported, as
+    well as the size, sha256, ETag and Last-Modified of the downloaded file.
+    The transfer waits for a slot of the given priority from the scheduler,
+    as do the additional segments of large files.
+    meter is an optional function called with the size of each received
+    chunk, which may raise DownloadCancelled to stop the transfer.
+    Return False if the file could not be downloaded."""
+    with getDownloadScheduler().slot(url, priority, cancel) as granted:
+        if not granted:
+            raise DownloadCancelled(url)
+        return _downloadFile(url, path, sha256, cancel, stats, priority, meter)
+
+def _downloadFile(url, path, sha256, cancel, stats, priority, meter):
+    part_path, record_path = partPaths(path)
+    if stats is None:
+        stats = {}
+    for attempt in range(DOWNLOAD_MAX_ATTEMPTS):
+        stats["retries"] = attempt
+        try:
+            if not _attemptDownload(url, part_path, record_path, cancel, stats, priority, meter):
+                return False
+        except sessions.ProviderUnavailable:
+            raise
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as err:
+            print("Download of {} interrupted ({}), resuming...".format(url, err))
+            continue
+        except RemoteFileChanged:
+            print("{} changed during download, starting over...".format(url))
+            os.remove(record_path)
+            continue
+
+        # Segmented downloads are written out of order, so they are hashed once complete
+        digest = stats.get("sha256") or fileSha256(part_path)
+        if sha256 is not None and digest != sha256:
+            print("Checksum mismatch for {}, downloading again...".format(url))
+            os.remove(part_path)
+            continue
+
+        record = _loadRecord(record_path, url) or {}
+        stats["sha256"] = digest
+        stats["size"] = os.path.getsize(part_path)
+        stats["etag"] = record.get("etag")
+        stats["last_modified"] = record.get("last_modified")
+        os.replace(part_path, path)
+        os.remove(record_path)
+        return True
+
+    print("Giving up downloading {} after {} attempts.".format(url, DOWNLOAD_MAX_ATTEMPTS))
+    return False
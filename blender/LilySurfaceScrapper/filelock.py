@@ -0,0 +1,283 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Advisory locks on directories, shared between processes. Several Blender
+instances, or render nodes, may use the same texture directory: downloading
+into a variant directory first takes its lock, so that an instance importing
+a variant that another one is downloading waits for it and then finds the
+files in place instead of downloading them again over the other's.
+
+A lock is a .lock file created exclusively in the directory, telling which
+process holds it. Within a process, it is held by a single thread at a time,
+which may take it again while holding it or let worker threads run under it
+(see DirectoryLock.share), and it is refreshed regularly, so that a lock left
+by a process that crashed is noticed either because its process is gone (same
+host) or because it got too old.
+
+The .lock file is only ever removed while holding the .lock.break file, also
+created exclusively, so that a process breaking a stale lock cannot remove a
+lock that another process took in the meantime.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+
+from .downloads import DownloadCancelled
+from .settings import LOCK_POLL_INTERVAL, LOCK_HEARTBEAT_INTERVAL, LOCK_STALE_TIMEOUT
+
+LOCK_FILENAME = ".lock"
+BREAK_SUFFIX = ".break"
+# The break lock is only held for the time of a few file operations
+BREAK_POLL_INTERVAL = 0.01
+
+class _HeldLock():
+    def __init__(self, path, token):
+        self.path = path
+        self.token = token
+        # Threads holding the lock, with how many times each took it
+        self.owners = {threading.get_ident(): 1}
+
+# Locks held by this process, by normalized directory
+_held = {}
+_held_lock = threading.Lock()
+_heartbeat_thread = None
+
+def _key(directory):
+    return os.path.normcase(os.path.abspath(directory))
+
+def _heartbeat():
+    while True:
+        time.sleep(LOCK_HEARTBEAT_INTERVAL)
+        with _held_lock:
+            paths = [held.path for held in _held.values()]
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+def _tryAcquire(directory):
+    """Take the lock of directory, or take it again if the calling thread
+    already holds it. Return None if another thread or process holds it."""
+    global _heartbeat_thread
+    key = _key(directory)
+    with _held_lock:
+        held = _held.get(key)
+        if held is not None:
+            owner = threading.get_ident()
+            if owner not in held.owners:
+                return None
+            held.owners[owner] += 1
+            return held
+        path = os.path.join(directory, LOCK_FILENAME)
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w") as f:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(), "token": token, "created": time.time()}, f)
+        held = _held[key] = _HeldLock(path, token)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat, name="LilyLockHeartbeat", daemon=True)
+            _heartbeat_thread.start()
+        return held
+
+def _release(directory, held):
+    owner = threading.get_ident()
+    with _held_lock:
+        held.owners[owner] -= 1
+        if held.owners[owner] > 0:
+            return
+        del held.owners[owner]
+        if held.owners:
+            return
+    # Without owners the lock can no longer be taken again nor shared, but it
+    # stays in _held until its file is removed so that it is not found stale.
+    # The break lock may take a while, other threads need _held_lock meanwhile.
+    try:
+        with _BreakLock(held.path):
+            # Do not remove a lock that another process took after breaking ours
+            if _readLock(held.path)[0].get("token") == held.token:
+                try:
+                    os.remove(held.path)
+                except OSError:
+                    pass
+    finally:
+        with _held_lock:
+            del _held[_key(directory)]
+
+def _readLock(path):
+    """Return the content of a lock file as a dict, and as raw bytes"""
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        return json.loads(content.decode("utf-8")), content
+    except FileNotFoundError:
+        return {}, None
+    except (OSError, ValueError):
+        # Being written
+        return {}, b""
+
+def _isRunning(pid):
+    if os.name == "nt":
+        # os.kill would send a console event, rely on the age of the lock
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _checkStale(path):
+    """Return whether the lock file at path was left by a process that
+    crashed, and the content it had when checked"""
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return False, None
+    info, content = _readLock(path)
+    if content is None:
+        return False, None
+    if time.time() - mtime > LOCK_STALE_TIMEOUT:
+        return True, content
+    if info.get("host") != socket.gethostname() or not isinstance(info.get("pid"), int):
+        return False, content
+    if info["pid"] == os.getpid():
+        with _held_lock:
+            return all(held.token != info.get("token") for held in _held.values()), content
+    return not _isRunning(info["pid"]), content
+
+class _BreakLock():
+    """Context manager holding the break lock of the lock file at path, which
+    is needed to remove the lock file. As the lock file is only created when
+    missing, its content cannot change while the break lock is held."""
+
+    def __init__(self, path):
+        self.path = path + BREAK_SUFFIX
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(self.path) > LOCK_STALE_TIMEOUT:
+                    # Left by a process that crashed while breaking a lock
+                    os.remove(self.path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(BREAK_POLL_INTERVAL)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def _breakStale(path, content):
+    """Remove the stale lock file at path, unless it changed since it was found stale"""
+    with _BreakLock(path):
+        if _readLock(path)[1] != content:
+            # Released, or broken and taken again by another process meanwhile
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def holdsLock(directory):
+    """Whether the calling thread holds the lock of directory"""
+    with _held_lock:
+        held = _held.get(_key(directory))
+        return held is not None and threading.get_ident() in held.owners
+
+def isLocked(directory):
+    """Whether a process, this one included, is downloading into directory"""
+    path = os.path.join(directory, LOCK_FILENAME)
+    return os.path.isfile(path) and not _checkStale(path)[0]
+
+class DirectoryLock():
+    """Context manager holding the lock of a directory. If another process
+    holds it, or another thread of this process, wait until it is released, or
+    found stale, checking the cancel event meanwhile, and raise
+    DownloadCancelled when it is set. The thread holding it may take it again."""
+
+    def __init__(self, directory, cancel=None):
+        self.directory = directory
+        self.cancel = cancel
+        # Whether another thread or process held the lock when we asked for it
+        self.waited = False
+        self._held = None
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, LOCK_FILENAME)
+        while True:
+            self._held = _tryAcquire(self.directory)
+            if self._held is not None:
+                return self
+            stale, content = _checkStale(path)
+            if stale:
+                print("Removing stale lock {}".format(path))
+                _breakStale(path, content)
+                continue
+            if not self.waited:
+                print("Waiting for another download into {}...".format(self.directory))
+                self.waited = True
+            if self.cancel is None:
+                time.sleep(LOCK_POLL_INTERVAL)
+            elif self.cancel.wait(LOCK_POLL_INTERVAL):
+                raise DownloadCancelled()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _release(self.directory, self._held)
+        self._held = None
+
+    def share(self, function):
+        """Wrap function so that it runs under this lock when called from
+        another thread, typically on the download scheduler. The thread
+        holding the lock must wait for these calls to end before releasing it."""
+        held = self._held
+        key = _key(self.directory)
+        def shared(*args, **kwargs):
+            owner = threading.get_ident()
+            with _held_lock:
+                if _held.get(key) is not held or not held.owners:
+                    raise DownloadCancelled(self.directory)
+                held.owners[owner] = held.owners.get(owner, 0) + 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _release(self.directory, held)
+        return shared
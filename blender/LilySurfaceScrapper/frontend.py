@@ -5,6 +5,7 @@
 # license. See the LICENSE.md file for the full text.
 
 import os
+import sys
 import bpy
 
 from .CyclesLightData import CyclesLightData
@@ -13,10 +14,22 @@ from .CyclesWorldData import CyclesWorldData
 from .ScrappersManager import ScrappersManager
 from .callback import register_callback, get_callback
 from .preferences import getPreferences
+from .config import Config
+from .jobs import ImportJob, RemoteImportJob, getRunningJobs, getJob
+from .daemon import getDaemonClient
+from .telemetry import getMetricsRegistry
+from .scheduler import getDownloadScheduler
+from .prefetch import getPrefetchBudget
+from .Scrappers.AbstractScrapper import AbstractScrapper
+from .settings import TEXTURE_CACHE_CHECK_INTERVAL
+from . import manifest
+from bpy.app.handlers import persistent
+from bpy_extras.io_utils import ExportHelper
 import bpy.utils.previews
 from bpy.props import EnumProperty
 import json
 import time
+import threading
 
 ## Operators
 
@@ -61,6 +74,23 @@ class CallbackProps:
         default=-1
     )
 
+def reportUpdatedFiles(operator, data):
+    """Tell which files a reinstall actually downloaded again"""
+    updated = data.getUpdatedFiles()
+    for path in updated:
+        print("Updated {}".format(path))
+    if updated:
+        names = ", ".join(os.path.basename(path) for path in updated)
+        operator.report({'INFO'}, "{} file(s) updated: {}".format(len(updated), names))
+    else:
+        operator.report({'INFO'}, "All textures were already up to date")
+
+def startPrefetch(context, data):
+    """Download what the variant prompt will likely lead to while it is open"""
+    pref = getPreferences(context)
+    if pref.prefetch_variants:
+        data.prefetch(pref.prefetch_budget * 1024 ** 2)
+
 ### Material
 
 class OBJECT_OT_LilySurfaceScrapper(ObjectPopupOperator, CallbackProps):
@@ -99,7 +129,7 @@ class OBJECT_OT_LilySurfaceScrapper(ObjectPopupOperator, CallbackProps):
             return {'CANCELLED'}
 
         texdir = os.path.dirname(bpy.data.filepath)
-        data = CyclesMaterialData(self.url, texture_root=texdir)
+        data = CyclesMaterialData(self.url, texture_root=texdir, config=Config.fromPreferences(pref))
         if data.error is not None:
             self.report({'ERROR_INVALID_INPUT'}, data.error)
             return {'CANCELLED'}
@@ -118,6 +148,7 @@ class OBJECT_OT_LilySurfaceScrapper(ObjectPopupOperator, CallbackProps):
         if selected_variant == -1:
             # More than one variant, prompt the user for which one she wants
             internal_states['skjhnvjkbg'] = data
+            startPrefetch(context, data)
             bpy.ops.object.lily_surface_prompt_variant('INVOKE_DEFAULT',
                 internal_state='skjhnvjkbg',
                 create_material=self.create_material,
@@ -192,10 +223,27 @@ class OBJECT_OT_LilySurfacePromptVariant(ObjectPopupOperator, CallbackProps):
         default=True
     )
 
+    background: bpy.props.BoolProperty(
+        name="Background",
+        description="Download the selected variant without blocking the interface",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=False
+    )
+
     def execute(self, context):
+        if self.background:
+            bpy.ops.object.lily_surface_import_background('INVOKE_DEFAULT',
+                internal_state=self.internal_state,
+                variant_index=int(self.variant),
+                reinstall=bool(self.reisntall),
+                create_material=self.create_material,
+                callback_handle=self.callback_handle)
+            return {'FINISHED'}
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
         data.selectVariant(int(self.variant))
+        if self.reisntall:
+            reportUpdatedFiles(self, data)
         if self.create_material:
             mat = data.createMaterial()
             context.object.active_material = mat
@@ -243,7 +291,7 @@ class OBJECT_OT_LilyWorldScrapper(PopupOperator, CallbackProps):
             return {'CANCELLED'}
 
         texdir = os.path.dirname(bpy.data.filepath)
-        data = CyclesWorldData(self.url, texture_root=texdir)
+        data = CyclesWorldData(self.url, texture_root=texdir, config=Config.fromPreferences(pref))
         if data.error is not None:
             self.report({'ERROR_INVALID_INPUT'}, data.error)
             return {'CANCELLED'}
@@ -262,6 +310,7 @@ class OBJECT_OT_LilyWorldScrapper(PopupOperator, CallbackProps):
         if selected_variant == -1:
             # More than one variant, prompt the user for which one she wants
             internal_states['zeilult'] = data
+            startPrefetch(context, data)
             bpy.ops.object.lily_world_prompt_variant('INVOKE_DEFAULT',
                 internal_state='zeilult',
                 create_world=self.create_world,
@@ -336,10 +385,27 @@ class OBJECT_OT_LilyWorldPromptVariant(PopupOperator, CallbackProps):
         default=True
     )
 
+    background: bpy.props.BoolProperty(
+        name="Background",
+        description="Download the selected variant without blocking the interface",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=False
+    )
+
     def execute(self, context):
+        if self.background:
+            bpy.ops.object.lily_world_import_background('INVOKE_DEFAULT',
+                internal_state=self.internal_state,
+                variant_index=int(self.variant),
+                reinstall=bool(self.reisntall),
+                create_world=self.create_world,
+                callback_handle=self.callback_handle)
+            return {'FINISHED'}
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
         data.selectVariant(int(self.variant))
+        if self.reisntall:
+            reportUpdatedFiles(self, data)
         if self.create_world:
             world = data.createWorld()
             context.scene.world = world
@@ -387,7 +453,7 @@ class OBJECT_OT_LilyLightScrapper(PopupOperator, CallbackProps):
             return {'CANCELLED'}
 
         texdir = os.path.dirname(bpy.data.filepath)
-        data = CyclesLightData(self.url, texture_root=texdir)
+        data = CyclesLightData(self.url, texture_root=texdir, config=Config.fromPreferences(pref))
         if data.error is not None:
             self.report({'ERROR_INVALID_INPUT'}, data.error)
             return {'CANCELLED'}
@@ -406,6 +472,7 @@ class OBJECT_OT_LilyLightScrapper(PopupOperator, CallbackProps):
         if selected_variant == -1:
             # More than one variant, prompt the user for which one she wants
             internal_states['kamour'] = data
+            startPrefetch(context, data)
             bpy.ops.object.lily_light_prompt_variant('INVOKE_DEFAULT',
                 internal_state='kamour',
                 callback_handle=self.callback_handle)
@@ -464,17 +531,559 @@ class OBJECT_OT_LilyLightPromptVariant(PopupOperator, CallbackProps):
         options={'HIDDEN', 'SKIP_SAVE'}
     )
 
+    background: bpy.props.BoolProperty(
+        name="Background",
+        description="Download the selected variant without blocking the interface",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=False
+    )
 
     def execute(self, context):
+        if self.background:
+            bpy.ops.object.lily_light_import_background('INVOKE_DEFAULT',
+                internal_state=self.internal_state,
+                variant_index=int(self.variant),
+                reinstall=bool(self.reisntall),
+                callback_handle=self.callback_handle)
+            return {'FINISHED'}
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
         data.selectVariant(int(self.variant))
+        if self.reisntall:
+            reportUpdatedFiles(self, data)
         data.createLights()
         cb = get_callback(self.callback_handle)
         cb(context)
         return {'FINISHED'}
 
 
+### Background imports
+
+class BackgroundImportOperator(CallbackProps):
+    """Common part of the operators importing without blocking the interface.
+    Scrapping and downloading run in an ImportJob on a worker thread, while a
+    modal timer polls the job and builds the Blender data on the main thread
+    once it is ready. Several such imports can run at the same time, each one
+    can be cancelled from the panel, and ESC cancels the last one started."""
+    bl_options = {'REGISTER', 'UNDO'}
+
+    # Set in subclasses
+    data_class = None
+    prompt_operator = ""
+
+    url: bpy.props.StringProperty(
+        name="URL",
+        description="Address from which importing",
+        default=""
+    )
+
+    variant: bpy.props.StringProperty(
+        name="Variant",
+        description="Look for the variant that has this name (for scripting access only)",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=""
+    )
+
+    variant_index: bpy.props.IntProperty(
+        name="Variant Index",
+        description="Index of the variant to download, as selected in the variant prompt",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=-1
+    )
+
+    reinstall: bpy.props.BoolProperty(
+        name="Reinstall Textures",
+        description="Reinstall the textures instead of using the ones present on the system",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=False
+    )
+
+    internal_state: bpy.props.StringProperty(
+        name="Internal State",
+        description="System property used to transfer the state of the operator",
+        options={'HIDDEN', 'SKIP_SAVE'}
+    )
+
+    def invoke(self, context, event):
+        if self.url == "" and self.internal_state == "":
+            return context.window_manager.invoke_props_dialog(self)
+        return self.execute(context)
+
+    def execute(self, context):
+        if self.internal_state != "":
+            data = internal_states[self.internal_state]
+        else:
+            pref = getPreferences(context)
+            if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+                self.report({'ERROR'}, 'You must save the file before using LilySurfaceScrapper')
+                return {'CANCELLED'}
+
+            texdir = os.path.dirname(bpy.data.filepath)
+            data = self.data_class(self.url, texture_root=texdir, config=Config.fromPreferences(pref))
+            if data.error is not None:
+                self.report({'ERROR_INVALID_INPUT'}, data.error)
+                return {'CANCELLED'}
+
+        self._target_name = context.object.name if context.object is not None else None
+        if getPreferences(context).use_worker_process:
+            self._job = RemoteImportJob(getDaemonClient(getPythonExecutable()), data,
+                variant_name=self.variant,
+                variant_index=self.variant_index,
+                reinstall=self.reinstall)
+        else:
+            self._job = ImportJob(data,
+                variant_name=self.variant,
+                variant_index=self.variant_index,
+                reinstall=self.reinstall)
+        self._job.start()
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.25, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def getTarget(self):
+        """The object that was active when the import started"""
+        if self._target_name is None:
+            return None
+        return bpy.data.objects.get(self._target_name)
+
+    def modal(self, context, event):
+        job = self._job
+        if event.type == 'ESC' and event.value == 'PRESS' and not job.cancelled:
+            # Handlers of the imports started before this one get the next ESC
+            job.cancel()
+            return {'RUNNING_MODAL'}
+        if event.type != 'TIMER' or not job.isDone():
+            return {'PASS_THROUGH'}
+
+        context.window_manager.event_timer_remove(self._timer)
+        job.forget()
+        if self.internal_state != "":
+            internal_states.pop(self.internal_state, None)
+        for area in context.screen.areas:
+            area.tag_redraw()
+
+        if job.cancelled:
+            self.report({'WARNING'}, "Import cancelled: {}".format(job.label))
+            return {'CANCELLED'}
+        if job.error is not None:
+            self.report({'ERROR'}, job.error)
+            return {'CANCELLED'}
+        if job.needs_variant:
+            # More than one variant, prompt the user for which one she wants
+            internal_state = "background-{}".format(job.id)
+            internal_states[internal_state] = job.data
+            if not isinstance(job, RemoteImportJob):
+                startPrefetch(context, job.data)
+            self.promptVariant(internal_state)
+            return {'FINISHED'}
+
+        if self.reinstall:
+            reportUpdatedFiles(self, job.data)
+        self.finish(context, job.data)
+        cb = get_callback(self.callback_handle)
+        cb(context)
+        return {'FINISHED'}
+
+    def promptVariant(self, internal_state):
+        getattr(bpy.ops.object, self.prompt_operator)('INVOKE_DEFAULT',
+            internal_state=internal_state,
+            background=True,
+            callback_handle=self.callback_handle)
+
+    def finish(self, context, data):
+        """Build Blender data on the main thread, implement in subclasses"""
+        raise NotImplementedError
+
+class OBJECT_OT_LilySurfaceScrapperBackground(BackgroundImportOperator, bpy.types.Operator):
+    """Import a material without blocking the interface while textures are downloaded"""
+    bl_idname = "object.lily_surface_import_background"
+    bl_label = "Import Surface in Background"
+
+    data_class = CyclesMaterialData
+    prompt_operator = "lily_surface_prompt_variant"
+
+    create_material: bpy.props.BoolProperty(
+        name="Create Material",
+        description="Create the material associated with downloaded maps",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=True
+    )
+
+    @classmethod
+    def poll(cls, context):
+        return context.active_object is not None
+
+    def promptVariant(self, internal_state):
+        bpy.ops.object.lily_surface_prompt_variant('INVOKE_DEFAULT',
+            internal_state=internal_state,
+            background=True,
+            create_material=self.create_material,
+            callback_handle=self.callback_handle)
+
+    def finish(self, context, data):
+        if self.create_material:
+            mat = data.createMaterial()
+            target = self.getTarget()
+            if target is not None:
+                target.active_material = mat
+        else:
+            data.loadImages()
+
+class OBJECT_OT_LilyWorldScrapperBackground(BackgroundImportOperator, bpy.types.Operator):
+    """Import a world without blocking the interface while textures are downloaded"""
+    bl_idname = "object.lily_world_import_background"
+    bl_label = "Import World in Background"
+
+    data_class = CyclesWorldData
+    prompt_operator = "lily_world_prompt_variant"
+
+    create_world: bpy.props.BoolProperty(
+        name="Create World",
+        description="Create the world associated with downloaded maps",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=True
+    )
+
+    def promptVariant(self, internal_state):
+        bpy.ops.object.lily_world_prompt_variant('INVOKE_DEFAULT',
+            internal_state=internal_state,
+            background=True,
+            create_world=self.create_world,
+            callback_handle=self.callback_handle)
+
+    def finish(self, context, data):
+        if self.create_world:
+            world = data.createWorld()
+            context.scene.world = world
+        else:
+            data.loadImages()
+
+class OBJECT_OT_LilyLightScrapperBackground(BackgroundImportOperator, bpy.types.Operator):
+    """Import a light without blocking the interface while data is downloaded"""
+    bl_idname = "object.lily_light_import_background"
+    bl_label = "Import Light in Background"
+
+    data_class = CyclesLightData
+    prompt_operator = "lily_light_prompt_variant"
+
+    def finish(self, context, data):
+        # createLights works on the active object, make sure it is still the
+        # light from which the import was started
+        target = self.getTarget()
+        if target is not None and context.view_layer.objects.active != target:
+            context.view_layer.objects.active = target
+        data.createLights()
+
+class WM_OT_LilyCancelImport(bpy.types.Operator):
+    """Cancel an import running in the background"""
+    bl_idname = "wm.lily_cancel_import"
+    bl_label = "Cancel Import"
+
+    job_id: bpy.props.IntProperty(
+        name="Job",
+        options={'HIDDEN', 'SKIP_SAVE'},
+        default=-1
+    )
+
+    def execute(self, context):
+        job = getJob(self.job_id)
+        if job is not None:
+            job.cancel()
+        return {'FINISHED'}
+
+def drawBackgroundImports(layout):
+    jobs = getRunningJobs()
+    if not jobs:
+        return
+    layout.label(text="Running imports:")
+    for job in jobs:
+        row = layout.row(align=True)
+        row.label(text="{} ({})".format(job.label, job.status))
+        row.operator("wm.lily_cancel_import", text="", icon='CANCEL').job_id = job.id
+
+
+### Worker process
+
+def getPythonExecutable():
+    """Python interpreter bundled with Blender, to run the worker process"""
+    # sys.executable is Blender itself before 2.92
+    return getattr(bpy.app, "binary_path_python", "") or sys.executable
+
+class WM_OT_LilyStopWorker(bpy.types.Operator):
+    """Stop the worker process running background imports, it starts again with the next import"""
+    bl_idname = "wm.lily_stop_worker"
+    bl_label = "Stop Worker Process"
+
+    def execute(self, context):
+        if getDaemonClient(getPythonExecutable()).shutdown():
+            self.report({'INFO'}, "Worker process stopped")
+        else:
+            self.report({'INFO'}, "No worker process is running")
+        return {'FINISHED'}
+
+### Download statistics
+
+def formatSize(nbytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if nbytes < 1024 or unit == "GB":
+            return "{:.1f} {}".format(nbytes, unit)
+        nbytes /= 1024
+
+class WM_OT_LilyDownloadStats(bpy.types.Operator):
+    """Show download statistics per texture provider since Blender started"""
+    bl_idname = "wm.lily_download_stats"
+    bl_label = "Download Statistics"
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_popup(self, width=600)
+
+    def execute(self, context):
+        return {'FINISHED'}
+
+    def draw(self, context):
+        layout = self.layout
+        stats = getMetricsRegistry().aggregates()
+        if not stats:
+            layout.label(text="Nothing downloaded yet.")
+            return
+        for provider, provider_stats in sorted(stats.items()):
+            box = layout.box()
+            box.label(text=provider, icon='URL')
+            for url_class, s in sorted(provider_stats.items()):
+                row = box.row()
+                row.label(text=url_class)
+                row.label(text="{} fetches, {} cached".format(s["count"], s["cache_hits"]))
+                row.label(text="{} in {:.1f}s".format(formatSize(s["bytes"]), s["time"]))
+                row.label(text="{}/s, {} retries".format(formatSize(s["throughput"]), s["retries"]))
+        layout.operator("wm.lily_export_download_stats")
+
+class WM_OT_LilyExportDownloadStats(bpy.types.Operator, ExportHelper):
+    """Export download statistics and the list of all fetches to a JSON file"""
+    bl_idname = "wm.lily_export_download_stats"
+    bl_label = "Export Download Statistics"
+
+    filename_ext = ".json"
+
+    filter_glob: bpy.props.StringProperty(
+        default="*.json",
+        options={'HIDDEN'},
+    )
+
+    def execute(self, context):
+        getMetricsRegistry().exportJson(self.filepath)
+        self.report({'INFO'}, "Download statistics exported to {}".format(self.filepath))
+        return {'FINISHED'}
+
+### Texture deduplication
+
+class WM_OT_LilyDedupeTextures(bpy.types.Operator):
+    """Look for identical maps in the texture directory, and replace them by links to the texture store"""
+    bl_idname = "wm.lily_dedupe_textures"
+    bl_label = "Deduplicate Textures"
+
+    compact: bpy.props.BoolProperty(
+        name="Compact",
+        description="Replace duplicated maps by links rather than only reporting them",
+        default=False,
+    )
+
+    def execute(self, context):
+        pref = getPreferences(context)
+        if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+            self.report({'ERROR'}, 'You must save the file before using LilySurfaceScrapper')
+            return {'CANCELLED'}
+
+        scrapper = AbstractScrapper(texture_root=os.path.dirname(bpy.data.filepath), config=Config.fromPreferences(pref))
+        store = scrapper.getBlobStore()
+        if store is None:
+            self.report({'ERROR'}, 'Texture deduplication is disabled in the add-on preferences')
+            return {'CANCELLED'}
+
+        root = scrapper.getTextureDirectory("")
+        if self.compact:
+            freed = store.compact(root)
+            self.report({'INFO'}, "Freed {} in {}".format(formatSize(freed), root))
+        else:
+            report = store.analyze(root)
+            self.report({'INFO'}, "{} files, {} distinct, {} already deduplicated, compacting would free {}".format(
+                report["files"], report["unique"], report["linked"], formatSize(report["wasted_bytes"])))
+        return {'FINISHED'}
+
+### Texture cache quota
+
+def getPinnedFiles():
+    """Files used by the open blend file, which must not be evicted"""
+    paths = [bpy.path.abspath(image.filepath, library=image.library)
+             for image in bpy.data.images if image.filepath and image.users > 0]
+    paths += [bpy.path.abspath(text.filepath) for text in bpy.data.texts if text.filepath]
+    for light in bpy.data.lights:
+        if light.node_tree is not None:
+            paths += [bpy.path.abspath(node.filepath) for node in light.node_tree.nodes
+                      if node.type == 'TEX_IES' and node.filepath]
+    return paths
+
+def getTextureQuota(context=None):
+    """Return the cache manager of the texture directory, its quota in bytes
+    and the files pinned by the open blend file, or None if there is no quota.
+    Must be called from the main thread."""
+    pref = getPreferences(context)
+    if pref.texture_cache_quota <= 0:
+        return None
+    if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+        return None
+    scrapper = AbstractScrapper(texture_root=os.path.dirname(bpy.data.filepath), config=Config.fromPreferences(pref))
+    quota = int(pref.texture_cache_quota * 1024 ** 3)
+    return scrapper.getCacheManager(), quota, getPinnedFiles()
+
+def enforceTextureQuota(context=None):
+    """Evict least recently used variants beyond the quota set in preferences.
+    Return the list of evicted directories, or None if there is no quota."""
+    texture_quota = getTextureQuota(context)
+    if texture_quota is None:
+        return None
+    cache_manager, quota, pinned = texture_quota
+    evicted = cache_manager.enforceQuota(quota, pinned=pinned)
+    return [entry.path for entry in evicted]
+
+_quota_thread = None
+
+def checkTextureQuota():
+    """Timer enforcing the quota regularly. Walking the texture directory
+    takes a while, so it is done on a background thread."""
+    global _quota_thread
+    if _quota_thread is not None and _quota_thread.is_alive():
+        return TEXTURE_CACHE_CHECK_INTERVAL
+    try:
+        texture_quota = getTextureQuota()
+    except KeyError:
+        # The add-on got disabled
+        return None
+    if texture_quota is not None:
+        cache_manager, quota, pinned = texture_quota
+        _quota_thread = threading.Thread(target=cache_manager.enforceQuota, args=(quota, pinned),
+                                         name="LilyTextureQuota", daemon=True)
+        _quota_thread.start()
+    return TEXTURE_CACHE_CHECK_INTERVAL
+
+def reclaimPrefetchedTextures(context):
+    """Evict prefetched variants that were never used.
+    Return the list of evicted directories, or None if the file must be saved first."""
+    pref = getPreferences(context)
+    if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+        return None
+    scrapper = AbstractScrapper(texture_root=os.path.dirname(bpy.data.filepath), config=Config.fromPreferences(pref))
+    evicted = scrapper.getCacheManager().reclaimPrefetched(pinned=getPinnedFiles())
+    return [entry.path for entry in evicted]
+
+class WM_OT_LilyFreeTextureCache(bpy.types.Operator):
+    """Remove the least recently used variants until the texture directory fits in its quota"""
+    bl_idname = "wm.lily_free_texture_cache"
+    bl_label = "Free Texture Cache"
+
+    prefetched_only: bpy.props.BoolProperty(
+        name="Prefetched Only",
+        description="Only remove the variants that were prefetched but never used",
+        default=False,
+    )
+
+    def execute(self, context):
+        if self.prefetched_only:
+            evicted = reclaimPrefetchedTextures(context)
+            if evicted is None:
+                self.report({'ERROR'}, 'You must save the file before using LilySurfaceScrapper')
+                return {'CANCELLED'}
+            self.report({'INFO'}, "Removed {} prefetched variants".format(len(evicted)))
+            return {'FINISHED'}
+        evicted = enforceTextureQuota(context)
+        if evicted is None:
+            self.report({'ERROR'}, 'No texture cache quota is set, or the file must be saved first')
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Removed {} variants from the texture cache".format(len(evicted)))
+        return {'FINISHED'}
+
+### Texture verification
+
+class WM_OT_LilyVerifyTextures(bpy.types.Operator):
+    """Check downloaded files against the size and hash recorded when they were downloaded"""
+    bl_idname = "wm.lily_verify_textures"
+    bl_label = "Verify Textures"
+
+    repair: bpy.props.BoolProperty(
+        name="Repair",
+        description="Download again the files that are missing or corrupted",
+        default=False,
+    )
+
+    def execute(self, context):
+        pref = getPreferences(context)
+        if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+            self.report({'ERROR'}, 'You must save the file before using LilySurfaceScrapper')
+            return {'CANCELLED'}
+
+        scrapper = AbstractScrapper(texture_root=os.path.dirname(bpy.data.filepath), config=Config.fromPreferences(pref))
+        root = scrapper.getTextureDirectory("")
+        store = scrapper.getBlobStore()
+        repair = self.repair
+        self._result = result = {}
+
+        def run():
+            try:
+                checked, broken = manifest.verifyCache(root, exclude=store.directory if store is not None else None)
+                repaired = 0
+                if repair:
+                    repaired = manifest.repairFiles(broken, store)
+                result.update(checked=checked, broken=broken, repaired=repaired)
+            except Exception as err:
+                result["error"] = str(err)
+
+        self._thread = threading.Thread(target=run, name="LilyVerify", daemon=True)
+        self._thread.start()
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type != 'TIMER' or self._thread.is_alive():
+            return {'PASS_THROUGH'}
+        context.window_manager.event_timer_remove(self._timer)
+
+        result = self._result
+        if "error" in result:
+            self.report({'ERROR'}, "Verification failed: {}".format(result["error"]))
+            return {'CANCELLED'}
+        for broken in result["broken"]:
+            print("{} is {}".format(broken.path, {
+                "missing": "missing", "size": "truncated", "hash": "corrupted",
+            }[broken.reason]))
+        message = "{} files checked, {} broken".format(result["checked"], len(result["broken"]))
+        if self.repair:
+            message += ", {} repaired".format(result["repaired"])
+        self.report({'WARNING'} if len(result["broken"]) > result["repaired"] else {'INFO'}, message)
+        return {'FINISHED'}
+
+### Download catalog
+
+class WM_OT_LilyRebuildCatalog(bpy.types.Operator):
+    """List again the assets and variants found in the texture directory, for caches filled by another version or by hand"""
+    bl_idname = "wm.lily_rebuild_catalog"
+    bl_label = "Rebuild Download Catalog"
+
+    def execute(self, context):
+        pref = getPreferences(context)
+        if bpy.data.filepath == '' and not os.path.isabs(pref.texture_dir):
+            self.report({'ERROR'}, 'You must save the file before using LilySurfaceScrapper')
+            return {'CANCELLED'}
+
+        scrapper = AbstractScrapper(texture_root=os.path.dirname(bpy.data.filepath), config=Config.fromPreferences(pref))
+        store = scrapper.getBlobStore()
+        assets, variants = scrapper.getCatalog().rebuild(exclude=store.directory if store is not None else None)
+        self.report({'INFO'}, "Found {} assets and {} downloaded variants".format(assets, variants))
+        return {'FINISHED'}
+
+
 # todo create new popup variants for local
 
 
@@ -497,6 +1106,8 @@ class MATERIAL_PT_LilySurfaceScrapper(bpy.types.Panel):
         else:
             layout.operator("object.lily_surface_import")
             layout.operator("object.lily_surface_import_from_clipboard")
+            layout.operator("object.lily_surface_import_background")
+            drawBackgroundImports(layout)
             layout.label(text="Available sources:")
             urls = {None}  # avoid doubles
             for S in ScrappersManager.getScrappersList():
@@ -532,6 +1143,8 @@ class WORLD_PT_LilySurfaceScrapper(bpy.types.Panel):
         else:
             layout.operator("object.lily_world_import")
             layout.operator("object.lily_world_import_from_clipboard")
+            layout.operator("object.lily_world_import_background")
+            drawBackgroundImports(layout)
             layout.label(text="Available sources:")
             urls = {None}  # avoid doubles
             for S in ScrappersManager.getScrappersList():
@@ -570,6 +1183,8 @@ class LIGHT_PT_LilySurfaceScrapper(bpy.types.Panel):
         else:
             layout.operator("object.lily_light_import")
             layout.operator("object.lily_light_import_from_clipboard")
+            layout.operator("object.lily_light_import_background")
+            drawBackgroundImports(layout)
             layout.label(text="Available sources:")
             urls = {None}  # avoid doubles
             for S in ScrappersManager.getScrappersList():
@@ -586,6 +1201,17 @@ class LIGHT_PT_LilySurfaceScrapper(bpy.types.Panel):
                                                show_labels=True)
                     urls.add(S.home_url)
 
+## Render handlers
+
+@persistent
+def pauseDownloadsDuringRender(scene, *args):
+    """Leave the bandwidth to the render, e.g. for network render farms"""
+    getDownloadScheduler().pause()
+
+@persistent
+def resumeDownloadsAfterRender(scene, *args):
+    getDownloadScheduler().resume()
+
 ## Registration
 
 
@@ -608,35 +1234,17 @@ def thumbnailGeneratorGenerator(scraper):
                 "", "missing_thumbnail")
             custom_icons.load("missing_thumbnail", missingThumb, 'IMAGE')
 
-        basedir = Scraper.getTextureDirectory(scraper.home_dir)
-
-        for i in os.listdir(basedir):
-            if not os.path.isdir(os.path.join(basedir, i)):
-                continue
-            thumbnail = None
+        for i, url, thumbnail in Scraper.getCatalog().assets(scraper.home_dir):
             if i in registeredThumbnails:
                 items[i] = f"thumb_{scraper.__class__}-{i.replace(' ', '_')}"
                 continue
-            metadataFile = os.path.join(basedir, i, scraper.metadataFilename)
-            name = ""
-            for j in os.listdir(os.path.join(basedir, i)):
-                if "thumbnail" in j:
-                    thumbnail = os.path.join(basedir, i, j)
-                    name += f"thumb_{scraper.__class__}-{i.replace(' ', '_')}"
-                    break
-            else:
-                if os.path.isfile(metadataFile):
-                    with open(metadataFile, "r") as fl:
-                        try:
-                            data = dict(json.load(fl))
-                            if "url" in data and data["url"] in lastChecks and \
-                                    time.time() - lastChecks[data["url"]] >= 5 * 60:
-                                thumbnail = Scraper.getAndSaveThumbnail(data["url"])
-                                lastChecks[data["url"]] = time.time()
-                        except json.decoder.JSONDecodeError:
-                            pass
-                        except ValueError:
-                            pass
+            name = f"thumb_{scraper.__class__}-{i.replace(' ', '_')}"
+            if thumbnail is None or not os.path.isfile(thumbnail):
+                thumbnail = None
+                if url is not None and url in lastChecks and \
+                        time.time() - lastChecks[url] >= 5 * 60:
+                    thumbnail = Scraper.getAndSaveThumbnail(url)
+                    lastChecks[url] = time.time()
                 if thumbnail is None:
                     # print("missing thumbnail",i)
                     items[i] = "missing_thumbnail"
@@ -722,6 +1330,22 @@ def register():
     bpy.utils.register_class(OBJECT_OT_LilyLightScrapper)
     bpy.utils.register_class(OBJECT_OT_LilyClipboardLightScrapper)
     bpy.utils.register_class(OBJECT_OT_LilyLightPromptVariant)
+    bpy.utils.register_class(OBJECT_OT_LilySurfaceScrapperBackground)
+    bpy.utils.register_class(OBJECT_OT_LilyWorldScrapperBackground)
+    bpy.utils.register_class(OBJECT_OT_LilyLightScrapperBackground)
+    bpy.utils.register_class(WM_OT_LilyCancelImport)
+    bpy.utils.register_class(WM_OT_LilyStopWorker)
+    bpy.utils.register_class(WM_OT_LilyDownloadStats)
+    bpy.utils.register_class(WM_OT_LilyExportDownloadStats)
+    bpy.utils.register_class(WM_OT_LilyDedupeTextures)
+    bpy.utils.register_class(WM_OT_LilyFreeTextureCache)
+    bpy.utils.register_class(WM_OT_LilyVerifyTextures)
+    bpy.utils.register_class(WM_OT_LilyRebuildCatalog)
+
+    bpy.app.handlers.render_pre.append(pauseDownloadsDuringRender)
+    bpy.app.handlers.render_post.append(resumeDownloadsAfterRender)
+    bpy.app.handlers.render_cancel.append(resumeDownloadsAfterRender)
+    bpy.app.timers.register(checkTextureQuota, first_interval=TEXTURE_CACHE_CHECK_INTERVAL, persistent=True)
 
     for S in ScrappersManager.getScrappersList():
         setattr(bpy.types.Object, S.__name__, EnumProperty(options={"SKIP_SAVE"}, items=thumbnailGeneratorGenerator(S),
@@ -741,6 +1365,28 @@ def unregister():
     bpy.utils.unregister_class(OBJECT_OT_LilyLightScrapper)
     bpy.utils.unregister_class(OBJECT_OT_LilyClipboardLightScrapper)
     bpy.utils.unregister_class(OBJECT_OT_LilyLightPromptVariant)
+    bpy.utils.unregister_class(OBJECT_OT_LilySurfaceScrapperBackground)
+    bpy.utils.unregister_class(OBJECT_OT_LilyWorldScrapperBackground)
+    bpy.utils.unregister_class(OBJECT_OT_LilyLightScrapperBackground)
+    bpy.utils.unregister_class(WM_OT_LilyStopWorker)
+    bpy.utils.unregister_class(WM_OT_LilyCancelImport)
+    bpy.utils.unregister_class(WM_OT_LilyDownloadStats)
+    bpy.utils.unregister_class(WM_OT_LilyExportDownloadStats)
+    bpy.utils.unregister_class(WM_OT_LilyDedupeTextures)
+    bpy.utils.unregister_class(WM_OT_LilyFreeTextureCache)
+    bpy.utils.unregister_class(WM_OT_LilyRebuildCatalog)
+    bpy.utils.unregister_class(WM_OT_LilyVerifyTextures)
+
+    bpy.app.handlers.render_pre.remove(pauseDownloadsDuringRender)
+    bpy.app.handlers.render_post.remove(resumeDownloadsAfterRender)
+    bpy.app.handlers.render_cancel.remove(resumeDownloadsAfterRender)
+    if bpy.app.timers.is_registered(checkTextureQuota):
+        bpy.app.timers.unregister(checkTextureQuota)
+    getDownloadScheduler().resume()
+
+    for job in getRunningJobs():
+        job.cancel()
+    getPrefetchBudget().flush()
 
     for S in ScrappersManager.getScrappersList():
         if hasattr(bpy.types.Object, S.__name__):
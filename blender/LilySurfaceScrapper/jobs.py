@@ -0,0 +1,161 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Background imports. An ImportJob runs the scrapping and downloading part of an
+import, i.e. everything but the creation of Blender data, on a worker thread.
+This module must not use the Blender API: the operators in frontend poll jobs
+from a modal timer and build materials, worlds and lights on the main thread.
+"""
+
+import itertools
+import threading
+import traceback
+
+from .downloads import DownloadCancelled
+
+_job_ids = itertools.count(1)
+_running_jobs = {}
+_running_jobs_lock = threading.Lock()
+
+def getRunningJobs():
+    with _running_jobs_lock:
+        return list(_running_jobs.values())
+
+def getJob(job_id):
+    with _running_jobs_lock:
+        return _running_jobs.get(job_id)
+
+class ImportJob():
+    def __init__(self, data, variant_name="", variant_index=-1, reinstall=False):
+        """data: a ScrappedData (MaterialData, WorldData or LightData)
+        variant_name, variant_index: the variant to download, if known. When
+        neither is provided and there are several variants, the job stops after
+        listing them and needs_variant tells the user must be prompted."""
+        self.id = next(_job_ids)
+        self.data = data
+        self.variant_name = variant_name
+        self.variant_index = variant_index
+        self.reinstall = reinstall
+        self.label = data.url
+        self.status = "Waiting"
+        self.error = None
+        self.needs_variant = False
+        self.cancelled = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="LilyImport-{}".format(self.id), daemon=True)
+
+    def start(self):
+        with _running_jobs_lock:
+            _running_jobs[self.id] = self
+        self._thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+        self.status = "Cancelling"
+        self.data.cancel()
+
+    def run(self):
+        """Run the job in the calling thread"""
+        self._run()
+
+    def isDone(self):
+        return self._done.is_set()
+
+    def forget(self):
+        """Remove the job from the list of running jobs shown in the UI"""
+        with _running_jobs_lock:
+            _running_jobs.pop(self.id, None)
+
+    def _selectVariantIndex(self, variants):
+        if self.variant_index >= 0:
+            return self.variant_index
+        if not variants or len(variants) == 1:
+            return 0
+        for i, v in enumerate(variants):
+            if v == self.variant_name:
+                return i
+        return -1
+
+    def _run(self):
+        try:
+            self.status = "Listing variants"
+            variants = self.data.getVariantList()
+            if self.data.error is not None:
+                self.error = self.data.error
+                return
+
+            selected_variant = self._selectVariantIndex(variants)
+            if selected_variant == -1:
+                self.needs_variant = True
+                return
+
+            if self.cancelled:
+                return
+            self.status = "Downloading"
+            self.data.setReinstall(self.reinstall)
+            if not self.data.selectVariant(selected_variant):
+                self.error = self.data.error or self.data.getScrapperError() or "Could not download variant"
+        except DownloadCancelled:
+            self.cancelled = True
+        except Exception as err:
+            traceback.print_exc()
+            self.error = "Import failed: {}".format(err)
+        finally:
+            self.status = "Done"
+            self._done.set()
+
+class RemoteImportJob(ImportJob):
+    """ImportJob run by the worker process, see daemon. Only its result,
+    i.e. the variants and downloaded maps, is applied to data."""
+
+    def __init__(self, client, data, variant_name="", variant_index=-1, reinstall=False):
+        """client: a daemon.DaemonClient"""
+        super().__init__(data, variant_name, variant_index, reinstall)
+        self.client = client
+        self._request_id = None
+
+    def cancel(self):
+        super().cancel()
+        if self._request_id is not None:
+            self.client.cancel(self._request_id)
+
+    def _run(self):
+        try:
+            self.status = "Waiting for the worker process"
+            self._request_id, future = self.client.submitImport(
+                self.data, self.variant_name, self.variant_index, self.reinstall)
+            if self.cancelled:
+                self.client.cancel(self._request_id)
+            self.status = "Downloading"
+            result = future.result()
+            self.data.applyResult(result)
+            self.error = result["error"]
+            self.needs_variant = result["needs_variant"]
+            self.cancelled = self.cancelled or result["cancelled"]
+        except Exception as err:
+            traceback.print_exc()
+            self.error = "Import failed: {}".format(err)
+        finally:
+            self.status = "Done"
+            self._done.set()
@@ -0,0 +1,198 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Integrity manifests. Each directory of downloaded files (typically a variant)
+has a manifest recording where each file comes from, its size and its sha256,
+which downloads compute while streaming. It tells whether a variant is really
+complete, and lets the cache be verified and broken files repaired by fetching
+them again, without reinstalling whole variants.
+"""
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .blobstore import fileSha256, IGNORED_DIRS
+from .downloads import downloadFile
+from .filelock import DirectoryLock
+from .remotezip import RemoteZip, RemoteZipError
+from .settings import VERIFY_MAX_WORKERS
+
+MANIFEST_FILENAME = ".manifest.json"
+
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+def _getLock(directory):
+    with _manifest_locks_lock:
+        return _manifest_locks.setdefault(os.path.normcase(os.path.abspath(directory)), threading.Lock())
+
+def loadManifest(directory):
+    """Return the dict filename -> entry of a directory, or None if it has no manifest"""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), "r") as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def updateManifest(directory, filename, url, size, sha256, etag=None, last_modified=None, member=None):
+    """Record a file of directory. filename may contain slashes for files in
+    sub-directories, member is the name of the file in the archive at url
+    when it was extracted from one."""
+    entry = {
+        "url": url,
+        "size": size,
+        "sha256": sha256,
+        "etag": etag,
+        "last_modified": last_modified,
+    }
+    if member is not None:
+        entry["member"] = member
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    with _getLock(directory):
+        files = loadManifest(directory) or {}
+        files[filename] = entry
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump({"files": files}, f, indent=1)
+        os.replace(tmp_path, path)
+
+def isComplete(directory):
+    """Whether all files of the manifest are present with the right size.
+    Directories downloaded before manifests existed are considered complete."""
+    files = loadManifest(directory)
+    if files is None:
+        return os.path.isdir(directory)
+    for filename, entry in files.items():
+        path = os.path.join(directory, *filename.split("/"))
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            return False
+    return True
+
+# -----------------------------------------------------------------------------
+# Verification and repair
+
+class BrokenFile():
+    def __init__(self, directory, filename, entry, reason):
+        self.directory = directory
+        self.filename = filename
+        self.entry = entry
+        # 'missing', 'size' or 'hash'
+        self.reason = reason
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, *self.filename.split("/"))
+
+def findManifests(root, exclude=None):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames
+                       if d not in IGNORED_DIRS and os.path.join(dirpath, d) != exclude]
+        if MANIFEST_FILENAME in filenames:
+            yield dirpath
+
+def verifyFile(directory, filename, entry):
+    """Return a BrokenFile, or None if the file is intact"""
+    path = os.path.join(directory, *filename.split("/"))
+    if not os.path.isfile(path):
+        return BrokenFile(directory, filename, entry, "missing")
+    if os.path.getsize(path) != entry["size"]:
+        return BrokenFile(directory, filename, entry, "size")
+    if fileSha256(path) != entry["sha256"]:
+        return BrokenFile(directory, filename, entry, "hash")
+    return None
+
+def verifyCache(root, exclude=None, max_workers=VERIFY_MAX_WORKERS):
+    """Check all files listed in the manifests under root, several at once.
+    Return the number of files checked and the list of broken ones."""
+    tasks = []
+    for directory in findManifests(root, exclude):
+        for filename, entry in (loadManifest(directory) or {}).items():
+            tasks.append((directory, filename, entry))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="LilyVerify") as executor:
+        results = list(executor.map(lambda task: verifyFile(*task), tasks))
+    return len(tasks), [broken for broken in results if broken is not None]
+
+def repairFile(broken, store=None, cancel=None):
+    """Fetch a broken file again and update its manifest entry.
+    store is the BlobStore in which the file must be deduplicated, if any.
+    Return False if it could not be downloaded."""
+    # Don't repair a file that is being downloaded again into its variant
+    with DirectoryLock(broken.directory, cancel) as lock:
+        return _repairLocked(broken, store, cancel, lock.waited)
+
+def repairFiles(broken_files, store=None, cancel=None, max_workers=VERIFY_MAX_WORKERS):
+    """Repair several files, one directory at a time per worker. The lock of a
+    directory is taken before its transfers ask the download scheduler for
+    slots, so that repairs waiting for a variant being downloaded do not hold
+    the slots that its download needs. Return the number of files repaired."""
+    by_directory = {}
+    for broken in broken_files:
+        by_directory.setdefault(broken.directory, []).append(broken)
+    def repairDirectory(files):
+        with DirectoryLock(files[0].directory, cancel) as lock:
+            return sum(1 for broken in files if _repairLocked(broken, store, cancel, lock.waited))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="LilyRepair") as executor:
+        return sum(executor.map(repairDirectory, by_directory.values()))
+
+def _repairLocked(broken, store, cancel, waited):
+    """Repair a file whose directory lock is held. If waited is True, the lock
+    was held by another download, which may have fixed it already."""
+    if waited:
+        entry = (loadManifest(broken.directory) or {}).get(broken.filename)
+        if entry is not None and verifyFile(broken.directory, broken.filename, entry) is None:
+            return True
+    return _repairFile(broken, store, cancel)
+
+def _repairFile(broken, store, cancel):
+    path = broken.path
+    entry = broken.entry
+    if store is not None and os.path.isfile(path):
+        # A corrupted file linked from the store means a corrupted blob,
+        # which must not be linked again
+        blob = store.blobPath(entry["sha256"])
+        if os.path.isfile(blob) and os.path.samefile(blob, path):
+            os.remove(blob)
+    if os.path.lexists(path):
+        os.remove(path)
+
+    if "member" in entry:
+        try:
+            archive = RemoteZip(entry["url"])
+            archive.extract(entry["member"], broken.directory, cancel)
+        except RemoteZipError as err:
+            print("Could not repair {} from {}: {}".format(broken.filename, entry["url"], err))
+            return False
+        stats = {"size": os.path.getsize(path), "sha256": fileSha256(path)}
+    else:
+        stats = {}
+        if not downloadFile(entry["url"], path, cancel=cancel, stats=stats):
+            return False
+
+    if store is not None:
+        store.ingest(path, stats["sha256"])
+    updateManifest(broken.directory, broken.filename, entry["url"], stats["size"], stats["sha256"],
+                   etag=stats.get("etag"), last_modified=stats.get("last_modified"), member=entry.get("member"))
+    return True
@@ -23,6 +23,9 @@
 
 import bpy
 
+from . import sessions
+from .settings import HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+
 addon_idname = __package__.split(".")[0]
 
 # -----------------------------------------------------------------------------
@@ -33,6 +36,13 @@ def getPreferences(context=None):
     addon_preferences = preferences.addons[addon_idname].preferences
     return addon_preferences
 
+def updateNetworkSettings(self, context):
+    sessions.getSessionPool().configure(
+        pool_maxsize=self.http_pool_size,
+        connect_timeout=self.http_connect_timeout,
+        read_timeout=self.http_read_timeout,
+    )
+
 # -----------------------------------------------------------------------------
 
 class LilySurfaceScrapperPreferences(bpy.types.AddonPreferences):
@@ -69,6 +79,79 @@ class LilySurfaceScrapperPreferences(bpy.types.AddonPreferences):
         default=True,
     )
 
+    use_texture_store: bpy.props.BoolProperty(
+        name="Deduplicate textures",
+        description="Store downloaded maps once for all blend files and hard link them into texture directories",
+        default=False,
+    )
+
+    texture_store_dir: bpy.props.StringProperty(
+        name="Texture Store",
+        description="Directory where deduplicated maps are stored. Only maps on the same drive are deduplicated",
+        subtype='DIR_PATH',
+        default="",
+    )
+
+    texture_cache_quota: bpy.props.FloatProperty(
+        name="Texture Cache Quota (GB)",
+        description=(
+            "Maximum size of the texture directory. Beyond it, the least recently used variants are removed, " +
+            "except those used by the open file. 0 means no limit"
+        ),
+        default=0.0,
+        min=0.0,
+    )
+
+    prefetch_variants: bpy.props.BoolProperty(
+        name="Prefetch variants",
+        description=(
+            "While the variant prompt is open, download in the background the thumbnail " +
+            "and the variant you are the most likely to pick"
+        ),
+        default=False,
+    )
+
+    prefetch_budget: bpy.props.IntProperty(
+        name="Prefetch budget (MB)",
+        description="Prefetching stops while prefetched variants that were not used take more than this",
+        default=500,
+        min=0,
+    )
+
+    use_worker_process: bpy.props.BoolProperty(
+        name="Use worker process",
+        description=(
+            "Run background imports in a separate process that keeps running between sessions, " +
+            "so that downloading and extracting textures does not slow down the interface"
+        ),
+        default=False,
+    )
+
+    http_pool_size: bpy.props.IntProperty(
+        name="Connections per host",
+        description="Number of keep-alive connections kept open to each texture provider",
+        default=HTTP_POOL_MAXSIZE,
+        min=1,
+        max=64,
+        update=updateNetworkSettings,
+    )
+
+    http_connect_timeout: bpy.props.FloatProperty(
+        name="Connect timeout",
+        description="Time in seconds to wait for a connection to a provider",
+        default=HTTP_CONNECT_TIMEOUT,
+        min=1.0,
+        update=updateNetworkSettings,
+    )
+
+    http_read_timeout: bpy.props.FloatProperty(
+        name="Read timeout",
+        description="Time in seconds to wait for data from a provider before giving up",
+        default=HTTP_READ_TIMEOUT,
+        min=1.0,
+        update=updateNetworkSettings,
+    )
+
     def draw(self, context):
         layout = self.layout
         layout.label(text="The texture directory where the textures are downloaded.")
@@ -95,8 +178,61 @@ class LilySurfaceScrapperPreferences(bpy.types.AddonPreferences):
         layout.label(text="Load map internally rather then linking to the file")
         layout.prop(self, "load_map")
 
+        layout.separator()
+        layout.label(text="Identical maps can be stored only once and linked into all texture directories.")
+        layout.label(text="Links are hard links when the store is on the same drive, symbolic links otherwise.")
+        layout.prop(self, "use_texture_store")
+        if self.use_texture_store:
+            layout.prop(self, "texture_store_dir")
+            row = layout.row()
+            row.operator("wm.lily_dedupe_textures", text="Find Duplicates").compact = False
+            row.operator("wm.lily_dedupe_textures", text="Compact Texture Directory").compact = True
+
+        layout.separator()
+        layout.label(text="Least recently used variants can be removed when the texture directory gets too large.")
+        row = layout.row()
+        row.prop(self, "texture_cache_quota")
+        row.operator("wm.lily_free_texture_cache").prefetched_only = False
+        row = layout.row()
+        row.operator("wm.lily_verify_textures", text="Verify Textures").repair = False
+        row.operator("wm.lily_verify_textures", text="Repair Textures").repair = True
+        row.operator("wm.lily_rebuild_catalog", text="Rebuild Catalog")
+
+        layout.separator()
+        layout.label(text="The likely variant can be downloaded while you choose, it is removed first when freeing space.")
+        row = layout.row()
+        row.prop(self, "prefetch_variants")
+        row.prop(self, "prefetch_budget")
+        row.operator("wm.lily_free_texture_cache", text="Remove Prefetched").prefetched_only = True
+
+        layout.separator()
+        layout.label(text="Background imports can run in a separate process, shared by all Blender instances.")
+        row = layout.row()
+        row.prop(self, "use_worker_process")
+        row.operator("wm.lily_stop_worker")
+
+        layout.separator()
+        layout.label(text="Network settings used when downloading from texture providers.")
+        layout.prop(self, "http_pool_size")
+        row = layout.row()
+        row.prop(self, "http_connect_timeout")
+        row.prop(self, "http_read_timeout")
+        layout.operator("wm.lily_download_stats")
+
 # -----------------------------------------------------------------------------
 
 classes = (LilySurfaceScrapperPreferences,)
 
-register, unregister = bpy.utils.register_classes_factory(classes)
+register_classes, unregister_classes = bpy.utils.register_classes_factory(classes)
+
+def register():
+    register_classes()
+    try:
+        updateNetworkSettings(getPreferences(), bpy.context)
+    except KeyError:
+        # Not registered as an add-on (e.g. run as a script), keep defaults
+        pass
+
+def unregister():
+    unregister_classes()
+    sessions.getSessionPool().close()
@@ -0,0 +1,277 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Speculative prefetch. Once the variant list of an asset is known, the user
+still spends a few seconds in the variant prompt before anything gets
+downloaded. When enabled, the thumbnail, the pages that fetchVariant needs and
+the variant the user is the most likely to pick are downloaded meanwhile, at
+the lowest priority of the download scheduler, and cancelled as soon as the
+user actually picks a variant.
+
+Prefetched variant directories are marked until they are used, so that the
+texture cache evicts them first. Their size is charged to a budget as they
+download, and prefetch stops as soon as unused prefetched variants take more
+than the budget set in the preferences, including those of previous sessions.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import traceback
+
+from .downloads import DownloadCancelled
+from .cachemanager import isPrefetched
+from .settings import PREFETCH_HISTORY_FILE, PREFETCH_BUDGET_FILE
+from .settings import PREFETCH_BUDGET_FLUSH_BYTES, PREFETCH_BUDGET_FLUSH_INTERVAL
+
+# "1K-JPG", "2k", "8K_PNG", etc.
+RESOLUTION_PATTERN = re.compile(r"(?<!\d)(\d+)\s*k(?![a-z])", re.IGNORECASE)
+
+def variantResolution(variant_name):
+    """Resolution in thousands of pixels found in a variant name, or None"""
+    match = RESOLUTION_PATTERN.search(variant_name)
+    return int(match.group(1)) if match is not None else None
+
+def directorySize(directory):
+    size = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+class VariantHistory():
+    """How many times each variant name and each resolution was picked,
+    saved in a json file shared by all blend files"""
+
+    def __init__(self, path=PREFETCH_HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counts = None
+
+    def _load(self):
+        if self._counts is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._counts = json.load(f)
+            except (OSError, ValueError):
+                self._counts = {}
+            self._counts.setdefault("variants", {})
+            self._counts.setdefault("resolutions", {})
+        return self._counts
+
+    def record(self, variant_name):
+        with self._lock:
+            counts = self._load()
+            counts["variants"][variant_name] = counts["variants"].get(variant_name, 0) + 1
+            resolution = variantResolution(variant_name)
+            if resolution is not None:
+                key = str(resolution)
+                counts["resolutions"][key] = counts["resolutions"].get(key, 0) + 1
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path + ".tmp", "w") as f:
+                    json.dump(counts, f)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError as err:
+                print("Could not save variant history: {}".format(err))
+
+    def preferredVariant(self, variants):
+        """Index of the variant the user will most likely pick: the one picked
+        the most so far, else the one of the resolution picked the most, else
+        the smallest resolution, else the first variant."""
+        with self._lock:
+            counts = self._load()
+            def score(i):
+                resolution = variantResolution(variants[i])
+                return (
+                    counts["variants"].get(variants[i], 0),
+                    counts["resolutions"].get(str(resolution), 0),
+                    -resolution if resolution is not None else float("-inf"),
+                )
+            return max(range(len(variants)), key=score)
+
+class PrefetchBudget():
+    """Bytes taken by prefetched variants that were not used yet, saved in a
+    json file shared by all blend files so that they still count after Blender
+    restarts. Variants are charged as their files download, and stop counting
+    once used, which removes their prefetch marker, or evicted. Charges are
+    only written to the file every few seconds or megabytes, call flush() to
+    write them right away."""
+
+    def __init__(self, path=PREFETCH_BUDGET_FILE,
+                 flush_bytes=PREFETCH_BUDGET_FLUSH_BYTES,
+                 flush_interval=PREFETCH_BUDGET_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._sizes = None
+        # Bytes charged since the last write, and time of that write
+        self._unsaved = 0
+        self._saved_time = time.monotonic()
+
+    def _load(self):
+        if self._sizes is None:
+            try:
+                with open(self.path, "r") as f:
+                    self._sizes = json.load(f)
+            except (OSError, ValueError):
+                self._sizes = {}
+        return self._sizes
+
+    def _save(self):
+        self._unsaved = 0
+        self._saved_time = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self._sizes, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as err:
+            print("Could not save prefetch budget: {}".format(err))
+
+    def charge(self, variant_dir, size):
+        """Add size bytes to a prefetched variant, return the bytes spent in total"""
+        with self._lock:
+            sizes = self._load()
+            sizes[variant_dir] = sizes.get(variant_dir, 0) + size
+            self._unsaved += size
+            if self._unsaved >= self.flush_bytes or time.monotonic() - self._saved_time >= self.flush_interval:
+                self._save()
+            return sum(sizes.values())
+
+    def flush(self):
+        """Write the charges not saved yet"""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def setSize(self, variant_dir, size):
+        """Replace what was charged for a variant by its size on disk"""
+        with self._lock:
+            self._load()[variant_dir] = size
+            self._save()
+
+    def spent(self):
+        with self._lock:
+            sizes = self._load()
+            unused = {variant_dir: size for variant_dir, size in sizes.items() if isPrefetched(variant_dir)}
+            if len(unused) != len(sizes):
+                self._sizes = unused
+                self._save()
+            return sum(unused.values())
+
+class _PrefetchedData():
+    """Stands for the ScrappedData that fetchVariant fills"""
+    def __init__(self):
+        self.name = None
+        self.maps = {}
+
+class PrefetchJob():
+    def __init__(self, scrapper, variants, budget):
+        """scrapper: a scrapper whose variant list was just fetched
+        variants: its variant list
+        budget: maximum number of bytes taken by unused prefetched variants"""
+        self.scrapper = scrapper.makePrefetchScrapper()
+        self.variants = variants
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._start_time = None
+        # Directory of the prefetched variant, once marked as prefetched
+        self._variant_dir = None
+        self._thread = threading.Thread(target=self._run, name="LilyPrefetch", daemon=True)
+
+    def start(self):
+        self._start_time = time.time()
+        self._thread.start()
+
+    def cancel(self):
+        """Stop downloading, what is already downloaded is kept for later"""
+        self.scrapper.cancel()
+
+    def _charge(self, data, size):
+        """Meter of the downloads of the prefetched variant, whose directory is
+        marked as prefetched as soon as something gets downloaded into it.
+        Stop once the budget is exhausted, or if the user picked this variant."""
+        scrapper = self.scrapper
+        with self._lock:
+            if self._variant_dir is None:
+                variant_dir = scrapper.getVariantDirectory(data.name)
+                if not scrapper.getCacheManager().markPrefetched(variant_dir, since=self._start_time):
+                    # Imported meanwhile, it is no longer speculative
+                    scrapper.cancel()
+                    raise DownloadCancelled(variant_dir)
+                self._variant_dir = variant_dir
+        spent = getPrefetchBudget().charge(self._variant_dir, size)
+        if spent > self.budget:
+            print("Prefetch budget exhausted ({} bytes in unused variants)".format(spent))
+            scrapper.cancel()
+            raise DownloadCancelled(self._variant_dir)
+
+    def _run(self):
+        scrapper = self.scrapper
+        try:
+            scrapper.saveThumbnail(scrapper._thumbnailUrl, scrapper._base_name)
+            scrapper.prefetchPages()
+            if not self.variants:
+                return
+
+            spent = getPrefetchBudget().spent()
+            if spent >= self.budget:
+                print("Prefetch budget exhausted ({} bytes in unused variants)".format(spent))
+                return
+            variant_index = getVariantHistory().preferredVariant(self.variants)
+            if scrapper.isDownloaded(self.variants[variant_index]):
+                return
+
+            print("Prefetching variant {}...".format(self.variants[variant_index]))
+            data = _PrefetchedData()
+            scrapper.download_meter = lambda size: self._charge(data, size)
+            if not scrapper.fetchVariant(variant_index, data) or scrapper._cancel_event.is_set():
+                # Cancelled because the user picked a variant, which may be this one
+                return
+            if scrapper.error is None:
+                scrapper.recordVariant(data.name)
+            if self._variant_dir is not None:
+                getPrefetchBudget().setSize(self._variant_dir, directorySize(self._variant_dir))
+        except DownloadCancelled:
+            pass
+        except Exception:
+            # Prefetch is only a hint, the actual import reports errors
+            traceback.print_exc()
+        finally:
+            getPrefetchBudget().flush()
+
+# -----------------------------------------------------------------------------
+
+_variant_history = VariantHistory()
+_prefetch_budget = PrefetchBudget()
+
+def getVariantHistory():
+    return _variant_history
+
+def getPrefetchBudget():
+    return _prefetch_budget
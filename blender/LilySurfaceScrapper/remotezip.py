@@ -0,0 +1,316 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Read members of a zip archive served over HTTP without downloading all of it.
+The central directory, at the end of the archive, is fetched with a Range
+request, then only the byte ranges of the requested members are downloaded and
+decompressed locally. This is used to pick a few maps out of multi-hundred
+megabytes texture archives. When the server does not support byte ranges,
+RangeNotSupported is raised so that callers fall back to a full download.
+"""
+
+import os
+import zlib
+import struct
+import hashlib
+import threading
+from concurrent.futures import wait, FIRST_EXCEPTION
+
+from . import sessions
+from .downloads import DownloadCancelled
+from .scheduler import getDownloadScheduler, PRIORITY_INTERACTIVE
+from .settings import DOWNLOAD_CHUNK_SIZE
+
+EOCD = struct.Struct("<4s4H2LH")
+EOCD_SIGNATURE = b"PK\x05\x06"
+ZIP64_LOCATOR = struct.Struct("<4sLQL")
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_EOCD = struct.Struct("<4sQ2H2L4Q")
+ZIP64_EOCD_SIGNATURE = b"PK\x06\x06"
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+# Enough to contain the end of central directory record with the longest
+# possible comment, and the zip64 records right before it
+TAIL_SIZE = EOCD.size + 0xFFFF + ZIP64_LOCATOR.size + ZIP64_EOCD.size
+
+STORED = 0
+DEFLATED = 8
+
+def fileCrc32(path):
+    with open(path, "rb") as f:
+        crc = 0
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+class RemoteZipError(Exception):
+    pass
+
+class RangeNotSupported(RemoteZipError):
+    pass
+
+class _StopEvent():
+    """Cancel event of the members extracted together, set when one of them
+    fails or when the cancel event of the caller is set"""
+    def __init__(self, cancel):
+        self._cancel = cancel
+        self._failed = threading.Event()
+
+    def set(self):
+        self._failed.set()
+
+    def is_set(self):
+        return self._failed.is_set() or (self._cancel is not None and self._cancel.is_set())
+
+class RemoteZipMember():
+    def __init__(self, name, method, flags, crc, compressed_size, file_size, header_offset):
+        self.name = name
+        self.method = method
+        self.flags = flags
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+        # Offset of the next member or of the central directory, set by RemoteZip
+        self.end_offset = None
+
+class RemoteZip():
+    def __init__(self, url):
+        self.url = url
+        self.size = None
+        # Validators of the archive, to revalidate extracted members later
+        self.etag = None
+        self.last_modified = None
+        self._members = {}
+        # sha256 of the members extracted so far, computed while extracting
+        self.digests = {}
+        self._readCentralDirectory()
+
+    def _getRange(self, start, end=None):
+        """Fetch bytes [start, end) of the archive, or the last -start bytes if
+        start is negative. The response is streamed, so that a server ignoring
+        the range does not get the whole archive read for nothing."""
+        if start < 0:
+            byte_range = "bytes={}".format(start)
+        else:
+            byte_range = "bytes={}-{}".format(start, "" if end is None else end - 1)
+        headers = {"Range": byte_range, "Accept-Encoding": "identity"}
+        r = sessions.get(self.url, headers=headers, stream=True)
+        if r.status_code != 206:
+            r.close()
+            if r.status_code == 200:
+                raise RangeNotSupported(self.url)
+            raise RemoteZipError("Could not fetch {} ({})".format(self.url, r.status_code))
+        # Don't follow redirections again for the next ranges
+        self.url = r.url
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        if total.isdigit():
+            self.size = int(total)
+        self.etag = r.headers.get("ETag", self.etag)
+        self.last_modified = r.headers.get("Last-Modified", self.last_modified)
+        return r
+
+    def _readCentralDirectory(self):
+        tail = self._getRange(-TAIL_SIZE).content
+        if self.size is None:
+            raise RangeNotSupported(self.url)
+        tail_offset = self.size - len(tail)
+
+        eocd_pos = tail.rfind(EOCD_SIGNATURE)
+        if eocd_pos < 0:
+            raise RemoteZipError("Not a zip archive: {}".format(self.url))
+        _, _, _, _, entry_count, cd_size, cd_offset, _ = EOCD.unpack_from(tail, eocd_pos)
+
+        locator_pos = eocd_pos - ZIP64_LOCATOR.size
+        if locator_pos >= 0 and tail[locator_pos:locator_pos + 4] == ZIP64_LOCATOR_SIGNATURE:
+            _, _, zip64_eocd_offset, _ = ZIP64_LOCATOR.unpack_from(tail, locator_pos)
+            pos = zip64_eocd_offset - tail_offset
+            if pos < 0 or tail[pos:pos + 4] != ZIP64_EOCD_SIGNATURE:
+                raise RemoteZipError("Invalid zip64 archive: {}".format(self.url))
+            fields = ZIP64_EOCD.unpack_from(tail, pos)
+            entry_count, cd_size, cd_offset = fields[7], fields[8], fields[9]
+
+        if cd_offset >= tail_offset:
+            cd = tail[cd_offset - tail_offset:cd_offset - tail_offset + cd_size]
+        else:
+            cd = self._getRange(cd_offset, cd_offset + cd_size).content
+
+        members = []
+        pos = 0
+        for _ in range(entry_count):
+            fields = CENTRAL_HEADER.unpack_from(cd, pos)
+            if fields[0] != CENTRAL_HEADER_SIGNATURE:
+                raise RemoteZipError("Invalid central directory: {}".format(self.url))
+            flags, method, crc = fields[3], fields[4], fields[7]
+            compressed_size, file_size = fields[8], fields[9]
+            name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+            header_offset = fields[16]
+            pos += CENTRAL_HEADER.size
+            raw_name = cd[pos:pos + name_length]
+            extra = cd[pos + name_length:pos + name_length + extra_length]
+            pos += name_length + extra_length + comment_length
+
+            name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+            file_size, compressed_size, header_offset = self._readZip64Extra(
+                extra, file_size, compressed_size, header_offset)
+            members.append(RemoteZipMember(name, method, flags, crc, compressed_size, file_size, header_offset))
+
+        members.sort(key=lambda m: m.header_offset)
+        for m, next_m in zip(members, members[1:] + [None]):
+            m.end_offset = next_m.header_offset if next_m is not None else cd_offset
+            self._members[m.name] = m
+
+    @staticmethod
+    def _readZip64Extra(extra, file_size, compressed_size, header_offset):
+        """Sizes and offset that overflow 32 bits are stored in a zip64 extra field"""
+        pos = 0
+        while pos + 4 <= len(extra):
+            field_id, field_size = struct.unpack_from("<2H", extra, pos)
+            if field_id == 0x0001:
+                values = list(struct.unpack_from("<{}Q".format(field_size // 8), extra, pos + 4))
+                if file_size == 0xFFFFFFFF:
+                    file_size = values.pop(0)
+                if compressed_size == 0xFFFFFFFF:
+                    compressed_size = values.pop(0)
+                if header_offset == 0xFFFFFFFF:
+                    header_offset = values.pop(0)
+                break
+            pos += 4 + field_size
+        return file_size, compressed_size, header_offset
+
+    def namelist(self):
+        return [name for name in self._members if not name.endswith("/")]
+
+    def isModified(self, name, path):
+        """Whether the local file at path differs from the member name,
+        according to the size and CRC-32 listed in the central directory"""
+        m = self._members[name]
+        if not os.path.isfile(path) or os.path.getsize(path) != m.file_size:
+            return True
+        return fileCrc32(path) != m.crc
+
+    def extract(self, name, directory, cancel=None, priority=PRIORITY_INTERACTIVE, meter=None):
+        """Download and decompress a single member into directory. cancel and
+        meter are used as by downloads.downloadFile.
+        Return the path of the extracted file."""
+        with getDownloadScheduler().slot(self.url, priority, cancel) as granted:
+            if not granted:
+                raise DownloadCancelled(name)
+            return self._extract(name, directory, cancel, meter)
+
+    def _extract(self, name, directory, cancel, meter):
+        m = self._members[name]
+        if m.flags & 0x1:
+            raise RemoteZipError("Encrypted member: {}".format(name))
+        if m.method not in (STORED, DEFLATED):
+            raise RemoteZipError("Unsupported compression method {} for {}".format(m.method, name))
+
+        path = os.path.join(directory, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = path + ".part"
+
+        # The range up to the next member contains the local header, whose
+        # extra field may differ from the central one, then the data.
+        r = self._getRange(m.header_offset, m.end_offset)
+        completed = False
+        try:
+            chunks = r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            buffer = b""
+            for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= LOCAL_HEADER.size:
+                    break
+            fields = LOCAL_HEADER.unpack_from(buffer)
+            if fields[0] != LOCAL_HEADER_SIGNATURE:
+                raise RemoteZipError("Invalid local header for {}".format(name))
+            skip = LOCAL_HEADER.size + fields[9] + fields[10]
+            while len(buffer) < skip:
+                buffer += next(chunks)
+            buffer = buffer[skip:]
+
+            decompressor = zlib.decompressobj(-15) if m.method == DEFLATED else None
+            remaining = m.compressed_size
+            crc = 0
+            h = hashlib.sha256()
+            with open(part_path, "wb") as f:
+                while remaining > 0:
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(name)
+                    if not buffer:
+                        buffer = next(chunks, b"")
+                        if not buffer:
+                            raise RemoteZipError("Truncated member: {}".format(name))
+                    data, buffer = buffer[:remaining], buffer[remaining:]
+                    remaining -= len(data)
+                    if meter is not None:
+                        meter(len(data))
+                    if decompressor is not None:
+                        data = decompressor.decompress(data)
+                    crc = zlib.crc32(data, crc)
+                    h.update(data)
+                    f.write(data)
+                if decompressor is not None:
+                    data = decompressor.flush()
+                    crc = zlib.crc32(data, crc)
+                    h.update(data)
+                    f.write(data)
+            completed = True
+        finally:
+            r.close()
+            if not completed and os.path.exists(part_path):
+                os.remove(part_path)
+
+        if crc != m.crc or os.path.getsize(part_path) != m.file_size:
+            os.remove(part_path)
+            raise RemoteZipError("Corrupted member: {}".format(name))
+        os.replace(part_path, path)
+        self.digests[name] = h.hexdigest()
+        return path
+
+    def transferredSize(self, names):
+        """Number of bytes downloaded when extracting these members"""
+        return sum(self._members[name].end_offset - self._members[name].header_offset for name in names)
+
+    def extractMembers(self, names, directory, cancel=None, priority=PRIORITY_INTERACTIVE, meter=None):
+        """Download several members at once on the download scheduler. If one
+        of them fails, the others are stopped, and all of them are over when
+        the error is raised, so that the caller may write the same files."""
+        scheduler = getDownloadScheduler()
+        stop = _StopEvent(cancel)
+        futures = [scheduler.submit(self.url, self.extract, name, directory, stop, priority=priority, meter=meter)
+                   for name in names]
+        try:
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+            return [future.result() for future in futures]
+        except BaseException:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
@@ -0,0 +1,141 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+On-disk cache of the pages and API responses scrapped by fetchHtml, fetchJson
+and fetchXml. Fresh entries are used without any network access, stale ones
+are revalidated with If-None-Match/If-Modified-Since, and 404 responses are
+remembered for a short while so that a bad URL does not hit the network again
+and again.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from . import sessions
+from .settings import RESPONSE_CACHE_NEGATIVE_TTL
+
+NEGATIVE_STATUS_CODES = {404, 410}
+
+def _writeAtomic(path, data, mode="wb"):
+    tmp_path = "{}.{}-{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class ResponseCache():
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def _load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if meta.get("url") != url:
+            return None, None
+        if meta["status"] != 200:
+            return meta, None
+        try:
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None, None
+        return meta, body
+
+    def _store(self, url, r):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            "url": url,
+            "status": r.status_code,
+            "time": time.time(),
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "encoding": r.encoding,
+        }
+        if r.status_code == 200:
+            _writeAtomic(body_path, r.content)
+        _writeAtomic(meta_path, json.dumps(meta), mode="w")
+        return meta
+
+    def _touch(self, url, meta):
+        meta_path, _ = self._paths(url)
+        meta["time"] = time.time()
+        _writeAtomic(meta_path, json.dumps(meta), mode="w")
+
+    @staticmethod
+    def _decode(meta, body):
+        return body.decode(meta.get("encoding") or "utf-8", errors="replace")
+
+    def fetchText(self, url, ttl):
+        """Return the text at url, or None if it could not be found, and
+        whether it was answered from cache (possibly after revalidation).
+        ttl is the time in seconds during which a cached response is used
+        without asking the server whether it changed. Past it, the cached
+        response is still used if the server cannot be reached."""
+        meta, body = self._load(url)
+        age = time.time() - meta["time"] if meta is not None else None
+
+        if meta is not None and meta["status"] in NEGATIVE_STATUS_CODES:
+            if age < RESPONSE_CACHE_NEGATIVE_TTL:
+                return None, True
+            meta = None
+
+        if meta is not None and age < ttl:
+            return self._decode(meta, body), True
+
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            r = sessions.get(url, headers=headers)
+        except sessions.requests.exceptions.RequestException:
+            if body is None:
+                raise
+            print("Could not revalidate {}, using the cached version".format(url))
+            return self._decode(meta, body), True
+        if r.status_code >= 500 and body is not None:
+            print("Could not revalidate {} ({}), using the cached version".format(url, r.status_code))
+            return self._decode(meta, body), True
+        if r.status_code == 304 and meta is not None:
+            self._touch(url, meta)
+            return self._decode(meta, body), True
+        if r.status_code == 200 or r.status_code in NEGATIVE_STATUS_CODES:
+            self._store(url, r)
+        if r.status_code != 200:
+            return None, False
+        return r.text, False
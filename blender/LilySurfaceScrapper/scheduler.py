@@ -0,0 +1,236 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Central download scheduler. Every file transfer, whether it runs on one of the
+scheduler's own threads or on the thread that asked for it, must first be
+granted a slot. Slots are granted by priority class, so that the variant the
+user is waiting for goes before thumbnails, which go before speculative
+prefetching, within a global and a per-host concurrency cap, and no faster
+than a token bucket allows. Low priority work can be paused, which the add-on
+does while Blender renders.
+"""
+
+import time
+import bisect
+import itertools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .sessions import getHost
+from .settings import (
+    DOWNLOAD_MAX_WORKERS, DOWNLOAD_MAX_PER_HOST,
+    DOWNLOAD_RATE_LIMIT, DOWNLOAD_RATE_BURST
+)
+
+# Priority classes, lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_THUMBNAIL = 1
+PRIORITY_PREFETCH = 2
+
+# Work of this priority or lower is paused during renders. Thumbnails are not,
+# because panels fetch them from Blender's main thread.
+RENDER_PAUSED_PRIORITY = PRIORITY_PREFETCH
+
+class TokenBucket():
+    """Allow rate events per second on average, with bursts of up to capacity
+    events. A rate of 0 disables the limit. Not thread safe on its own."""
+
+    def __init__(self, rate=DOWNLOAD_RATE_LIMIT, capacity=DOWNLOAD_RATE_BURST):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def tryConsume(self):
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self):
+        """Time until the next token is available"""
+        return max(1 - self.tokens, 0) / self.rate if self.rate > 0 else 0
+
+class _SlotRequest():
+    def __init__(self, priority, seq, host, task=None):
+        self.priority = priority
+        self.seq = seq
+        self.host = host
+        # (future, fn, args, kwargs) for work run on the scheduler's threads
+        self.task = task
+        self.admitted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class DownloadScheduler():
+    def __init__(self, max_active=DOWNLOAD_MAX_WORKERS, max_per_host=DOWNLOAD_MAX_PER_HOST,
+                 rate=DOWNLOAD_RATE_LIMIT, burst=DOWNLOAD_RATE_BURST):
+        self._cond = threading.Condition()
+        # As many threads as slots, so that admitted work never waits for a thread
+        self._executor = ThreadPoolExecutor(max_workers=max_active, thread_name_prefix="LilyDownload")
+        self._waiting = []  # sorted by priority, then by submission order
+        self._seq = itertools.count()
+        self._active = 0
+        self._host_active = {}
+        self._bucket = TokenBucket(rate, burst)
+        self._timer = None
+        self._local = threading.local()
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.paused_priority = None
+
+    def _admit(self):
+        """Grant slots to waiting requests, by priority. Must hold self._cond"""
+        for request in list(self._waiting):
+            if self._active >= self.max_active:
+                break
+            if self.paused_priority is not None and request.priority >= self.paused_priority:
+                break
+            if self._host_active.get(request.host, 0) >= self.max_per_host:
+                continue
+            if not self._bucket.tryConsume():
+                self._admitLater(self._bucket.delay())
+                break
+            self._waiting.remove(request)
+            self._active += 1
+            self._host_active[request.host] = self._host_active.get(request.host, 0) + 1
+            request.admitted = True
+            if request.task is not None:
+                self._executor.submit(self._runTask, request)
+        self._cond.notify_all()
+
+    def _admitLater(self, delay):
+        if self._timer is not None:
+            return
+        def wake():
+            with self._cond:
+                self._timer = None
+                self._admit()
+        self._timer = threading.Timer(delay, wake)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _release(self, host):
+        with self._cond:
+            self._active -= 1
+            self._host_active[host] -= 1
+            self._admit()
+
+    def _enqueue(self, request):
+        with self._cond:
+            bisect.insort(self._waiting, request)
+            self._admit()
+
+    def _discard(self, request):
+        with self._cond:
+            if request in self._waiting:
+                self._waiting.remove(request)
+
+    def _runTask(self, request):
+        future, fn, args, kwargs = request.task
+        self._local.holding = True
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as err:
+                    future.set_exception(err)
+        finally:
+            self._local.holding = False
+            self._release(request.host)
+
+    def submit(self, url, fn, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Run fn(*args, **kwargs) on a download thread once a slot for url's
+        host is granted. Return a concurrent.futures.Future, which can be
+        cancelled as long as it did not start."""
+        future = Future()
+        request = _SlotRequest(priority, next(self._seq), getHost(url), (future, fn, args, kwargs))
+        future.add_done_callback(lambda f: f.cancelled() and self._discard(request))
+        self._enqueue(request)
+        return future
+
+    @contextmanager
+    def slot(self, url, priority=PRIORITY_INTERACTIVE, cancel=None):
+        """Block the calling thread until a transfer from url's host may
+        start, and hold the slot until the end of the with block. Yield False
+        if the optional cancel event got set while waiting. A thread that
+        already holds a slot, e.g. a task run by submit, gets it right away."""
+        if getattr(self._local, "holding", False):
+            yield True
+            return
+
+        request = _SlotRequest(priority, next(self._seq), getHost(url))
+        self._enqueue(request)
+        with self._cond:
+            while not request.admitted:
+                if cancel is not None and cancel.is_set():
+                    self._waiting.remove(request)
+                    break
+                self._cond.wait(0.5)
+        if not request.admitted:
+            yield False
+            return
+
+        self._local.holding = True
+        try:
+            yield True
+        finally:
+            self._local.holding = False
+            self._release(request.host)
+
+    def pause(self, priority=RENDER_PAUSED_PRIORITY):
+        """Stop granting slots to work of this priority or lower. Running
+        transfers are not interrupted."""
+        with self._cond:
+            self.paused_priority = priority
+
+    def resume(self):
+        with self._cond:
+            self.paused_priority = None
+            self._admit()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+# -----------------------------------------------------------------------------
+
+_download_scheduler = None
+_download_scheduler_lock = threading.Lock()
+
+def getDownloadScheduler():
+    global _download_scheduler
+    with _download_scheduler_lock:
+        if _download_scheduler is None:
+            _download_scheduler = DownloadScheduler()
+        return _download_scheduler
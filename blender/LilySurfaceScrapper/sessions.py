@@ -0,0 +1,219 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Shared HTTP layer used by all the scrappers. Instead of calling requests.get
+directly, which opens a new TCP+TLS connection for every single map, fetches go
+through a pool of keep-alive sessions, one per host, so that downloading the
+6 to 8 maps of a material reuses the same connection.
+
+This is also where requests are made resilient: they have connect and read
+timeouts, transient failures (network errors, 429 and 5xx) are retried with
+exponential backoff and jitter, and a per-host circuit breaker makes requests
+to a provider that is down fail fast instead of piling up blocked threads.
+"""
+
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .settings import (
+    HTTP_POOL_MAXSIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT,
+    HTTP_RETRY_STATUS_CODES, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX,
+    CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN
+)
+
+USER_AGENT = "Mozilla/5.0"  # fake user agent
+
+def getHost(url):
+    """Return the normalized host (with port if any) of an url"""
+    return urlparse(url).netloc.lower()
+
+class ProviderUnavailable(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the circuit breaker of a host is open"""
+    pass
+
+class CircuitBreaker():
+    """Count consecutive failures of a host. Once there are too many, the
+    circuit opens and requests are refused until the cooldown is over, then a
+    single trial request is allowed, whose result closes or reopens it."""
+
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self._lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.trial_running = True
+            return True
+
+    def recordSuccess(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def recordFailure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+def _retryDelay(r, attempt):
+    """Time to wait before the next attempt, honoring Retry-After"""
+    retry_after = r.headers.get("Retry-After") if r is not None else None
+    if retry_after is not None:
+        if retry_after.isdigit():
+            return min(int(retry_after), HTTP_BACKOFF_MAX)
+        try:
+            delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            return min(max(delay, 0), HTTP_BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_BASE * 2 ** attempt, HTTP_BACKOFF_MAX))
+
+class SessionPool():
+    """Thread-safe collection of keep-alive sessions, one per host.
+    pool_maxsize is the number of connections kept open to a given host,
+    which bounds how many downloads can share a host without reconnecting."""
+
+    def __init__(self, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._breakers = {}
+        self.max_retries = HTTP_MAX_RETRIES
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def _makeSession(self):
+        session = requests.Session()
+        session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def getSession(self, url):
+        host = getHost(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._makeSession()
+                self._sessions[host] = session
+            return session
+
+    def getCircuitBreaker(self, url):
+        host = getHost(url)
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker()
+                self._breakers[host] = breaker
+            return breaker
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying on transient failures. Raise
+        ProviderUnavailable if the host is known to be down."""
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        session = self.getSession(url)
+        breaker = self.getCircuitBreaker(url)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise ProviderUnavailable("{} is unavailable, not trying again for now".format(getHost(url)))
+            try:
+                r = session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                breaker.recordFailure()
+                if attempt >= self.max_retries:
+                    raise
+                r = None
+            else:
+                if r.status_code not in HTTP_RETRY_STATUS_CODES:
+                    breaker.recordSuccess()
+                    r.retries = attempt
+                    return r
+                if r.status_code != 429:
+                    breaker.recordFailure()
+                if attempt >= self.max_retries:
+                    r.retries = attempt
+                    return r
+                r.close()
+
+            delay = _retryDelay(r, attempt)
+            attempt += 1
+            print("Request to {} failed, retrying in {:.1f}s ({}/{})...".format(url, delay, attempt, self.max_retries))
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def configure(self, pool_maxsize=None, connect_timeout=None, read_timeout=None):
+        """Change pool size and timeouts. Open sessions are dropped so that
+        the new pool size applies to the next requests."""
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if pool_maxsize is not None and pool_maxsize != self.pool_maxsize:
+            self.pool_maxsize = pool_maxsize
+            self.close()
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+# -----------------------------------------------------------------------------
+
+_session_pool = SessionPool()
+
+def getSessionPool():
+    return _session_pool
+
+def get(url, **kwargs):
+    return _session_pool.get(url, **kwargs)
+
+def head(url, **kwargs):
+    return _session_pool.head(url, **kwargs)
@@ -21,7 +21,97 @@
 # This file is part of LilySurfaceScrapper, a Blender add-on to import materials
 # from a single URL
 
+import os
+
 ## Constants
 
 TEXTURE_DIR = "LilySurface"
 UNSUPPORTED_PROVIDER_ERR = "Material provider not supported. See the documentation for a list of supported material providers."
+# Where downloaded maps are stored once for all blend files, see blobstore
+TEXTURE_STORE_DIR = os.path.join(os.path.expanduser("~"), ".LilySurfaceScrapper", "store")
+# Variants the user picked so far, to guess which one to prefetch, see prefetch
+PREFETCH_HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".LilySurfaceScrapper", "history.json")
+# Bytes taken by prefetched variants that were not used yet, see prefetch
+PREFETCH_BUDGET_FILE = os.path.join(os.path.expanduser("~"), ".LilySurfaceScrapper", "prefetched.json")
+# The budget is kept in memory while downloading, and written to its file once
+# this many bytes were charged or this many seconds passed since the last write
+PREFETCH_BUDGET_FLUSH_BYTES = 64 * 1024 * 1024
+PREFETCH_BUDGET_FLUSH_INTERVAL = 5
+# Optional worker process running background imports outside of Blender, see
+# daemon. It listens on DAEMON_ADDRESS, only accepting clients that know the
+# key stored in DAEMON_AUTHKEY_FILE, and logs to DAEMON_LOG_FILE
+DAEMON_DIR = os.path.join(os.path.expanduser("~"), ".LilySurfaceScrapper")
+if os.name == "nt":
+    DAEMON_ADDRESS = r"\\.\pipe\LilySurfaceScrapper-" + os.path.basename(os.path.expanduser("~"))
+else:
+    DAEMON_ADDRESS = os.path.join(DAEMON_DIR, "daemon.sock")
+DAEMON_AUTHKEY_FILE = os.path.join(DAEMON_DIR, "daemon.key")
+DAEMON_LOG_FILE = os.path.join(DAEMON_DIR, "daemon.log")
+# Time in seconds the worker keeps running without any client, and that
+# Blender waits for it to start
+DAEMON_IDLE_TIMEOUT = 30 * 60
+DAEMON_START_TIMEOUT = 15
+# Number of imports the worker runs at the same time
+DAEMON_MAX_JOBS = 8
+# Time in seconds between two checks of the texture directory size quota
+TEXTURE_CACHE_CHECK_INTERVAL = 5 * 60
+# Number of files hashed at the same time when verifying the texture directory
+VERIFY_MAX_WORKERS = 4
+# Files larger than this are memory-mapped rather than read when hashed
+MMAP_HASH_MIN_SIZE = 16 * 1024 * 1024
+
+## Network
+
+# Number of keep-alive connections kept open per host
+HTTP_POOL_MAXSIZE = 8
+# Timeouts, in seconds, for establishing a connection and waiting for data
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+# Requests failing with one of these status codes or a network error are
+# retried, waiting a random time up to HTTP_BACKOFF_BASE * 2^attempt seconds
+# (capped to HTTP_BACKOFF_MAX), or what the server asks with Retry-After
+HTTP_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 30
+# After this many consecutive failures, requests to a host fail immediately
+# during CIRCUIT_BREAKER_COOLDOWN seconds, then a single trial request is let through
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_COOLDOWN = 30
+
+# Maximum number of maps downloaded at the same time, in total and per host
+DOWNLOAD_MAX_WORKERS = 8
+DOWNLOAD_MAX_PER_HOST = 4
+
+# Maximum number of transfers started per second on average (0 for no limit),
+# and how many can be started at once after a quiet period
+DOWNLOAD_RATE_LIMIT = 10
+DOWNLOAD_RATE_BURST = 20
+
+# Downloading into a directory takes its lock file, see filelock. Its holder
+# refreshes it every LOCK_HEARTBEAT_INTERVAL seconds, it is considered left by
+# a crashed process after LOCK_STALE_TIMEOUT seconds without refresh, and
+# other processes check whether it got released every LOCK_POLL_INTERVAL seconds
+LOCK_HEARTBEAT_INTERVAL = 10
+LOCK_STALE_TIMEOUT = 60
+LOCK_POLL_INTERVAL = 0.5
+
+# Size of the blocks in which downloads are streamed to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# How many times an interrupted download is resumed before giving up
+DOWNLOAD_MAX_ATTEMPTS = 3
+
+# Time in seconds during which scrapped pages are reused without revalidation,
+# unless a scrapper overrides it with its response_ttl attribute
+RESPONSE_CACHE_TTL = 60 * 60
+# Time in seconds during which a page that was not found is not asked again
+RESPONSE_CACHE_NEGATIVE_TTL = 2 * 60
+
+# Number of archive members decompressed at the same time
+EXTRACT_MAX_WORKERS = 4
+
+# Files larger than this are downloaded as several byte ranges in parallel,
+# split in segments of roughly SEGMENT_TARGET_SIZE, but no more than SEGMENT_MAX_COUNT
+SEGMENTED_DOWNLOAD_MIN_SIZE = 32 * 1024 * 1024
+SEGMENT_TARGET_SIZE = 16 * 1024 * 1024
+SEGMENT_MAX_COUNT = 8
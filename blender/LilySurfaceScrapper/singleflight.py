@@ -0,0 +1,83 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Deduplication of concurrent identical downloads. When several threads ask for
+the same url to be written at the same path at about the same time (e.g. the
+thumbnail saved by fetchVariant while the panel also fetches it, or two
+materials using the same HDRI), only the first one actually downloads it and
+the others wait for its result instead of racing on the same file.
+"""
+
+import os
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlsplit, urlunsplit
+
+def normalizeUrl(url):
+    """Lower case the scheme and host, drop the fragment, default to https"""
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+
+def flightKey(url, path):
+    return normalizeUrl(url), os.path.normcase(os.path.realpath(path))
+
+class SingleFlight():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) unless a call with the same key is already
+        running, in which case wait for it and share its result, or exception.
+        Return the result and whether it was shared with another call."""
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+# -----------------------------------------------------------------------------
+
+_single_flight = SingleFlight()
+
+def getSingleFlight():
+    return _single_flight
@@ -0,0 +1,114 @@
+# Copyright (c) 2019-2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScrapper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Registry of download metrics. Every fetch done by a scrapper is recorded with
+its provider (the scrapper's source_name), a class of url ('page', 'map',
+'archive', 'text', 'redirect'), the number of bytes, the wall time, the number
+of retries and whether it was served from cache. Aggregates tell which
+providers and which stages dominate import latency.
+"""
+
+import json
+import time
+import threading
+
+class FetchRecord():
+    def __init__(self, provider, url_class, url, nbytes, duration, retries, cache_hit):
+        self.provider = provider
+        self.url_class = url_class
+        self.url = url
+        self.nbytes = nbytes
+        self.duration = duration
+        self.retries = retries
+        self.cache_hit = cache_hit
+        self.timestamp = time.time()
+
+    def toDict(self):
+        return {
+            "provider": self.provider,
+            "url_class": self.url_class,
+            "url": self.url,
+            "bytes": self.nbytes,
+            "duration": self.duration,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "timestamp": self.timestamp,
+        }
+
+class MetricsRegistry():
+    def __init__(self, max_records=10000):
+        self._lock = threading.Lock()
+        self._records = []
+        self.max_records = max_records
+
+    def record(self, provider, url_class, url, nbytes=0, duration=0.0, retries=0, cache_hit=False):
+        record = FetchRecord(provider, url_class, url, nbytes, duration, retries, cache_hit)
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) > self.max_records:
+                del self._records[:len(self._records) - self.max_records]
+
+    def getRecords(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records = []
+
+    def aggregates(self):
+        """Return a dict provider -> url class -> statistics. Bytes, time and
+        throughput only account for fetches that were not served from cache."""
+        stats = {}
+        for r in self.getRecords():
+            s = stats.setdefault(r.provider, {}).setdefault(r.url_class, {
+                "count": 0, "cache_hits": 0, "cache_misses": 0,
+                "bytes": 0, "time": 0.0, "retries": 0, "throughput": 0.0,
+            })
+            s["count"] += 1
+            s["retries"] += r.retries
+            if r.cache_hit:
+                s["cache_hits"] += 1
+            else:
+                s["cache_misses"] += 1
+                s["bytes"] += r.nbytes
+                s["time"] += r.duration
+        for provider_stats in stats.values():
+            for s in provider_stats.values():
+                s["throughput"] = s["bytes"] / s["time"] if s["time"] > 0 else 0.0
+        return stats
+
+    def exportJson(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "aggregates": self.aggregates(),
+                "records": [r.toDict() for r in self.getRecords()],
+            }, f, indent=2)
+
+# -----------------------------------------------------------------------------
+
+_metrics_registry = MetricsRegistry()
+
+def getMetricsRegistry():
+    return _metrics_registry
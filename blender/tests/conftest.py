@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import the add-on as a package, as Blender does, without Blender
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from LilySurfaceScrapper.aio import AsyncRunner
+from LilySurfaceScrapper.config import Config
+from LilySurfaceScrapper.scheduler import getDownloadScheduler, PRIORITY_PREFETCH
+from LilySurfaceScrapper.Scrappers.AbstractScrapper import AbstractScrapper
+
+class SlowScrapper(AbstractScrapper):
+    """Third-party style scrapper implementing only the synchronous API"""
+    source_name = "Slow"
+    url_pattern = r"https://slow\.example/"
+
+    def fetchVariantList(self, url):
+        time.sleep(0.2)
+        return [url]
+
+    def fetchVariant(self, variant_index, material_data, reinstall=False):
+        # Blocks until the scrapper is cancelled
+        return not self._cancel_event.wait(5)
+
+@pytest.fixture
+def runner():
+    runner = AsyncRunner()
+    yield runner
+    runner.stop()
+
+@pytest.fixture
+def scrapper(tmp_path):
+    return SlowScrapper(config=Config(texture_dir=str(tmp_path)))
+
+def test_variant_lists_overlap(runner, tmp_path):
+    scrappers = [SlowScrapper(config=Config(texture_dir=str(tmp_path))) for _ in range(10)]
+    async def listAll():
+        return await asyncio.gather(*(s.fetchVariantListAsync("https://slow.example/{}".format(i))
+                                      for i, s in enumerate(scrappers)))
+    start_time = time.perf_counter()
+    variants = runner.run(listAll(), timeout=10)
+    assert variants == [["https://slow.example/{}".format(i)] for i in range(10)]
+    assert time.perf_counter() - start_time < 10 * 0.2
+
+def test_page_fetch_runs_on_scheduler(runner, scrapper):
+    threads = []
+    def fetchHtml(url):
+        threads.append(threading.current_thread().name)
+        return url
+    scrapper.fetchHtml = fetchHtml
+    assert runner.run(scrapper.fetchHtmlAsync("slow.example/page"), timeout=5) == "slow.example/page"
+    assert threads[0].startswith("LilyDownload")
+
+def test_cancel_queued_request(runner, scrapper):
+    calls = []
+    scrapper.fetchHtml = calls.append
+    scrapper.download_priority = PRIORITY_PREFETCH
+    scheduler = getDownloadScheduler()
+    scheduler.pause(PRIORITY_PREFETCH)
+    try:
+        future = runner.submit(scrapper.fetchHtmlAsync("https://slow.example/page"))
+        time.sleep(0.1)
+        future.cancel()
+        with pytest.raises(CancelledError):
+            future.result(5)
+        # The coroutine itself gets cancelled on the loop thread
+        time.sleep(0.2)
+    finally:
+        scheduler.resume()
+    time.sleep(0.2)
+    assert calls == []
+
+def test_cancel_running_call_cancels_scrapper(runner, scrapper):
+    future = runner.submit(scrapper.fetchVariantAsync(0, None))
+    time.sleep(0.1)
+    future.cancel()
+    assert scrapper._cancel_event.wait(5)
@@ -0,0 +1,34 @@
+import os
+import errno
+import hashlib
+
+from LilySurfaceScrapper.blobstore import BlobStore
+
+def writeMap(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_ingest_hard_links_duplicates(tmp_path):
+    store = BlobStore(str(tmp_path / "store"))
+    first, second = str(tmp_path / "a" / "Color.png"), str(tmp_path / "b" / "Color.png")
+    writeMap(first, b"color")
+    writeMap(second, b"color")
+    digest = hashlib.sha256(b"color").hexdigest()
+    assert store.ingest(first, digest) == store.blobPath(digest)
+    assert store.ingest(second, digest) == store.blobPath(digest)
+    assert os.path.samefile(first, second)
+    assert not os.path.islink(second)
+
+def test_files_that_cannot_be_hard_linked_are_kept(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "store"))
+    path = str(tmp_path / "a" / "Color.png")
+    writeMap(path, b"color")
+    def link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(os, "link", link)
+    assert store.ingest(path) is None
+    assert not os.path.islink(path)
+    with open(path, "rb") as f:
+        assert f.read() == b"color"
+    assert not os.path.exists(store.blobPath(hashlib.sha256(b"color").hexdigest()))
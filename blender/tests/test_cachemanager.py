@@ -0,0 +1,42 @@
+import os
+import time
+
+from LilySurfaceScrapper.cachemanager import CacheManager
+
+def makeVariant(root, name, maps, last_access):
+    variant_dir = os.path.join(root, *name.split("/"))
+    for filename, size in maps.items():
+        path = os.path.join(variant_dir, *filename.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+    cache_manager = CacheManager(root)
+    cache_manager.touch(variant_dir)
+    marker = os.path.join(variant_dir, ".lastaccess")
+    os.utime(marker, (last_access, last_access))
+    return variant_dir
+
+def test_variants_with_sub_directories_are_evicted_whole(tmp_path):
+    root = str(tmp_path)
+    now = time.time()
+    old = makeVariant(root, "cc0textures/Ground054/2K-JPG",
+                      {"Ground054_2K_Color.jpg": 1000, "sub/Ground054_2K_Normal.jpg": 1000}, now - 100)
+    recent = makeVariant(root, "cc0textures/Ground055/2K-JPG",
+                         {"Ground055_2K_Color.jpg": 1000, "sub/Ground055_2K_Normal.jpg": 1000}, now)
+    cache_manager = CacheManager(root)
+    assert sorted(entry.path for entry in cache_manager.scan()) == [old, recent]
+
+    evicted = cache_manager.enforceQuota(3000)
+    assert [entry.path for entry in evicted] == [old]
+    assert not os.path.exists(old)
+    assert os.path.isfile(os.path.join(recent, "sub", "Ground055_2K_Normal.jpg"))
+
+def test_map_in_sub_directory_pins_its_variant(tmp_path):
+    root = str(tmp_path)
+    now = time.time()
+    old = makeVariant(root, "cc0textures/Ground054/2K-JPG",
+                      {"Ground054_2K_Color.jpg": 1000, "sub/Ground054_2K_Normal.jpg": 1000}, now - 100)
+    recent = makeVariant(root, "cc0textures/Ground055/2K-JPG", {"Ground055_2K_Color.jpg": 1000}, now)
+    evicted = CacheManager(root).enforceQuota(0, pinned=[os.path.join(old, "sub", "Ground054_2K_Normal.jpg")])
+    assert [entry.path for entry in evicted] == [recent]
+    assert os.path.isdir(os.path.join(old, "sub"))
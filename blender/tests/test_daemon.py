@@ -0,0 +1,75 @@
+import threading
+from multiprocessing import Pipe
+from multiprocessing.connection import Listener
+
+from LilySurfaceScrapper import daemon
+from LilySurfaceScrapper.daemon import DaemonClient, WorkerDaemon, PROTOCOL_VERSION, ADDON_VERSION
+
+AUTHKEY = b"test"
+
+def fakeWorker(address, received, answer_hello=True):
+    """Worker answering hello like the current one, or ignoring it like
+    the ones older than it, and stopping on shutdown"""
+    listener = Listener(address, authkey=AUTHKEY)
+    def serve():
+        with listener:
+            while True:
+                with listener.accept() as connection:
+                    while True:
+                        try:
+                            message = connection.recv()
+                        except (OSError, EOFError):
+                            break
+                        received.append(message["type"])
+                        if message["type"] == "hello" and answer_hello:
+                            connection.send({"type": "hello", "id": message.get("id"), "pid": 2,
+                                             "protocol": PROTOCOL_VERSION, "version": ADDON_VERSION})
+                        elif message["type"] == "ping":
+                            connection.send({"type": "pong", "id": message.get("id"), "pid": 2 if answer_hello else 1})
+                        elif message["type"] == "shutdown":
+                            return
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+def test_worker_answers_hello_with_its_versions():
+    worker = WorkerDaemon(address=None, authkey=AUTHKEY)
+    client_end, worker_end = Pipe()
+    thread = threading.Thread(target=worker._serve, args=(worker_end,), daemon=True)
+    thread.start()
+    client_end.send({"type": "hello", "id": 1, "protocol": PROTOCOL_VERSION, "version": ADDON_VERSION})
+    assert client_end.poll(2)
+    answer = client_end.recv()
+    assert answer["type"] == "hello" and answer["id"] == 1
+    assert answer["protocol"] == PROTOCOL_VERSION
+    assert answer["version"] == ADDON_VERSION
+    client_end.close()
+    thread.join(2)
+
+def test_client_restarts_worker_of_another_version(tmp_path, monkeypatch):
+    address = str(tmp_path / "daemon.sock")
+    monkeypatch.setattr(daemon, "getAuthKey", lambda: AUTHKEY)
+    old_received = []
+    old_worker = fakeWorker(address, old_received, answer_hello=False)
+
+    new_received = []
+    client = DaemonClient(address=address)
+    monkeypatch.setattr(client, "startDaemon", lambda: fakeWorker(address, new_received))
+    assert client.ping() == 2
+    assert old_received == ["hello", "ping", "shutdown"]
+    old_worker.join(2)
+    assert not old_worker.is_alive()
+    assert new_received[:2] == ["hello", "ping"]
+
+def test_client_keeps_worker_of_same_version(tmp_path, monkeypatch):
+    address = str(tmp_path / "daemon.sock")
+    monkeypatch.setattr(daemon, "getAuthKey", lambda: AUTHKEY)
+    received = []
+    fakeWorker(address, received)
+
+    client = DaemonClient(address=address)
+    def startDaemon():
+        raise AssertionError("the worker should be reused")
+    monkeypatch.setattr(client, "startDaemon", startDaemon)
+    assert client.ping() == 2
+    assert received == ["hello", "ping", "ping"]
@@ -0,0 +1,46 @@
+import os
+import threading
+
+from LilySurfaceScrapper.filelock import DirectoryLock, holdsLock, isLocked, LOCK_FILENAME, BREAK_SUFFIX
+
+def test_release_waits_for_break_lock_without_blocking_other_threads(tmp_path):
+    directory = str(tmp_path / "variant")
+    other_directory = str(tmp_path / "other")
+    acquired = threading.Event()
+    release = threading.Event()
+    def holdThenRelease():
+        with DirectoryLock(directory):
+            acquired.set()
+            release.wait()
+    releaser = threading.Thread(target=holdThenRelease)
+    releaser.start()
+    assert acquired.wait(2)
+
+    # Another process is breaking a lock, the release must wait for it
+    break_path = os.path.join(directory, LOCK_FILENAME) + BREAK_SUFFIX
+    open(break_path, "w").close()
+    try:
+        release.set()
+        releaser.join(0.2)
+        assert releaser.is_alive()
+
+        # Meanwhile other threads still get their locks
+        taken = threading.Event()
+        def takeOther():
+            with DirectoryLock(other_directory):
+                taken.set()
+        other = threading.Thread(target=takeOther)
+        other.start()
+        other.join(2)
+        assert taken.is_set()
+
+        # The lock being released is neither stale nor available
+        assert isLocked(directory)
+        assert not holdsLock(directory)
+    finally:
+        os.remove(break_path)
+    releaser.join(2)
+    assert not releaser.is_alive()
+    assert not os.path.exists(os.path.join(directory, LOCK_FILENAME))
+    with DirectoryLock(directory):
+        assert holdsLock(directory)
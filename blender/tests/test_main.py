@@ -0,0 +1,19 @@
+from LilySurfaceScrapper.__main__ import FetchItem
+
+def test_parse_keeps_fragment_of_ies_urls():
+    item = FetchItem.parse("https://ieslibrary.com/en/browse#ies-1a2b3c")
+    assert item.url == "https://ieslibrary.com/en/browse#ies-1a2b3c"
+    assert item.variants is None
+
+    item = FetchItem.parse("https://ieslibrary.com/en/browse#ies-1a2b3c#Lumcat-1")
+    assert item.url == "https://ieslibrary.com/en/browse#ies-1a2b3c"
+    assert item.variants == ["Lumcat-1"]
+
+def test_parse_reads_variant_after_url():
+    item = FetchItem.parse("https://cc0textures.com/view?id=Ground023#2K-JPG")
+    assert item.url == "https://cc0textures.com/view?id=Ground023"
+    assert item.variants == ["2K-JPG"]
+
+    item = FetchItem.parse("https://hdrihaven.com/hdri/?h=the_lost_city")
+    assert item.url == "https://hdrihaven.com/hdri/?h=the_lost_city"
+    assert item.variants is None
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+from LilySurfaceScrapper import manifest
+from LilySurfaceScrapper.filelock import DirectoryLock
+from LilySurfaceScrapper.scheduler import getDownloadScheduler
+
+class MapHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def server_url():
+    server = Server(("127.0.0.1", 0), MapHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+def test_repairs_do_not_hold_slots_while_waiting_for_a_variant(tmp_path, server_url):
+    variant_dir = str(tmp_path / "cc0textures" / "Ground054" / "2K-JPG")
+    os.makedirs(variant_dir)
+    # More missing maps than the scheduler has slots, from the host of the variant
+    scheduler = getDownloadScheduler()
+    for i in range(scheduler.max_active + 2):
+        body = "/map{}.png".format(i).encode("utf-8")
+        manifest.updateManifest(variant_dir, "map{}.png".format(i), server_url + "/map{}.png".format(i),
+                                len(body), hashlib.sha256(body).hexdigest())
+    checked, broken = manifest.verifyCache(str(tmp_path))
+    assert checked == len(broken) == scheduler.max_active + 2
+
+    locked = threading.Event()
+    release = threading.Event()
+    holder_got_slots = []
+    def downloadVariant():
+        # Like fetchImages, holding the variant lock while waiting for slots of its host
+        with DirectoryLock(variant_dir):
+            locked.set()
+            release.wait(10)
+            futures = [scheduler.submit(server_url, lambda: True) for _ in range(scheduler.max_active)]
+            holder_got_slots.extend(future.result(5) for future in futures)
+    holder = threading.Thread(target=downloadVariant)
+    holder.start()
+    locked.wait(5)
+
+    repaired = []
+    repairer = threading.Thread(target=lambda: repaired.append(manifest.repairFiles(broken)))
+    repairer.start()
+    release.set()
+    holder.join(10)
+    assert holder_got_slots == [True] * scheduler.max_active
+    repairer.join(10)
+    assert repaired == [len(broken)]
+    assert manifest.verifyCache(str(tmp_path))[1] == []
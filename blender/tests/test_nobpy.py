@@ -0,0 +1,44 @@
+import os
+import sys
+import importlib
+
+import pytest
+
+SCRAPPERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "LilySurfaceScrapper", "Scrappers")
+SCRAPPER_MODULES = sorted(f[:-3] for f in os.listdir(SCRAPPERS_DIR) if f.endswith(".py"))
+
+@pytest.fixture
+def nobpy(monkeypatch):
+    """Import the add-on afresh from modules in which Blender is missing"""
+    for name in ("bpy", "bpy_extras", "mathutils"):
+        # A None entry makes the import raise ImportError
+        monkeypatch.setitem(sys.modules, name, None)
+    for name in list(sys.modules):
+        if name == "LilySurfaceScrapper" or name.startswith("LilySurfaceScrapper."):
+            monkeypatch.delitem(sys.modules, name)
+    return importlib.import_module
+
+def test_config_without_bpy(nobpy):
+    config = nobpy("LilySurfaceScrapper.config")
+    with pytest.raises(RuntimeError):
+        config.getConfig()
+    settings = config.Config(texture_dir="/textures")
+    config.setConfig(settings)
+    assert config.getConfig() is settings
+
+@pytest.mark.parametrize("module_name", SCRAPPER_MODULES)
+def test_scrapper_imports_and_reads_config_without_bpy(nobpy, module_name, tmp_path):
+    module = nobpy("LilySurfaceScrapper.Scrappers." + module_name)
+    abstract = nobpy("LilySurfaceScrapper.Scrappers.AbstractScrapper").AbstractScrapper
+    config = nobpy("LilySurfaceScrapper.config")
+    texture_dir = str(tmp_path / "textures")
+    settings = config.Config(texture_dir=texture_dir)
+    config.setConfig(settings)
+
+    scrappers = [x for x in vars(module).values()
+                 if isinstance(x, type) and issubclass(x, abstract) and x.__module__ == module.__name__]
+    assert scrappers
+    for S in scrappers:
+        scrapper = S(texture_root=str(tmp_path))
+        assert scrapper.getConfig() is settings
+        assert scrapper.getTextureDirectory("name") == os.path.join(texture_dir, "name")
@@ -0,0 +1,38 @@
+import json
+
+from LilySurfaceScrapper.prefetch import PrefetchBudget
+
+def readBudget(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def test_charges_are_written_by_threshold_and_flush(tmp_path):
+    path = str(tmp_path / "prefetched.json")
+    budget = PrefetchBudget(path, flush_bytes=10 * 1024 * 1024, flush_interval=3600)
+    writes = []
+    save = budget._save
+    def countingSave():
+        writes.append(1)
+        save()
+    budget._save = countingSave
+
+    # Metered downloads charge about 1 MiB at a time
+    for _ in range(25):
+        spent = budget.charge("variant", 1024 * 1024)
+    assert spent == 25 * 1024 * 1024
+    assert len(writes) == 2
+    assert readBudget(path) == {"variant": 20 * 1024 * 1024}
+
+    budget.flush()
+    assert len(writes) == 3
+    assert readBudget(path) == {"variant": 25 * 1024 * 1024}
+
+    # Nothing left to write
+    budget.flush()
+    assert len(writes) == 3
+
+def test_charges_are_written_after_interval(tmp_path):
+    path = str(tmp_path / "prefetched.json")
+    budget = PrefetchBudget(path, flush_bytes=float("inf"), flush_interval=0)
+    budget.charge("variant", 1024)
+    assert readBudget(path) == {"variant": 1024}
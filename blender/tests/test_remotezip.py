@@ -0,0 +1,121 @@
+import io
+import os
+import re
+import time
+import zipfile
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+from LilySurfaceScrapper.remotezip import RemoteZip, RemoteZipError, RangeNotSupported
+
+MEMBERS = {
+    "Ground_Color.jpg": os.urandom(3000000),
+    "Ground_Normal.png": b"n" * 2000000,
+    "Ground_Preview.png": os.urandom(20000000),
+    "sub/Ground_Roughness.jpg": b"r" * 1000,
+}
+
+def makeArchive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in MEMBERS.items():
+            z.writestr(name, data)
+    return buffer.getvalue()
+
+ARCHIVE = makeArchive()
+with zipfile.ZipFile(io.BytesIO(ARCHIVE)) as z:
+    OFFSETS = {info.filename: info.header_offset for info in z.infolist()}
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    """Serve ARCHIVE, honoring Range requests if ranges is True"""
+    protocol_version = "HTTP/1.1"
+    ranges = True
+    # Offsets of the ranges to answer with a 404, and to send slowly
+    failing = ()
+    slow = ()
+    sent = 0
+
+    def do_GET(self):
+        body, status, headers = ARCHIVE, 200, {}
+        match = re.match(r"bytes=(-?\d*)-?(\d*)", self.headers.get("Range", ""))
+        if match and self.ranges:
+            first, last = match.groups()
+            if first.startswith("-"):
+                start, end = len(ARCHIVE) + int(first), len(ARCHIVE)
+            else:
+                start, end = int(first), int(last) + 1 if last else len(ARCHIVE)
+            if start in self.failing:
+                body, status = b"", 404
+            else:
+                body, status = ARCHIVE[start:end], 206
+                headers["Content-Range"] = "bytes {}-{}/{}".format(start, end - 1, len(ARCHIVE))
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        delay = 0.05 if status == 206 and start in self.slow else 0
+        try:
+            for i in range(0, len(body), 65536):
+                self.wfile.write(body[i:i + 65536])
+                type(self).sent += len(body[i:i + 65536])
+                time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def serve():
+    servers = []
+    def serve(**attributes):
+        handler = type("Handler", (ArchiveHandler,), attributes)
+        server = Server(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://127.0.0.1:{}/textures.zip".format(server.server_address[1]), handler
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_extract_members_with_ranges(serve, tmp_path):
+    url, handler = serve()
+    archive = RemoteZip(url)
+    assert sorted(archive.namelist()) == sorted(MEMBERS)
+    wanted = ["Ground_Color.jpg", "Ground_Normal.png", "sub/Ground_Roughness.jpg"]
+    archive.extractMembers(wanted, str(tmp_path))
+    for name in wanted:
+        path = os.path.join(str(tmp_path), *name.split("/"))
+        with open(path, "rb") as f:
+            assert f.read() == MEMBERS[name]
+        assert not archive.isModified(name, path)
+    assert not os.path.exists(os.path.join(str(tmp_path), "Ground_Preview.png"))
+    # The preview makes most of the archive and was not transferred
+    assert handler.sent < len(ARCHIVE) / 2
+
+def test_server_ignoring_ranges(serve):
+    url, handler = serve(ranges=False)
+    with pytest.raises(RangeNotSupported):
+        RemoteZip(url)
+    time.sleep(0.5)
+    # The response was closed instead of reading the whole archive
+    assert handler.sent < len(ARCHIVE) / 2
+
+def test_failed_member_stops_the_others(serve, tmp_path):
+    url, handler = serve(failing=(OFFSETS["Ground_Color.jpg"],), slow=(OFFSETS["Ground_Normal.png"],))
+    archive = RemoteZip(url)
+    start_time = time.perf_counter()
+    with pytest.raises(RemoteZipError):
+        archive.extractMembers(["Ground_Normal.png", "Ground_Color.jpg"], str(tmp_path))
+    # The slow member would take 1.6 s, it got stopped and is over
+    assert time.perf_counter() - start_time < 1
+    time.sleep(0.3)
+    assert os.listdir(str(tmp_path)) == []